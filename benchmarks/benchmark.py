@@ -0,0 +1,295 @@
+"""Benchmarks of FastIR Artifacts enumeration, archiving and hashing throughput.
+
+Synthetic trees (and ext4 images built from them with mke2fs, without root
+privileges) are generated in a temporary directory, and results are written
+as JSON so that releases can be compared:
+
+    python benchmarks/benchmark.py --files 5000 --depth 4 --size 16K -o results.json
+
+The NTFS metadata index cannot be measured on ext4 images, an existing NTFS
+image can be given with --ntfs-image.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import subprocess
+from tempfile import mkdtemp
+from statistics import median
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastir.common.file_info import FileInfo  # noqa: E402
+from fastir.common.output import Outputs, parse_human_size  # noqa: E402
+from fastir.common.filesystem import OSFileSystem, TSKFileSystem  # noqa: E402
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+class NullOutput:
+    """Output counting collected files, without reading them"""
+
+    deadline = None
+
+    def __init__(self):
+        self.files = 0
+
+    @contextmanager
+    def read_once(self, path_object):
+        yield
+
+    def add_collected_file(self, artifact, path_object):
+        self.files += 1
+
+    def add_collected_file_info(self, artifact, path_object):
+        self.files += 1
+
+
+def generate_tree(root, files, depth, fanout, size, seed=0):
+    """Create files spread over directories of the given depth, return the list of file paths"""
+    rng = random.Random(seed)
+
+    directories = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(parent, f'dir{i}') for parent in level for i in range(fanout)]
+        directories += level
+
+    for directory in directories:
+        os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    content = os.urandom(size)
+    for i in range(files):
+        path = os.path.join(rng.choice(directories), f'file{i}.{rng.choice(["dll", "exe", "log", "txt"])}')
+
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        paths.append(path)
+
+    return paths
+
+
+def make_ext4_image(tree, image, files, size):
+    """Build an ext4 image holding the tree, return None when mke2fs is not available"""
+    mke2fs = shutil.which('mke2fs') or shutil.which('/sbin/mke2fs') or shutil.which('/usr/sbin/mke2fs')
+
+    if mke2fs is None:
+        return None
+
+    image_size = max(16 * 1024, (files * (size + 4096) * 2) // 1024)
+    subprocess.check_output(
+        [mke2fs, '-q', '-F', '-t', 'ext4', '-N', str(files * 2 + 1024), '-d', tree, image, f'{image_size}k'],
+        stderr=subprocess.STDOUT)
+
+    return image
+
+
+def timed(function, repeat):
+    """Run function repeat times, return the median duration and the last result"""
+    durations = []
+    result = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+
+    return median(durations), result
+
+
+def throughput(seconds, items, size=None):
+    result = {
+        'seconds': round(seconds, 6),
+        'items': items,
+        'items_per_second': round(items / seconds, 1) if seconds else None
+    }
+
+    if size is not None:
+        result['bytes'] = size
+        result['bytes_per_second'] = round(size / seconds, 1) if seconds else None
+
+    return result
+
+
+def bench_pattern_resolution(name, filesystem_factory, patterns, repeat):
+    def run():
+        filesystem = filesystem_factory()
+        output = NullOutput()
+
+        for pattern in patterns:
+            filesystem.add_pattern('Benchmark', pattern)
+
+        filesystem.collect(output)
+
+        return output.files
+
+    seconds, files = timed(run, repeat)
+    log(f"{name}: {files} paths resolved in {seconds:.3f}s")
+
+    return throughput(seconds, files)
+
+
+def bench_indexed_resolution(name, image, patterns, repeat):
+    """Pattern resolution with the metadata index, skipped when the filesystem cannot be indexed"""
+    if not TSKFileSystem(None, image, '/', index=True)._use_index:
+        log(f"{name}: skipped, the metadata index is not supported on this filesystem")
+
+        return {'skipped': 'metadata index not supported on this filesystem, directories would be walked'}
+
+    return bench_pattern_resolution(name, lambda: TSKFileSystem(None, image, '/', index=True), patterns, repeat)
+
+
+def bench_listing(name, filesystem_factory, repeat):
+    def run():
+        filesystem = filesystem_factory()
+        pending = [next(filesystem._base_generator())]
+        entries = 0
+
+        while pending:
+            directory = pending.pop()
+
+            for entry in directory.list_directory():
+                entries += 1
+
+                if entry.is_directory():
+                    pending.append(entry)
+
+        return entries
+
+    seconds, entries = timed(run, repeat)
+    log(f"{name}: {entries} entries listed in {seconds:.3f}s")
+
+    return throughput(seconds, entries)
+
+
+def bench_archive(name, paths, workdir, repeat, sha256=False, compression_workers=1):
+    filesystem = OSFileSystem('/')
+    size = sum(os.path.getsize(path) for path in paths)
+    runs = iter(range(repeat))
+
+    def run():
+        output = Outputs(
+            os.path.join(workdir, f'{name}{next(runs)}'), None, sha256, compression_workers=compression_workers)
+
+        for path in paths:
+            output.add_collected_file('Benchmark', filesystem.get_fullpath(path))
+
+        output.close()
+
+    seconds, _ = timed(run, repeat)
+    log(f"{name}: {len(paths)} files archived in {seconds:.3f}s")
+
+    return throughput(seconds, len(paths), size)
+
+
+def bench_hashing(paths, repeat):
+    filesystem = OSFileSystem('/')
+    size = sum(os.path.getsize(path) for path in paths)
+
+    def run():
+        for path in paths:
+            FileInfo(filesystem.get_fullpath(path)).compute()
+
+    seconds, _ = timed(run, repeat)
+    log(f"FileInfo.compute: {len(paths)} files hashed in {seconds:.3f}s")
+
+    return throughput(seconds, len(paths), size)
+
+
+def run_benchmarks(arguments, workdir):
+    tree = os.path.join(workdir, 'tree')
+    size = parse_human_size(arguments.size)
+
+    log(f"Generating {arguments.files} files of {size} bytes ...")
+    paths = generate_tree(tree, arguments.files, arguments.depth, arguments.fanout, size)
+
+    patterns = [os.path.join(tree, '**10', '*.dll'), os.path.join(tree, '**10', '*.exe')]
+    results = {
+        'pattern_resolution_os': bench_pattern_resolution(
+            'OSFileSystem.collect', lambda: OSFileSystem(tree), patterns, arguments.repeat),
+        'listing_os': bench_listing('OSFileSystem listing', lambda: OSFileSystem(tree), arguments.repeat),
+        'archive': bench_archive('archive', paths, workdir, arguments.repeat),
+        'archive_sha256': bench_archive('archive_sha256', paths, workdir, arguments.repeat, sha256=True),
+        'file_info': bench_hashing(paths, arguments.repeat)
+    }
+
+    if arguments.compression_workers > 1:
+        results['archive_parallel_compression'] = bench_archive(
+            'archive_parallel_compression', paths, workdir, arguments.repeat,
+            compression_workers=arguments.compression_workers)
+
+    image = make_ext4_image(tree, os.path.join(workdir, 'image.ext4'), arguments.files, size)
+    tsk_patterns = ['/**10/*.dll', '/**10/*.exe']
+
+    if image:
+        results['pattern_resolution_tsk'] = bench_pattern_resolution(
+            'TSKFileSystem.collect', lambda: TSKFileSystem(None, image, '/'), tsk_patterns, arguments.repeat)
+        results['pattern_resolution_tsk_index'] = bench_indexed_resolution(
+            'TSKFileSystem.collect (index)', image, tsk_patterns, arguments.repeat)
+        results['listing_tsk'] = bench_listing(
+            'TSKFileSystem listing', lambda: TSKFileSystem(None, image, '/'), arguments.repeat)
+    else:
+        log("mke2fs not found, TSKFileSystem benchmarks are skipped")
+
+    if arguments.ntfs_image:
+        ntfs_image = arguments.ntfs_image
+        results['pattern_resolution_ntfs'] = bench_pattern_resolution(
+            'TSKFileSystem.collect (NTFS)', lambda: TSKFileSystem(None, ntfs_image, '/'), tsk_patterns,
+            arguments.repeat)
+        results['pattern_resolution_ntfs_index'] = bench_indexed_resolution(
+            'TSKFileSystem.collect (NTFS, index)', ntfs_image, tsk_patterns, arguments.repeat)
+
+    return results
+
+
+def main(arguments):
+    workdir = mkdtemp(dir=arguments.workdir)
+
+    try:
+        results = run_benchmarks(arguments, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'files': arguments.files,
+            'depth': arguments.depth,
+            'fanout': arguments.fanout,
+            'size': parse_human_size(arguments.size),
+            'repeat': arguments.repeat
+        },
+        'results': results
+    }
+
+    with open(arguments.output, 'w') as out:
+        json.dump(report, out, indent=2)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FastIR Artifacts benchmarks')
+    parser.add_argument('--files', help='Number of generated files', type=int, default=2000)
+    parser.add_argument('--depth', help='Depth of the generated tree', type=int, default=3)
+    parser.add_argument('--fanout', help='Number of subdirectories per directory', type=int, default=4)
+    parser.add_argument('--size', help='Size of each generated file', default='16K')
+    parser.add_argument('--repeat', help='Number of runs of each benchmark (the median is kept)', type=int, default=3)
+    parser.add_argument(
+        '--compression-workers', help='Also benchmark archiving with n compression threads', type=int, default=1)
+    parser.add_argument('--ntfs-image', help='NTFS image on which the metadata index is also benchmarked')
+    parser.add_argument('--workdir', help='Directory where synthetic data is generated')
+    parser.add_argument('-o', '--output', help='JSON results file', default='benchmark-results.json')
+
+    main(parser.parse_args())
@@ -0,0 +1,196 @@
+import sys
+import time
+import zlib
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .governor import governor
+from .logging import logger
+from .metrics import metrics
+
+
+# Compressed blocks are independent: bigger blocks compress better, smaller blocks parallelize better
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+DEFLATE_WINDOW_SIZE = 32 * 1024
+
+# CPython versions (from, to excluded) checked to compress zip members through their
+# `_compressor` attribute, which is replaced to compress members in parallel
+PARALLEL_COMPRESSION_VERSIONS = ((3, 6), (3, 14))
+
+
+def parallel_compression_supported(member=None):
+    """Whether zip members can be compressed by a ParallelCompressor.
+
+    The zipfile module has no public API to plug a compressor: its internals are
+    only relied on with the versions they were checked with. Members are
+    compressed by the zipfile module itself otherwise.
+    """
+    first, last = PARALLEL_COMPRESSION_VERSIONS
+
+    if sys.implementation.name != 'cpython' or not first <= sys.version_info[:2] < last:
+        return False
+
+    return member is None or hasattr(member, '_compressor')
+
+
+def compress_block(data, level, zdict):
+    """Compress a block as raw deflate data that can be concatenated with the following blocks"""
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    start = time.monotonic()
+
+    # A sync flush ends the data on a byte boundary without marking the last block
+    with governor.cpu('compression'):
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    metrics.stage_time('compress', busy=time.monotonic() - start)
+
+    return compressed
+
+
+class ParallelCompressor:
+    """Deflate compressor running on a thread pool (zlib releases the GIL).
+
+    Data is split into blocks compressed independently, each one primed with the
+    end of the previous block as dictionary. Compressed blocks are returned in
+    order, once more than `window` blocks are in flight.
+    """
+
+    def __init__(self, executor, level, window):
+        self._executor = executor
+        self._level = level
+        self._window = window
+
+        self._pending = deque()
+        self._previous = None
+
+    def _collect(self, window):
+        output = []
+
+        while len(self._pending) > window:
+            output.append(self._pending.popleft().result())
+
+        return b''.join(output)
+
+    def compress(self, data):
+        data = memoryview(data)
+
+        for offset in range(0, len(data), COMPRESSION_BLOCK_SIZE):
+            block = data[offset:offset + COMPRESSION_BLOCK_SIZE]
+            zdict = bytes(self._previous[-DEFLATE_WINDOW_SIZE:]) if self._previous is not None else None
+
+            self._pending.append(self._executor.submit(compress_block, block, self._level, zdict))
+            self._previous = block
+
+        return self._collect(self._window)
+
+    def flush(self):
+        output = self._collect(0)
+
+        # Terminate the deflate stream with an empty final block
+        return output + zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+
+class Archive:
+    """Zip archive of collected files, with a constant-time index of its members.
+
+    When several compression workers are used, members are compressed in parallel
+    while being written by the calling thread only, in order.
+
+    The archive is written to a path or a file object, that stays open when the
+    archive is closed. Unseekable files (streams) are supported, but members
+    cannot be discarded from them.
+    """
+
+    def __init__(self, file, compression_level=zlib.Z_DEFAULT_COMPRESSION, compression_workers=1):
+        # The compression level can only be set since Python 3.7
+        options = {'compresslevel': compression_level} if sys.version_info >= (3, 7) else {}
+
+        self._zip = zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED, **options)
+        self._seekable = isinstance(file, str) or file.seekable()
+        self._names = set()
+        self._last = None
+
+        self._compression_level = compression_level
+        self._executor = None
+
+        if compression_workers > 1:
+            if parallel_compression_supported():
+                self._executor = ThreadPoolExecutor(compression_workers, thread_name_prefix='compression')
+            else:
+                logger.warning(
+                    f"Members cannot be compressed in parallel with Python {sys.version.split()[0]}, "
+                    "using a single compression thread")
+                compression_workers = 1
+
+        self._compression_workers = max(compression_workers, 1)
+        metrics.stage_workers('compress', self._compression_workers)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def open(self, name):
+        """Open a new member, to be written chunk by chunk and closed before opening another one"""
+        # Partially written members stay in the archive when reading fails
+        self._names.add(name)
+        self._last = name
+
+        member = self._zip.open(name, mode='w', force_zip64=True)
+
+        # The zip file still computes CRC and sizes, and writes headers
+        if self._executor and parallel_compression_supported(member):
+            member._compressor = ParallelCompressor(
+                self._executor, self._compression_level, 2 * self._compression_workers)
+
+        return member
+
+    def _last_info(self):
+        # Members are only listed once closed
+        return self._zip.getinfo(self._last)
+
+    def write(self, name, chunks):
+        """Write a member from an iterable of chunks, and return its size"""
+        with self.open(name) as member:
+            for chunk in chunks:
+                member.write(chunk)
+
+        return self._last_info().file_size
+
+    def size(self):
+        """Size of the archive up to the end of its last closed member"""
+        return self._zip.start_dir
+
+    def last_compressed_size(self):
+        """Size of the last written member in the archive"""
+        return self._last_info().compress_size if self._last else 0
+
+    def can_discard(self):
+        return self._last is not None and self._seekable
+
+    def discard_last(self):
+        """Remove the last written member, by truncating the archive at its header"""
+        zinfo = self._last_info()
+        self._last = None
+
+        self._zip.filelist.remove(zinfo)
+        del self._zip.NameToInfo[zinfo.filename]
+        self._names.discard(zinfo.filename)
+
+        self._zip.fp.seek(zinfo.header_offset)
+        self._zip.fp.truncate()
+        self._zip.start_dir = zinfo.header_offset
+
+    def close(self):
+        self._zip.close()
+
+        if self._executor:
+            self._executor.shutdown()
+
+        metrics.stage_workers_done('compress', self._compression_workers)
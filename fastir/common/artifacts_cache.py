@@ -0,0 +1,168 @@
+import os
+import glob
+import json
+import hashlib
+
+import artifacts
+import artifacts.errors
+import artifacts.reader
+
+from .logging import logger
+
+
+# Changed when the format of cached definitions changes
+CACHE_VERSION = 1
+LIBRARY_VERSION = getattr(artifacts, '__version__', None)
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def definition_files(directory):
+    """Definition files read from a directory, as the artifacts registry finds them"""
+    return sorted(glob.glob(os.path.join(directory, '*.yaml')))
+
+
+class ArtifactsCache:
+    """Artifact sources selected by previous runs, to avoid parsing YAML definitions at startup.
+
+    Selections (after group resolution and platform filtering) are keyed by the options
+    they depend on. The cache is only used while definition files are the same: files with
+    the same size and modification time are trusted, others are compared by SHA-256, so that
+    a cache shipped with a release stays valid once extracted. Paths are not part of the
+    fingerprint, for the same reason.
+    """
+
+    def __init__(self, path, directories):
+        self.path = path
+
+        self._directories = directories
+        self._selections = {}
+        self._files = None
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data['version'] != CACHE_VERSION or data['library'] != LIBRARY_VERSION:
+                logger.info(f"Ignoring artifacts cache '{self.path}' built by another version")
+            elif not self._fingerprint_matches(data['files']):
+                logger.info(f"Ignoring artifacts cache '{self.path}', definitions changed")
+            else:
+                self._files = data['files']
+                self._selections = data['selections']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Could not load artifacts cache '{self.path}': {str(e)}")
+
+    def _fingerprint_matches(self, cached_files):
+        if len(cached_files) != len(self._directories):
+            return False
+
+        for directory, files in zip(self._directories, cached_files):
+            paths = definition_files(directory)
+
+            if sorted(files) != [os.path.basename(path) for path in paths]:
+                return False
+
+            for path in paths:
+                size, mtime, sha256 = files[os.path.basename(path)]
+                stat = os.stat(path)
+
+                if stat.st_size != size:
+                    return False
+
+                if stat.st_mtime_ns != mtime and file_sha256(path) != sha256:
+                    return False
+
+        return True
+
+    def _fingerprint(self):
+        cached_files = []
+
+        for directory in self._directories:
+            files = {}
+
+            for path in definition_files(directory):
+                stat = os.stat(path)
+                files[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns, file_sha256(path)]
+
+            cached_files.append(files)
+
+        return cached_files
+
+    @staticmethod
+    def key(parameters):
+        return json.dumps(parameters, sort_keys=True)
+
+    def get(self, parameters):
+        """(definition, source) pairs selected with these parameters, None on a miss"""
+        selection = self._selections.get(self.key(parameters))
+
+        if selection is None:
+            return None
+
+        reader = artifacts.reader.YamlArtifactsReader()
+        pairs = []
+
+        try:
+            for entry in selection:
+                artifact_definition = reader.ReadArtifactDefinitionValues(entry['definition'])
+
+                if entry.get('labels'):
+                    artifact_definition.labels = entry['labels']
+
+                for index in entry['sources']:
+                    pairs.append((artifact_definition, artifact_definition.sources[index]))
+        except (artifacts.errors.FormatError, KeyError, IndexError) as e:
+            logger.warning(f"Could not read artifacts cache '{self.path}': {str(e)}")
+            return None
+
+        return pairs
+
+    def set(self, parameters, pairs):
+        selection = []
+
+        for artifact_definition, artifact_source in pairs:
+            if not selection or selection[-1]['name'] != artifact_definition.name:
+                selection.append({
+                    'name': artifact_definition.name,
+                    'definition': artifact_definition.AsDict(),
+                    'labels': getattr(artifact_definition, 'labels', None),
+                    'sources': []
+                })
+
+            selection[-1]['sources'].append(artifact_definition.sources.index(artifact_source))
+
+        self._selections[self.key(parameters)] = selection
+
+    def save(self):
+        # Definitions are only fingerprinted when the cache is (re)built
+        if self._files is None:
+            self._files = self._fingerprint()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Replace the cache atomically so that an interrupted run does not corrupt it
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': CACHE_VERSION,
+                'library': LIBRARY_VERSION,
+                'files': self._files,
+                'selections': self._selections
+            }, f)
+        os.replace(tmp_path, self.path)
@@ -1,6 +1,28 @@
+import time
+
 import artifacts
 
+from fastir.common.governor import governor
+from fastir.common.memory import memory
+from fastir.common.metrics import metrics
 from fastir.common.logging import logger, PROGRESS
+from fastir.common.source_types import FILE_INFO_TYPE
+
+
+# Source types handled by each collector, in collection order
+COLLECTOR_TYPES = {
+    'filesystem': [
+        artifacts.definitions.TYPE_INDICATOR_FILE, artifacts.definitions.TYPE_INDICATOR_PATH, FILE_INFO_TYPE],
+    'commands': [artifacts.definitions.TYPE_INDICATOR_COMMAND],
+    'wmi': [artifacts.definitions.TYPE_INDICATOR_WMI_QUERY],
+    'registry': [
+        artifacts.definitions.TYPE_INDICATOR_WINDOWS_REGISTRY_KEY,
+        artifacts.definitions.TYPE_INDICATOR_WINDOWS_REGISTRY_VALUE]
+}
+WINDOWS_COLLECTORS = ['wmi', 'registry']
+
+# Collectors created once and collected once per priority, so that filesystems are only opened once
+SHARED_COLLECTORS = ['filesystem']
 
 
 class AbstractCollector:
@@ -10,46 +32,138 @@ class AbstractCollector:
     def register_source(self, artifact_definition, artifact_source, variables):
         raise NotImplementedError
 
+    def plan(self, planner):
+        """Report the sources that would be collected to a Planner, without collecting them"""
+        raise NotImplementedError
+
+
+def get_priority(artifact_definition, priorities):
+    """Priority of an artifact, from its name or labels (the highest one wins)"""
+    names = [artifact_definition.name] + list(getattr(artifact_definition, 'labels', None) or [])
+    matching = [priorities[name] for name in names if name in priorities]
+
+    return max(matching) if matching else 0
+
+
+def get_read_options(artifact_definition, read_options):
+    """Options to read only a part of the files of an artifact, from its labels and name (the name wins)"""
+    options = {}
+
+    for name in list(getattr(artifact_definition, 'labels', None) or []) + [artifact_definition.name]:
+        options.update(read_options.get(name, {}))
+
+    return options
+
 
 class Collector:
-    def __init__(self, platform):
+    def __init__(self, platform, workers=1, tsk_options=None, command_options=None, deadline=None, priorities=None,
+                 read_workers=1, read_options=None):
         self._platform = platform
         self._variables = None
         self._sources = 0
 
-        from fastir.common.commands import CommandExecutor
-        from fastir.common.filesystem import FileSystemManager
-        self._collectors = [FileSystemManager(), CommandExecutor()]
+        self._workers = workers
+        self._read_workers = read_workers
+        self._tsk_options = tsk_options
+        self._command_options = command_options or {}
+        self._read_options = read_options
+
+        # With a deadline, sources are collected by decreasing priority, each priority having its own collectors
+        self._deadline = deadline
+        self._priorities = priorities or {}
+        self._collectors = {}
+        self._shared_collectors = {}
 
         if platform == 'Windows':
             from fastir.windows.variables import WindowsHostVariables
             self._variables = WindowsHostVariables()
-
-            from fastir.windows.wmi import WMIExecutor
-            from fastir.windows.registry import RegistryCollector
-            self._collectors.append(WMIExecutor())
-            self._collectors.append(RegistryCollector())
         else:
             from fastir.unix.variables import UnixHostVariables
             self._variables = UnixHostVariables()
 
-    def register_source(self, artifact_definition, artifact_source):
-        supported = False
+    def _create_collector(self, name):
+        # Backends (pytsk3, win32com, ...) are only imported when a selected source needs them
+        if name == 'filesystem':
+            from fastir.common.filesystem import FileSystemManager
+            return FileSystemManager(
+                self._workers, self._tsk_options, self._read_workers, self._read_options,
+                self._priorities if self._deadline else None)
+        elif name == 'commands':
+            from fastir.common.commands import CommandExecutor
+            return CommandExecutor(**self._command_options)
+        elif name == 'wmi':
+            from fastir.windows.wmi import WMIExecutor
+            return WMIExecutor()
+        elif name == 'registry':
+            from fastir.windows.registry import RegistryCollector
+            return RegistryCollector()
+
+    def _get_collector(self, artifact_definition, artifact_source):
+        name = next(
+            (name for name, types in COLLECTOR_TYPES.items() if artifact_source.type_indicator in types), None)
+
+        if name is None or (name in WINDOWS_COLLECTORS and self._platform != 'Windows'):
+            return None
 
-        for collector in self._collectors:
-            if collector.register_source(artifact_definition, artifact_source, self._variables):
-                supported = True
+        priority = get_priority(artifact_definition, self._priorities) if self._deadline else 0
+        collectors = self._collectors.setdefault(priority, {})
 
-        if supported:
+        if name not in collectors:
+            if name in SHARED_COLLECTORS:
+                if name not in self._shared_collectors:
+                    self._shared_collectors[name] = self._create_collector(name)
+
+                collectors[name] = self._shared_collectors[name]
+            else:
+                collectors[name] = self._create_collector(name)
+
+        return collectors[name]
+
+    def register_source(self, artifact_definition, artifact_source):
+        collector = self._get_collector(artifact_definition, artifact_source)
+
+        if collector and collector.register_source(artifact_definition, artifact_source, self._variables):
             self._sources += 1
         elif artifact_source.type_indicator != artifacts.definitions.TYPE_INDICATOR_ARTIFACT_GROUP:
             logger.warning(f"Cannot process source for '{artifact_definition.name}' because type '{artifact_source.type_indicator}' is not supported")
 
+    def _all_collectors(self):
+        for priority in sorted(self._collectors, reverse=True):
+            collectors = self._collectors[priority]
+
+            for name in COLLECTOR_TYPES:
+                if name in collectors:
+                    yield priority, name, collectors[name]
+
+    def plan(self, planner, path):
+        logger.log(PROGRESS, f"Planning collection of {self._sources} sources ...")
+
+        planned = []
+        for _, _, collector in self._all_collectors():
+            # Shared collectors plan all their priorities at once
+            if collector not in planned:
+                planned.append(collector)
+                collector.plan(planner)
+
+        planner.write(path, self._variables.expansions)
+
     def collect(self, output):
         logger.log(PROGRESS, f"Collecting artifacts from {self._sources} sources ...")
 
-        for collector in self._collectors:
-            collector.collect(output)
+        if self._deadline:
+            logger.log(PROGRESS, f"Collection must end in {self._deadline.remaining():.0f}s")
+            output.deadline = self._deadline
+
+        for priority, name, collector in self._all_collectors():
+            start = time.monotonic()
+
+            if name in SHARED_COLLECTORS:
+                collector.collect(output, priority)
+            else:
+                collector.collect(output)
+            metrics.stage(type(collector).__name__, time.monotonic() - start)
 
         logger.log(PROGRESS, "Finished collecting artifacts")
+        governor.report()
+        memory.report()
         output.close()
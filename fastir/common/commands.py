@@ -1,4 +1,10 @@
-from subprocess import check_output, STDOUT, CalledProcessError
+import os
+import time
+import signal
+import threading
+import subprocess
+from subprocess import Popen, PIPE, STDOUT, DEVNULL
+from concurrent.futures import ThreadPoolExecutor
 
 import artifacts
 
@@ -6,10 +12,103 @@ from fastir.common.logging import logger
 from fastir.common.collector import AbstractCollector
 
 
+CHUNK_SIZE = 64 * 1024
+
+# Commands run in their own process group (a new session on POSIX), so that killing
+# them also kills their children still holding the output pipe
+if os.name == 'posix':
+    PROCESS_GROUP_OPTIONS = {'start_new_session': True}
+else:
+    PROCESS_GROUP_OPTIONS = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+class CommandResult:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.returncode = None
+        self.timed_out = False
+        self.truncated = False
+        self.not_found = False
+        self.duration = 0
+        self.size = 0
+
+        # Timeout applied to the command, from the options or the remaining time before the deadline
+        self.timeout = None
+
+
+def kill_process(process):
+    """Kill a command and the processes it started"""
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        # Windows has no signal for a process group, taskkill walks the tree of processes instead
+        try:
+            subprocess.call(['taskkill', '/T', '/F', '/PID', str(process.pid)], stdout=DEVNULL, stderr=DEVNULL)
+        except OSError:
+            process.kill()
+
+
+def run_command(full_command, output_file, out, timeout=None, max_output_size=None):
+    """Run a command with its output (stdout and stderr) streamed to a file object, closed at the end.
+
+    The command is killed when it exceeds the timeout (in seconds) or the maximum output
+    size (in bytes), in which case the output is truncated.
+    """
+    result = CommandResult(output_file)
+    result.timeout = timeout
+    start = time.monotonic()
+
+    with out:
+        try:
+            process = Popen(full_command, stdout=PIPE, stderr=STDOUT, **PROCESS_GROUP_OPTIONS)
+        except FileNotFoundError:
+            result.not_found = True
+            return result
+
+        def kill():
+            result.timed_out = True
+            kill_process(process)
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+
+        try:
+            for chunk in iter(lambda: process.stdout.read1(CHUNK_SIZE), b''):
+                if max_output_size and result.size + len(chunk) > max_output_size:
+                    out.write(chunk[:max_output_size - result.size])
+                    result.size = max_output_size
+                    result.truncated = True
+                    kill_process(process)
+                    break
+
+                out.write(chunk)
+                result.size += len(chunk)
+
+            process.stdout.close()
+            result.returncode = process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+
+    result.duration = time.monotonic() - start
+
+    return result
+
+
 class CommandExecutor(AbstractCollector):
-    def __init__(self):
+    def __init__(self, workers=1, timeout=None, max_output_size=None):
         self._commands = []
 
+        # Commands are independent, several of them can run at the same time
+        self._workers = workers
+        self._timeout = timeout
+        self._max_output_size = max_output_size
+
     def add_command(self, artifact, cmd, args):
         self._commands.append({
             'artifact': artifact,
@@ -17,21 +116,62 @@ class CommandExecutor(AbstractCollector):
             'args': args
         })
 
+    def _run(self, full_command, output, output_file, deadline):
+        timeout = self._timeout
+
+        # Commands must end before the deadline, those that cannot start in time are skipped
+        if deadline:
+            if deadline.expired():
+                return None
+
+            timeout = min(timeout or deadline.remaining(), deadline.remaining())
+
+        return run_command(
+            full_command, output_file, output.open_command_output(output_file), timeout, self._max_output_size)
+
     def collect(self, output):
+        with ThreadPoolExecutor(self._workers, thread_name_prefix='command') as executor:
+            futures = []
+
+            for command in self._commands:
+                full_command = [command['cmd']] + command['args']
+                output_file = output.command_output_name(command['artifact'])
+
+                futures.append(executor.submit(self._run, full_command, output, output_file, output.deadline))
+
+            # Results are recorded in order, by this thread only
+            for command, future in zip(self._commands, futures):
+                result = future.result()
+
+                if result is None:
+                    output.add_skipped(command['artifact'], 'COMMAND', ' '.join([command['cmd']] + command['args']), 'deadline')
+                else:
+                    self._record(output, command, result)
+
+    def plan(self, planner):
         for command in self._commands:
-            full_command = [command['cmd']] + command['args']
-            full_command_str = ' '.join(full_command)
-
-            try:
-                command_output = check_output(full_command, stderr=STDOUT)
-            except CalledProcessError as e:
-                logger.warning(f"Command '{full_command_str}' for artifact '{command['artifact']}' returned error code '{e.returncode}'")
-                command_output = e.output
-            except FileNotFoundError:
-                logger.warning(f"Command '{command['cmd']}' for artifact '{command['artifact']}' could not be found")
-                command_output = b''
-
-            output.add_collected_command(command['artifact'], full_command_str, command_output)
+            planner.add_planned(command['artifact'], 'commands')
+
+    def _record(self, output, command, result):
+        full_command_str = ' '.join([command['cmd']] + command['args'])
+
+        if result.not_found:
+            logger.warning(f"Command '{command['cmd']}' for artifact '{command['artifact']}' could not be found")
+        elif result.timed_out:
+            logger.warning(
+                f"Command '{full_command_str}' for artifact '{command['artifact']}' "
+                f"timed out after {result.timeout:.1f}s")
+        elif result.returncode != 0 and not result.truncated:
+            logger.warning(
+                f"Command '{full_command_str}' for artifact '{command['artifact']}' "
+                f"returned error code '{result.returncode}'")
+
+        if result.truncated:
+            logger.warning(
+                f"Output of command '{full_command_str}' for artifact '{command['artifact']}' "
+                f"was truncated to {self._max_output_size} bytes")
+
+        output.add_collected_command_output(command['artifact'], full_command_str, result)
 
     def register_source(self, artifact_definition, artifact_source, variables):
         if artifact_source.type_indicator == artifacts.definitions.TYPE_INDICATOR_COMMAND:
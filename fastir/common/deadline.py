@@ -0,0 +1,47 @@
+import time
+import threading
+
+
+# Read throughput assumed until some files have been read, in bytes per second
+DEFAULT_READ_THROUGHPUT = 50 * 1024 * 1024
+
+# Only trust the measured throughput once enough data was read
+MIN_MEASURED_BYTES = 1024 * 1024
+
+
+class Deadline:
+    """Time budget of a collection, with an estimate of the time needed to read files"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+        self._end = time.monotonic() + seconds
+        self._bytes = 0
+        self._read_time = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0, self._end - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def record_read(self, size, duration):
+        with self._lock:
+            self._bytes += size
+            self._read_time += duration
+
+    def throughput(self):
+        with self._lock:
+            if self._bytes < MIN_MEASURED_BYTES or self._read_time <= 0:
+                return DEFAULT_READ_THROUGHPUT
+
+            return self._bytes / self._read_time
+
+    def estimate(self, size):
+        """Estimated time to read size bytes, in seconds"""
+        return size / self.throughput()
+
+    def fits(self, size):
+        """Whether reading size bytes can be done before the deadline"""
+        return self.estimate(size) <= self.remaining()
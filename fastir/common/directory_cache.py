@@ -0,0 +1,112 @@
+import os
+from collections import OrderedDict
+
+
+# Approximate memory used by a cached entry (PathObject and TSK objects), in addition to its strings
+ENTRY_OVERHEAD = 512
+
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+class DirectoryListing:
+    """Entries of a directory, indexed by normalized name"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.names = {}
+        self.size = 0
+
+        for entry in entries:
+            # Keep the first entry when several names only differ by case
+            self.names.setdefault(os.path.normcase(entry.name), entry)
+            self.size += ENTRY_OVERHEAD + len(entry.name) + len(entry.path)
+
+    def get(self, name):
+        return self.names.get(os.path.normcase(name))
+
+
+class DirectoryCache:
+    """LRU cache of directory listings, bounded by entry count and approximate size.
+
+    The most recently added listing is always kept, even if it exceeds the limits.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._listings = OrderedDict()
+        self._entries = 0
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Set from other threads when memory runs low, applied by the owner of the cache
+        self._shrink_requested = False
+
+    def __len__(self):
+        return len(self._listings)
+
+    def get(self, path):
+        listing = self._listings.get(path)
+
+        if listing is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._listings.move_to_end(path)
+
+        return listing
+
+    def add(self, path, entries):
+        if self._shrink_requested:
+            self.shrink()
+
+        if path in self._listings:
+            self._remove(path)
+
+        listing = DirectoryListing(entries)
+        self._listings[path] = listing
+        self._entries += len(listing.entries)
+        self._bytes += listing.size
+
+        self._evict()
+
+        return listing
+
+    def resize(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._evict()
+
+    def request_shrink(self):
+        self._shrink_requested = True
+
+    def shrink(self):
+        """Halve the limits of the cache"""
+        self._shrink_requested = False
+        self.resize(max(self._entries // 2, 1), max(self._bytes // 2, 1))
+
+    def _remove(self, path):
+        listing = self._listings.pop(path)
+        self._entries -= len(listing.entries)
+        self._bytes -= listing.size
+
+    def _evict(self):
+        while len(self._listings) > 1 and (self._entries > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._listings)))
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'directories': len(self._listings),
+            'entries': self._entries,
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -2,65 +2,99 @@ import hashlib
 import filetype
 from datetime import datetime
 
-from pefile import PE
-
 from .logging import logger
+from .memory import ContentBuffer
 
 
 MAX_PE_SIZE = 50 * 1024 * 1024
 
 
 class FileInfo:
+    # Hashes computed over the file content
+    algorithms = ['md5', 'sha1', 'sha256']
+
     def __init__(self, path_object):
         self._path_object = path_object
         self.size = path_object.get_size()
 
         self._info = {}
-        self._content = b""
+        self._content = None
+        self._chunks = 0
+        self.mime_type = None
+
+    def update(self, chunk):
+        """Analyze the next chunk of content, except for hashes"""
+        if self._chunks == 0:
+            file_type = filetype.guess(chunk)
+            if file_type:
+                self.mime_type = file_type.mime
+
+        if self.mime_type == "application/x-msdownload" and self.size < MAX_PE_SIZE:
+            # Large PE files are buffered on disk when memory is limited
+            if self._content is None:
+                self._content = ContentBuffer(self.size)
+
+            self._content.write(chunk)
+
+        self._chunks += 1
 
     def compute(self):
-        self.md5 = hashlib.md5()
-        self.sha1 = hashlib.sha1()
-        self.sha256 = hashlib.sha256()
-        self.mime_type = None
+        hashes = {algorithm: hashlib.new(algorithm) for algorithm in self.algorithms}
+
+        for chunk in self._path_object.read_chunks():
+            for h in hashes.values():
+                h.update(chunk)
 
-        for i, chunk in enumerate(self._path_object.read_chunks()):
-            self.md5.update(chunk)
-            self.sha1.update(chunk)
-            self.sha256.update(chunk)
+            self.update(chunk)
 
-            if i == 0:
-                file_type = filetype.guess(chunk)
-                if file_type:
-                    self.mime_type = file_type.mime
+        return self.get_results({algorithm: h.hexdigest() for algorithm, h in hashes.items()})
 
-            if self.mime_type == "application/x-msdownload" and self.size < MAX_PE_SIZE:
-                self._content += chunk
+    def get_results(self, digests):
+        self.md5 = digests['md5']
+        self.sha1 = digests['sha1']
+        self.sha256 = digests['sha256']
 
         return self._get_results()
 
-    def _get_results(self):
+    def _init_info(self):
         self._info = {
             '@timestamp': datetime.utcnow().isoformat(),
             'file': {
                 'size': self.size,
-                'path': self._path_object.path,
-                'hash': {
-                    'md5': self.md5.hexdigest(),
-                    'sha1': self.sha1.hexdigest(),
-                    'sha256': self.sha256.hexdigest()
-                }
+                'path': self._path_object.path
             }
         }
 
+    def get_cached_results(self, properties):
+        """Results made of properties computed during a previous run"""
+        self._init_info()
+        self._info['file'].update(properties)
+
+        return self._info
+
+    @staticmethod
+    def cacheable_properties(results):
+        """Properties of the results that only depend on the file content"""
+        return {field: value for field, value in results['file'].items() if field not in ['size', 'path']}
+
+    def _get_results(self):
+        self._init_info()
+        self._info['file']['hash'] = {
+            'md5': self.md5,
+            'sha1': self.sha1,
+            'sha256': self.sha256
+        }
+
         if self.mime_type:
             self._info['file']['mime_type'] = self.mime_type
 
-        if len(self._content) > 0:
+        if self._content is not None and self._content.size > 0:
             try:
                 self._add_pe_info()
             except Exception as e:
                 logger.warning(f"Could not parse PE file '{self._path_object.path}': '{str(e)}'")
+            finally:
+                self._content.close()
 
         return self._info
 
@@ -91,7 +125,10 @@ class FileInfo:
                                             str_entry[1].decode('utf-8', 'replace'))
 
     def _add_pe_info(self):
-        parsed_pe = PE(data=self._content)
+        # pefile is slow to import, and only needed for PE files
+        from pefile import PE
+
+        parsed_pe = PE(data=self._content.getbuffer())
 
         self._add_vs_info(parsed_pe)
         self._add_file_property('pe', 'imphash', parsed_pe.get_imphash())
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+
+from .logging import logger
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class FileInfoCache:
+    """File info results kept across runs, keyed by file identity, size and timestamps.
+
+    The cache is loaded when opened and saved when closed, keeping the most
+    recently used entries within the size limit. Entries are never evicted
+    during a run, so that a file announced as cached stays cached.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._entries[entry['key']] = entry
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load file info cache '{self.path}': {str(e)}")
+            self._entries = {}
+
+    @staticmethod
+    def key(path_object):
+        """Cache key of a path object, None if it cannot be identified"""
+        identity = path_object.get_identity()
+
+        if identity is None:
+            return None
+
+        timestamps = path_object.get_timestamps()
+
+        return json.dumps(list(identity) + [path_object.get_size(), timestamps['mtime'], timestamps['ctime']])
+
+    def __contains__(self, key):
+        return key is not None and key in self._entries
+
+    def get(self, key, size):
+        """Cached file properties (hashes, mime type, PE info), None on a miss"""
+        entry = self._entries.get(key) if key is not None else None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.bytes_saved += size
+        entry['used'] = time.time()
+
+        return entry['file']
+
+    def add(self, key, file):
+        if key is not None:
+            self._entries[key] = {'key': key, 'used': time.time(), 'file': file}
+
+    def save(self):
+        lines = []
+        size = 0
+
+        # Most recently used entries are kept first
+        for entry in sorted(self._entries.values(), key=lambda entry: entry['used'], reverse=True):
+            line = json.dumps(entry) + '\n'
+
+            if size + len(line) > self.max_bytes:
+                break
+
+            lines.append(line)
+            size += len(line)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Replace the cache atomically so that an interrupted run does not corrupt it
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+
+        return len(lines)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0,
+            'bytes_saved': self.bytes_saved
+        }
@@ -1,33 +1,144 @@
 import re
 import os
+import time
+import errno
+import itertools
+import threading
+from contextlib import contextmanager
 
 import pytsk3
 import psutil
 import artifacts
-from artifacts.source_type import FileSourceType
 
 from fastir.common.logging import logger
-from fastir.common.collector import AbstractCollector
-from fastir.common.path_components import RecursionPathComponent, GlobPathComponent, RegularPathComponent, PathObject
+from fastir.common.source_types import FILE_INFO_TYPE
+from fastir.common.collector import AbstractCollector, get_priority, get_read_options
+from fastir.common.directory_cache import DirectoryCache, DEFAULT_MAX_BYTES
+from fastir.common.governor import governor
+from fastir.common.memory import memory
+from fastir.common.metrics import metrics
+from fastir.common.pipeline import StageQueue
+from fastir.common.metadata_index import MetadataIndex
+from fastir.common.path_components import RecursionPathComponent, GlobPathComponent, RegularPathComponent, PathObject, PathTree, PartialPathObject
 
 CHUNK_SIZE = 5 * 1024 * 1024
 PATH_RECURSION_REGEX = re.compile(r"\*\*(?P<max_depth>(-1|\d*))")
 PATH_GLOB_REGEX = re.compile(r"\*|\?|\[.+\]")
-FILE_INFO_TYPE = "FILE_INFO"
 TSK_FILESYSTEMS = ['NTFS', 'ext3', 'ext4']
 
+# Maximum number of files a filesystem worker can enumerate ahead of the writer,
+# and of chunks its readers can read ahead for each file
+FILE_QUEUE_SIZE = 32
+CHUNK_QUEUE_SIZE = 8
+
+# In deadline mode, matched paths are collected by increasing size within batches of this many paths
+SCHEDULE_BATCH_SIZE = 1000
+
+# Share of the memory limit directory caches may use
+DIRECTORY_CACHE_SHARE = 1 / 8
+
+# Share of the memory limit chunks read ahead by all filesystem workers may use
+READ_AHEAD_SHARE = 1 / 4
+END_OF_FILE = object()
+END_OF_COLLECTION = object()
+
+
+def read_ahead_sizes(workers, read_workers):
+    """Sizes of the file and chunk queues of each filesystem worker, under the memory limit.
+
+    Every file queued for the writer (and the one it writes, and the one the
+    enumeration is blocked on) holds up to a chunk queue of content, and each
+    reader one more chunk: queues are shrunk until these chunks fit in their
+    share of the limit. They cannot be smaller than a single file and chunk.
+    """
+    files, chunks = FILE_QUEUE_SIZE, CHUNK_QUEUE_SIZE
+
+    def in_flight(files, chunks):
+        return (files + 2) * chunks + read_workers
+
+    # Number of chunks each worker can read ahead
+    budget = memory.share(workers * in_flight(files, chunks) * CHUNK_SIZE, READ_AHEAD_SHARE) // (workers * CHUNK_SIZE)
+
+    while in_flight(files, chunks) > budget and chunks > 1:
+        chunks //= 2
+
+    while in_flight(files, chunks) > budget and files > 1:
+        files //= 2
+
+    return files, chunks
+
+
+def collect_path(output, artifact, source_type, path):
+    try:
+        if source_type == FILE_INFO_TYPE:
+            output.add_collected_file_info(artifact, path)
+        else:
+            output.add_collected_file(artifact, path)
+    except Exception as e:
+        logger.error(f"Error collecting file '{path.path}': {str(e)}")
+
+
+def collect_labels(output, path, labels):
+    """Collect a path for all its labels, reading its content only once"""
+    try:
+        with output.read_once(path):
+            for artifact, source_type in labels:
+                collect_path(output, artifact, source_type, path)
+    except Exception as e:
+        logger.error(f"Error collecting file '{path.path}': {str(e)}")
+
+
+def merge_runs(runs):
+    """Merge contiguous (offset, length) runs"""
+    merged = []
+
+    for offset, length in sorted(runs):
+        if merged and merged[-1][0] + merged[-1][1] >= offset:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], offset + length - merged[-1][0]))
+        elif length > 0:
+            merged.append((offset, length))
+
+    return merged
+
 
 class FileSystem:
     def __init__(self):
         self._patterns = []
 
-    def add_pattern(self, artifact, pattern, source_type='FILE'):
+        # Options of artifacts collecting only a range or the allocated runs of their files
+        self._read_options = {}
+
+    def add_pattern(self, artifact, pattern, source_type='FILE', read_options=None, priority=0):
         self._patterns.append({
             'artifact': artifact,
             'pattern': pattern,
-            'source_type': source_type
+            'source_type': source_type,
+            'priority': priority
         })
 
+        if read_options:
+            self._read_options[artifact] = read_options
+
+    def patterns(self, priority=None):
+        """Patterns to collect, only those of a priority when it is given"""
+        return [pattern for pattern in self._patterns if priority is None or pattern['priority'] == priority]
+
+    def allocated_runs(self, path_object):
+        """(offset, length) runs of a file holding data, None when unknown"""
+        return None
+
+    def _partial(self, path_object, labels):
+        """Only read a part of a file when all the artifacts collecting it agree on it"""
+        options = [
+            self._read_options.get(artifact) if source_type != FILE_INFO_TYPE else None
+            for artifact, source_type in labels
+        ]
+
+        if options[0] and all(option == options[0] for option in options):
+            return PartialPathObject(path_object, options[0].get('range'), options[0].get('sparse', False))
+
+        return path_object
+
     def _relative_path(self, filepath):
         raise NotImplementedError
 
@@ -57,34 +168,107 @@ class FileSystem:
     def _base_generator(self):
         raise NotImplementedError
 
-    def collect(self, output):
-        for pattern in self._patterns:
+    def _schedule(self, matches):
+        """Choose the order in which matched paths are collected"""
+        return matches
+
+    def _until_deadline(self, output, matches, tree, patterns):
+        """Stop enumerating matched paths when the deadline is reached"""
+        for match in matches:
+            if output.deadline.expired():
+                # Patterns entirely walked, or with matches already collected, are not skipped
+                done = tree.yielded_patterns | tree.enumerated_patterns
+
+                for pattern in patterns:
+                    if pattern['pattern'] not in done:
+                        output.add_skipped(
+                            pattern['artifact'], pattern['source_type'], pattern['pattern'],
+                            'deadline (incomplete enumeration)')
+                return
+
+            yield match
+
+    def _schedule_by_cost(self, matches):
+        """Collect the cheapest paths first, their size being known from metadata.
+
+        Paths are only sorted within batches, so that collection starts without
+        waiting for the end of a slow enumeration.
+        """
+        def cost(match):
+            path, _ = match
+
+            try:
+                return path.get_size()
+            except Exception:
+                return float('inf')
+
+        matches = iter(matches)
+
+        while True:
+            batch = list(itertools.islice(matches, SCHEDULE_BATCH_SIZE))
+            if not batch:
+                return
+
+            yield from sorted(batch, key=cost)
+
+    def collect(self, output, priority=None):
+        # All patterns are merged in a single tree so that common directories are only walked once
+        tree = PathTree()
+        patterns = self.patterns(priority)
+
+        for pattern in patterns:
             logger.debug("Collecting pattern '{}' for artifact '{}'".format(pattern['pattern'], pattern['artifact']))
 
             # Normalize the pattern, relative to the mountpoint
             relative_pattern = self._relative_path(pattern['pattern'])
-            path_components = self._parse(relative_pattern)
+            tree.add(self._parse(relative_pattern), (pattern['artifact'], pattern['source_type']), pattern['pattern'])
+            metrics.add_pattern(pattern['pattern'], pattern['artifact'])
 
-            generator = self._base_generator
-            for component in path_components:
-                generator = component.get_generator(generator)
+        matches = tree.walk(self._base_generator)
 
-            for path in generator():
-                try:
-                    if pattern['source_type'] == FILE_INFO_TYPE:
-                        output.add_collected_file_info(pattern['artifact'], path)
-                    else:
-                        output.add_collected_file(pattern['artifact'], path)
-                except Exception as e:
-                    logger.error(f"Error collecting file '{path.path}': {str(e)}")
+        if output.deadline:
+            matches = self._schedule_by_cost(self._until_deadline(output, matches, tree, patterns))
+        else:
+            matches = self._schedule(matches)
+
+        for path, labels in matches:
+            collect_labels(output, self._partial(path, labels), labels)
+
+
+class TSKIndexedPathObject(PathObject):
+    """Path object resolved from a MetadataIndex, only opened with TSK when needed"""
+
+    def __init__(self, filesystem, name, path, inode, meta_type):
+        super().__init__(filesystem, name, path)
+
+        self.inode = inode
+        self.meta_type = meta_type
+
+    @property
+    def obj(self):
+        if self._obj is None:
+            self._obj = self.filesystem.open_meta(self.inode)
+
+        return self._obj
+
+    @obj.setter
+    def obj(self, value):
+        self._obj = value
 
 
 class TSKFileSystem(FileSystem):
-    def __init__(self, manager, device, path):
+    def __init__(self, manager, device, path, index=False, ordered_reads=False):
         self._manager = manager
         self._path = path
         self._root = None
 
+        # Resolve paths from a metadata index instead of opening directories one by one
+        self._use_index = index
+        self._index = None
+
+        # Enumerate all paths first, then read them in physical order
+        self._ordered_reads = ordered_reads
+
         # Unix Device
         if self._path.startswith('/'):
             self._device = device
@@ -93,14 +277,23 @@ class TSKFileSystem(FileSystem):
             self._device = r"\\.\{}:".format(device[0])
 
         # Cache parsed entries for better performances
-        self._entries_cache = {}
-        self._entries_cache_last = []
+        self._entries_cache = DirectoryCache(max_bytes=memory.share(DEFAULT_MAX_BYTES, DIRECTORY_CACHE_SHARE))
 
         # Open drive
         img_info = pytsk3.Img_Info(self._device)
         self._fs_info = pytsk3.FS_Info(img_info)
         self._root = self._fs_info.open_dir('')
 
+        # Only NTFS can be indexed in a single pass, other filesystems are walked from their patterns
+        if self._use_index and not MetadataIndex.supported(self._fs_info):
+            logger.info(f"Metadata of '{self._path}' cannot be indexed in a single pass, reading directories instead")
+            self._use_index = False
+
+        # Listings are the largest structure of the collection on big filesystems
+        memory.track(
+            f'directory_cache:{self._path}', lambda: self._entries_cache.stats()['bytes'],
+            self._entries_cache.request_shrink)
+
         super().__init__()
 
     def _relative_path(self, filepath):
@@ -114,14 +307,31 @@ class TSKFileSystem(FileSystem):
         return (int(tsk_entry.info.name.flags) & pytsk3.TSK_FS_NAME_FLAG_ALLOC != 0 and
                 int(tsk_entry.info.meta.flags) & pytsk3.TSK_FS_META_FLAG_ALLOC != 0)
 
+    def _meta_type(self, path_object):
+        if isinstance(path_object, TSKIndexedPathObject):
+            return path_object.meta_type
+
+        return path_object.obj.info.meta.type
+
+    def _inode(self, path_object):
+        if isinstance(path_object, TSKIndexedPathObject):
+            return path_object.inode
+        elif isinstance(path_object.obj, pytsk3.Directory):
+            return path_object.obj.info.addr
+
+        return path_object.obj.info.meta.addr
+
     def is_directory(self, path_object):
-        return path_object.obj.info.meta.type in [pytsk3.TSK_FS_META_TYPE_DIR, pytsk3.TSK_FS_META_TYPE_VIRT_DIR]
+        return self._meta_type(path_object) in [pytsk3.TSK_FS_META_TYPE_DIR, pytsk3.TSK_FS_META_TYPE_VIRT_DIR]
 
     def is_file(self, path_object):
-        return path_object.obj.info.meta.type == pytsk3.TSK_FS_META_TYPE_REG
+        return self._meta_type(path_object) == pytsk3.TSK_FS_META_TYPE_REG
 
     def is_symlink(self, path_object):
-        return path_object.obj.info.meta.type == pytsk3.TSK_FS_META_TYPE_LNK
+        return self._meta_type(path_object) == pytsk3.TSK_FS_META_TYPE_LNK
+
+    def open_meta(self, inode):
+        return self._fs_info.open_meta(inode=inode)
 
     def _follow_symlink(self, parent, path_object):
         # TODO: attempt to follow symlinks with TSK
@@ -130,42 +340,41 @@ class TSKFileSystem(FileSystem):
         # they are still collected
         return OSFileSystem('/').get_fullpath(path_object.path)
 
-    def list_directory(self, path_object):
-        if path_object.path in self._entries_cache:
-            return self._entries_cache[path_object.path]
+    def collect(self, output, priority=None):
+        super().collect(output, priority)
+
+        logger.info(f"Directory cache statistics for '{self._path}': {self.cache_stats()}")
+
+    def cache_stats(self):
+        return self._entries_cache.stats()
+
+    def _get_listing(self, path_object):
+        listing = self._entries_cache.get(path_object.path)
+
+        if listing is None:
+            listing = self._entries_cache.add(path_object.path, self._read_directory(path_object))
         else:
-            # Make sure we do not keep more than 10 000 entries in the cache
-            if len(self._entries_cache_last) >= 10000:
-                first = self._entries_cache_last.pop(0)
-                del self._entries_cache[first]
-
-            entries = []
-            directory = path_object.obj
-
-            if not isinstance(directory, pytsk3.Directory):
-                if not self.is_directory(path_object):
-                    return
-
-                directory = path_object.obj.as_directory()
-
-            for entry in directory:
-                if (
-                    not hasattr(entry, 'info') or
-                    not hasattr(entry.info, 'name') or
-                    not hasattr(entry.info.name, 'name') or
-                    entry.info.name.name in [b'.', b'..'] or
-                    not hasattr(entry.info, 'meta') or
-                    not hasattr(entry.info.meta, 'size') or
-                    not hasattr(entry.info.meta, 'type') or
-                    not self.is_allocated(entry)
-                ):
-                    continue
-
-                name = entry.info.name.name.decode('utf-8', errors='replace')
+            metrics.count_current('cache_hits')
+
+        return listing
+
+    def _get_index(self):
+        if self._index is None:
+            start = time.time()
+            self._index = MetadataIndex.build(self._fs_info)
+            logger.info(f"Indexed {self._index.entries} entries for '{self._path}' in {time.time() - start:.2f}s")
+
+        return self._index
+
+    def _read_indexed_directory(self, path_object):
+        entries = []
+
+        if isinstance(path_object.obj, pytsk3.Directory) or self.is_directory(path_object):
+            for name, inode, meta_type in self._get_index().children(self._inode(path_object)):
                 filepath = os.path.join(path_object.path, name)
-                entry_path_object = PathObject(self, name, filepath, entry)
+                entry_path_object = TSKIndexedPathObject(self, name, filepath, inode, meta_type)
 
-                if entry.info.meta.type == pytsk3.TSK_FS_META_TYPE_LNK:
+                if meta_type == pytsk3.TSK_FS_META_TYPE_LNK:
                     symlink_object = self._follow_symlink(path_object, entry_path_object)
 
                     if symlink_object:
@@ -173,15 +382,53 @@ class TSKFileSystem(FileSystem):
                 else:
                     entries.append(entry_path_object)
 
-            self._entries_cache[path_object.path] = entries
-            self._entries_cache_last.append(entries)
+        return entries
+
+    def _read_directory(self, path_object):
+        if self._use_index:
+            return self._read_indexed_directory(path_object)
+
+        entries = []
+        directory = path_object.obj
 
-            return entries
+        if not isinstance(directory, pytsk3.Directory):
+            if not self.is_directory(path_object):
+                return entries
+
+            directory = path_object.obj.as_directory()
+
+        for entry in directory:
+            if (
+                not hasattr(entry, 'info') or
+                not hasattr(entry.info, 'name') or
+                not hasattr(entry.info.name, 'name') or
+                entry.info.name.name in [b'.', b'..'] or
+                not hasattr(entry.info, 'meta') or
+                not hasattr(entry.info.meta, 'size') or
+                not hasattr(entry.info.meta, 'type') or
+                not self.is_allocated(entry)
+            ):
+                continue
+
+            name = entry.info.name.name.decode('utf-8', errors='replace')
+            filepath = os.path.join(path_object.path, name)
+            entry_path_object = PathObject(self, name, filepath, entry)
+
+            if entry.info.meta.type == pytsk3.TSK_FS_META_TYPE_LNK:
+                symlink_object = self._follow_symlink(path_object, entry_path_object)
+
+                if symlink_object:
+                    entries.append(symlink_object)
+            else:
+                entries.append(entry_path_object)
+
+        return entries
+
+    def list_directory(self, path_object):
+        return self._get_listing(path_object).entries
 
     def get_path(self, parent, name):
-        for path_object in self.list_directory(parent):
-            if os.path.normcase(name) == os.path.normcase(path_object.name):
-                return path_object
+        return self._get_listing(parent).get(name)
 
     def get_fullpath(self, filepath):
         relative_path = self._relative_path(filepath)
@@ -192,9 +439,12 @@ class TSKFileSystem(FileSystem):
 
         return path_object
 
-    def read_chunks(self, path_object):
+    def read_chunks(self, path_object, start=0, end=None):
         size = path_object.obj.info.meta.size
-        offset = 0
+        if end is not None:
+            size = min(size, end)
+
+        offset = start
 
         while offset < size:
             chunk_size = min(CHUNK_SIZE, size - offset)
@@ -202,6 +452,7 @@ class TSKFileSystem(FileSystem):
 
             if chunk:
                 offset += chunk_size
+                governor.throttle_read(len(chunk))
                 yield chunk
             else:
                 break
@@ -209,6 +460,92 @@ class TSKFileSystem(FileSystem):
     def get_size(self, path_object):
         return path_object.obj.info.meta.size
 
+    def get_identity(self, path_object):
+        return ('tsk', self._device, self._inode(path_object))
+
+    def get_timestamps(self, path_object):
+        meta = path_object.obj.info.meta
+
+        return {
+            'mtime': meta.mtime * 1000000000 + meta.mtime_nano,
+            'ctime': meta.ctime * 1000000000 + meta.ctime_nano
+        }
+
+    def _data_attribute(self, path_object):
+        """Default data stream of a file"""
+        for attribute in path_object.obj:
+            if attribute.info.type not in [pytsk3.TSK_FS_ATTR_TYPE_DEFAULT, pytsk3.TSK_FS_ATTR_TYPE_NTFS_DATA]:
+                continue
+
+            # Skip NTFS alternate data streams
+            if attribute.info.name:
+                continue
+
+            return attribute
+
+        return None
+
+    @staticmethod
+    def _is_allocated_run(run):
+        return not int(run.flags) & (pytsk3.TSK_FS_ATTR_RUN_FLAG_SPARSE | pytsk3.TSK_FS_ATTR_RUN_FLAG_FILLER)
+
+    def get_physical_offset(self, path_object):
+        """Offset on the volume of the first allocated block of the default data stream.
+
+        Returns None when the content has no block of its own (empty or resident files).
+        """
+        attribute = self._data_attribute(path_object)
+
+        if attribute is not None:
+            for run in attribute:
+                if run.addr and self._is_allocated_run(run):
+                    return run.addr * self._fs_info.info.block_size
+
+        return None
+
+    def allocated_runs(self, path_object):
+        attribute = self._data_attribute(path_object)
+
+        # Resident and compressed streams have no runs that map directly to the content
+        if attribute is None or int(attribute.info.flags) & (pytsk3.TSK_FS_ATTR_RES | pytsk3.TSK_FS_ATTR_COMP):
+            return None
+
+        size = self.get_size(path_object)
+        block_size = self._fs_info.info.block_size
+        runs = []
+
+        for run in attribute:
+            offset = run.offset * block_size
+
+            if self._is_allocated_run(run) and offset < size:
+                runs.append((offset, min(run.len * block_size, size - offset)))
+
+        return merge_runs(runs)
+
+    def _schedule(self, matches):
+        if not self._ordered_reads:
+            return matches
+
+        def sort_key(match):
+            path, _ = match
+
+            # Links are downgraded to OSFileSystem and read last
+            if path.filesystem is not self:
+                return (2, 0)
+
+            try:
+                offset = self.get_physical_offset(path)
+            except OSError:
+                return (2, 0)
+
+            # Files without blocks of their own are read first
+            return (0, 0) if offset is None else (1, offset)
+
+        matches = sorted(matches, key=sort_key)
+        logger.info(f"Scheduled {len(matches)} paths from '{self._path}' in physical order")
+
+        return matches
+
 
 class OSFileSystem(FileSystem):
     def __init__(self, path):
@@ -224,9 +561,16 @@ class OSFileSystem(FileSystem):
         yield PathObject(self, os.path.basename(self._path), self._path)
 
     def is_directory(self, path):
+        # Entries coming from a directory listing carry their type
+        if isinstance(path.obj, os.DirEntry):
+            return path.obj.is_dir()
+
         return os.path.isdir(path.path)
 
     def is_file(self, path):
+        if isinstance(path.obj, os.DirEntry):
+            return path.obj.is_file()
+
         return os.path.isfile(path.path)
 
     def is_symlink(self, path):
@@ -235,10 +579,11 @@ class OSFileSystem(FileSystem):
 
     def list_directory(self, path):
         try:
-            for name in os.listdir(path.path):
-                yield PathObject(self, name, os.path.join(path.path, name))
+            with os.scandir(path.path) as entries:
+                return [PathObject(self, entry.name, entry.path, entry) for entry in entries]
         except Exception as e:
             logger.error(f"Error analyzing directory '{path.path}': {str(e)}")
+            return []
 
     def get_path(self, parent, name):
         return PathObject(self, name, os.path.join(parent.path, name))
@@ -246,23 +591,305 @@ class OSFileSystem(FileSystem):
     def get_fullpath(self, fullpath):
         return PathObject(self, os.path.basename(fullpath), fullpath)
 
-    def read_chunks(self, path_object):
-        with open(path_object.path, 'rb') as f:
-            chunk = f.read(CHUNK_SIZE)
+    def read_chunks(self, path_object, start=0, end=None):
+        # Chunks are handed over to other threads, so each one needs its own buffer.
+        # Reading from the unbuffered file avoids an extra copy.
+        with open(path_object.path, 'rb', buffering=0) as f:
+            if start:
+                f.seek(start)
 
-            if chunk:
+            offset = start
+
+            while True:
+                chunk = f.read(CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - offset))
+
+                if not chunk:
+                    break
+
+                offset += len(chunk)
+                governor.throttle_read(len(chunk))
                 yield chunk
 
+    def allocated_runs(self, path_object):
+        # Holes can only be found on platforms and filesystems supporting SEEK_DATA
+        if not hasattr(os, 'SEEK_DATA'):
+            return None
+
+        runs = []
+
+        with open(path_object.path, 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+
+            while offset < size:
+                try:
+                    data = os.lseek(f.fileno(), offset, os.SEEK_DATA)
+                except OSError as e:
+                    # No data after offset
+                    if e.errno == errno.ENXIO:
+                        break
+                    raise
+
+                offset = min(os.lseek(f.fileno(), data, os.SEEK_HOLE), size)
+                runs.append((data, offset - data))
+
+        return merge_runs(runs)
+
     def get_size(self, path_object):
-        stats = os.lstat(path_object.path)
+        if isinstance(path_object.obj, os.DirEntry):
+            stats = path_object.obj.stat(follow_symlinks=False)
+        else:
+            stats = os.lstat(path_object.path)
 
         return stats.st_size
 
+    def _stat(self, path_object):
+        # Content is read through symlinks, so are its identity and timestamps
+        if isinstance(path_object.obj, os.DirEntry):
+            return path_object.obj.stat()
+
+        return os.stat(path_object.path)
+
+    def get_identity(self, path_object):
+        stats = self._stat(path_object)
+
+        # Some filesystems do not provide inode numbers
+        if stats.st_ino:
+            return ('os', stats.st_dev, stats.st_ino)
+
+    def get_timestamps(self, path_object):
+        stats = self._stat(path_object)
+
+        return {
+            'mtime': stats.st_mtime_ns,
+            'ctime': stats.st_ctime_ns
+        }
+
+
+class PrefetchedPathObject(PathObject):
+    """Path object whose content is read ahead by the readers of a FileSystemWorker"""
+
+    def __init__(self, path_object, metadata, chunk_queue_size=CHUNK_QUEUE_SIZE):
+        super().__init__(path_object.filesystem, path_object.name, path_object.path, path_object.obj)
+
+        # Metadata is read by the worker as well
+        self._metadata = metadata
+        self.layout = path_object.layout
+        self.member_suffix = path_object.member_suffix
+        self.chunks = StageQueue('chunks', chunk_queue_size, 'read', 'write')
+        self._done = False
+
+        # Time spent by the writer waiting for chunks
+        self.waited = 0
+
+    def read_chunks(self):
+        while not self._done:
+            chunk, idle = self.chunks.get_timed()
+            self.waited += idle
+
+            if chunk is END_OF_FILE:
+                self._done = True
+            elif isinstance(chunk, Exception):
+                self._done = True
+                raise chunk
+            else:
+                yield chunk
+
+    def get_size(self):
+        return self._metadata['size']
+
+    def get_identity(self):
+        return self._metadata['identity']
+
+    def get_timestamps(self):
+        return self._metadata['timestamps']
+
+    def drain(self):
+        """Discard the chunks that were not consumed by the writer"""
+        try:
+            for _ in self.read_chunks():
+                pass
+        except Exception:
+            pass
+
+
+class FileSystemWorker(threading.Thread):
+    """Enumerate the files of a single filesystem, and read them ahead.
+
+    The worker takes the place of the output: collected files are sent, in
+    order, to a bounded queue consumed by the thread owning the real output.
+    Files to read are handed over to reader threads, each file being read into
+    a bounded queue of chunks. Readers take files in the order they are sent,
+    so the file the writer waits for is always being read.
+    """
+
+    def __init__(self, mountpoint, filesystem, output, read_workers=1, priority=None,
+                 file_queue_size=FILE_QUEUE_SIZE, chunk_queue_size=CHUNK_QUEUE_SIZE):
+        super().__init__(daemon=True)
+
+        self.queue = StageQueue('files', file_queue_size, 'enumerate', 'write')
+        self._reads = StageQueue('reads', file_queue_size, 'enumerate', 'read')
+        self._chunk_queue_size = chunk_queue_size
+        self._readers = [threading.Thread(target=self._read_files, daemon=True) for _ in range(read_workers)]
+
+        self._mountpoint = mountpoint
+        self._filesystem = filesystem
+        self._priority = priority
+        self._output = output
+
+        # Members entirely written by the writer, whose files do not need to be read again
+        self._archived = set()
+        self._labels = None
+
+        # Time spent blocked on full queues is not spent enumerating
+        self._blocked = 0
+        self._files = 0
+
+        # Skipped sources are recorded by the thread owning the output
+        self.skipped = []
+
+    @property
+    def deadline(self):
+        return self._output.deadline
+
+    def add_skipped(self, artifact, source_type, item, reason):
+        self.skipped.append((artifact, source_type, item, reason))
+
+    def run(self):
+        metrics.stage_workers('enumerate', 1)
+        metrics.stage_workers('read', len(self._readers))
+
+        for reader in self._readers:
+            reader.start()
+
+        start = time.monotonic()
+
+        try:
+            self._filesystem.collect(self, self._priority)
+        except Exception as e:
+            logger.error(f"Error collecting filesystem '{self._mountpoint}': {str(e)}")
+        finally:
+            for _ in self._readers:
+                self._reads.put(None)
+
+            metrics.stage_time(
+                'enumerate', busy=time.monotonic() - start - self._blocked, items=self._files)
+            metrics.stage_workers_done('enumerate', 1)
+
+            # Readers end once the writer consumed the chunks of the last files
+            for reader in self._readers:
+                reader.join()
+
+            self.queue.put(END_OF_COLLECTION)
+
+    def _read_files(self):
+        while True:
+            item, _ = self._reads.get_timed()
+
+            if item is None:
+                metrics.stage_workers_done('read', 1)
+                return
+
+            path_object, prefetched = item
+            memory.check('read')
+            start = time.monotonic()
+            blocked = 0
+
+            try:
+                for chunk in path_object.read_chunks():
+                    blocked += prefetched.chunks.put(chunk)
+            except Exception as e:
+                prefetched.chunks.put(e)
+            else:
+                prefetched.chunks.put(END_OF_FILE)
+
+            metrics.stage_time('read', busy=time.monotonic() - start - blocked, items=1)
+
+    def _send(self, labels, path_object):
+        memory.check('enumerate')
+
+        try:
+            metadata = {
+                'size': path_object.get_size(),
+                'identity': path_object.get_identity(),
+                'timestamps': path_object.get_timestamps()
+            }
+        except Exception as e:
+            logger.error(f"Error collecting file '{path_object.path}': {str(e)}")
+            return
+
+        # Do not read ahead files that cannot be collected in time
+        reason = self._output.deadline_exceeded(metadata['size'])
+        if reason:
+            for artifact, source_type in labels:
+                self.add_skipped(artifact, source_type, path_object.path, reason)
+            return
+
+        prefetched = PrefetchedPathObject(path_object, metadata, self._chunk_queue_size)
+
+        # Files are only archived once, unchanged files are not archived, and file info may be cached:
+        # there is no need to read them. Files still being written are read again, in case writing them fails.
+        read = False
+        if not self._output.exceeds_maxsize(metadata['size']):
+            for _, source_type in labels:
+                if source_type == FILE_INFO_TYPE:
+                    read = read or not self._output.has_cached_file_info(prefetched)
+                elif self._member(path_object) not in self._archived:
+                    read = read or not self._output.is_unchanged(prefetched)
+
+        if read:
+            self._blocked += self._reads.put((path_object, prefetched))
+        else:
+            prefetched.chunks.put(END_OF_FILE)
+
+        self._blocked += self.queue.put((labels, prefetched))
+        self._files += 1
+
+    def _member(self, path_object):
+        return path_object.path + path_object.member_suffix
+
+    def mark_archived(self, path_object):
+        """Called by the writer once the content of a file is entirely written"""
+        self._archived.add(self._member(path_object))
+
+    @contextmanager
+    def read_once(self, path_object):
+        self._labels = []
+
+        try:
+            yield
+        finally:
+            labels, self._labels = self._labels, None
+
+        if labels:
+            self._send(labels, path_object)
+
+    def _add(self, artifact, source_type, path_object):
+        if self._labels is not None:
+            self._labels.append((artifact, source_type))
+        else:
+            self._send([(artifact, source_type)], path_object)
+
+    def add_collected_file(self, artifact, path_object):
+        self._add(artifact, artifacts.definitions.TYPE_INDICATOR_FILE, path_object)
+
+    def add_collected_file_info(self, artifact, path_object):
+        self._add(artifact, FILE_INFO_TYPE, path_object)
+
 
 class FileSystemManager(AbstractCollector):
-    def __init__(self):
+    def __init__(self, workers=1, tsk_options=None, read_workers=1, read_options=None, priorities=None):
         self._filesystems = {}
         self._mount_points = psutil.disk_partitions(True)
+        self._workers = workers
+        self._read_workers = read_workers
+        self._tsk_options = tsk_options or {}
+
+        # Ranges or sparse reads, by artifact name or label
+        self._read_options = read_options or {}
+
+        # With a deadline, filesystems are opened once and collected once per priority
+        self._priorities = priorities or {}
 
     def _get_mountpoint(self, filepath):
         best_mountpoint = None
@@ -288,7 +915,7 @@ class FileSystemManager(AbstractCollector):
             if mountpoint.fstype in TSK_FILESYSTEMS:
                 try:
                     self._filesystems[mountpoint.mountpoint] = TSKFileSystem(
-                        self, mountpoint.device, mountpoint.mountpoint)
+                        self, mountpoint.device, mountpoint.mountpoint, **self._tsk_options)
                 except OSError:
                     pass
 
@@ -301,7 +928,7 @@ class FileSystemManager(AbstractCollector):
         filesystem = self._get_filesystem(filepath)
         return filesystem.get_fullpath(filepath)
 
-    def add_pattern(self, artifact, pattern, source_type='FILE'):
+    def add_pattern(self, artifact, pattern, source_type='FILE', read_options=None, priority=0):
         pattern = os.path.normpath(pattern)
 
         # If the pattern starts with '\', it should be applied to all drives
@@ -310,37 +937,82 @@ class FileSystemManager(AbstractCollector):
                 if mountpoint.fstype in TSK_FILESYSTEMS:
                     extended_pattern = os.path.join(mountpoint.mountpoint, pattern[1:])
                     filesystem = self._get_filesystem(extended_pattern)
-                    filesystem.add_pattern(artifact, extended_pattern, source_type)
+                    filesystem.add_pattern(artifact, extended_pattern, source_type, read_options, priority)
 
         else:
             filesystem = self._get_filesystem(pattern)
-            filesystem.add_pattern(artifact, pattern, source_type)
+            filesystem.add_pattern(artifact, pattern, source_type, read_options, priority)
+
+    def collect(self, output, priority=None):
+        # Filesystems are enumerated and read by their own worker, while this thread
+        # is the only one writing to the output, so that listing directories, reading
+        # files and compressing them overlap. Workers are consumed in a fixed
+        # round-robin order (one file at a time) so that the archive does not depend
+        # on thread scheduling.
+        pending = [path for path, filesystem in self._filesystems.items() if filesystem.patterns(priority)]
+        active = []
+
+        # Chunks read ahead are part of the memory limit
+        file_queue_size, chunk_queue_size = read_ahead_sizes(self._workers, self._read_workers)
+        if (file_queue_size, chunk_queue_size) != (FILE_QUEUE_SIZE, CHUNK_QUEUE_SIZE):
+            logger.info(
+                f"Reading ahead up to {file_queue_size} files and {chunk_queue_size} chunks per file "
+                "to stay under the memory limit")
+
+        metrics.stage_workers('write', 1)
+
+        while pending or active:
+            while pending and len(active) < self._workers:
+                path = pending.pop(0)
+                logger.debug(f"Start collection for '{path}'")
+
+                worker = FileSystemWorker(
+                    path, self._filesystems[path], output, self._read_workers, priority,
+                    file_queue_size, chunk_queue_size)
+                worker.start()
+                active.append(worker)
+
+            for worker in list(active):
+                message, _ = worker.queue.get_timed()
+
+                if message is END_OF_COLLECTION:
+                    worker.join()
+                    active.remove(worker)
+
+                    for skipped in worker.skipped:
+                        output.add_skipped(*skipped)
+                else:
+                    labels, path_object = message
+                    start = time.monotonic()
+
+                    memory.check('write')
+                    collect_labels(output, path_object, labels)
+                    path_object.drain()
+
+                    if output.is_archived(path_object):
+                        worker.mark_archived(path_object)
+
+                    metrics.stage_time('write', busy=time.monotonic() - start - path_object.waited, items=1)
 
-    def collect(self, output):
+        metrics.stage_workers_done('write', 1)
+
+    def plan(self, planner):
+        # Only metadata is needed, there is nothing to read ahead
         for path in list(self._filesystems):
-            logger.debug(f"Start collection for '{path}'")
-            self._filesystems[path].collect(output)
+            self._filesystems[path].collect(planner)
 
     def register_source(self, artifact_definition, artifact_source, variables):
         supported = False
 
         if artifact_source.type_indicator in [artifacts.definitions.TYPE_INDICATOR_FILE, artifacts.definitions.TYPE_INDICATOR_PATH, FILE_INFO_TYPE]:
             supported = True
+            read_options = get_read_options(artifact_definition, self._read_options)
+            priority = get_priority(artifact_definition, self._priorities)
 
             for p in artifact_source.paths:
                 for sp in variables.substitute(p):
                     if artifact_source.type_indicator == artifacts.definitions.TYPE_INDICATOR_PATH and (sp[-1] != '*'):
                         sp = f"{sp}/**-1"
-                    self.add_pattern(artifact_definition.name, sp, artifact_source.type_indicator)
+                    self.add_pattern(artifact_definition.name, sp, artifact_source.type_indicator, read_options, priority)
 
         return supported
-
-
-class FileInfoSourceType(FileSourceType):
-    """Custom Source Type to collect file info instead of content"""
-    TYPE_INDICATOR = FILE_INFO_TYPE
-
-
-# register custom source type
-artifacts.registry.ArtifactDefinitionsRegistry.RegisterSourceType(FileInfoSourceType)
-artifacts.source_type.SourceTypeFactory.RegisterSourceType(FileInfoSourceType)
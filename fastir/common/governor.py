@@ -0,0 +1,124 @@
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+from .logging import logger, PROGRESS
+
+
+class TokenBucket:
+    """Limit a rate (units per second), allowing bursts of one second.
+
+    Consumers going over the limit are put to sleep until their debt is paid back.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Consume tokens, sleeping if needed, and return the time spent sleeping"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+class Governor:
+    """Limit the resources used by the collection, to protect production hosts.
+
+    - reads from filesystems are limited to a number of bytes per second
+    - compression and hashing threads are limited to a share of a CPU, by sleeping
+      in proportion to the CPU time they used
+
+    Time spent throttled is recorded per stage. Without limits, the governor does nothing.
+    """
+
+    def __init__(self):
+        self._read_bucket = None
+        self._cpu_share = None
+
+        self._throttled = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_read_rate=None, cpu_share=None):
+        self._read_bucket = TokenBucket(max_read_rate) if max_read_rate else None
+        self._cpu_share = cpu_share if cpu_share and cpu_share < 1 else None
+
+    @property
+    def enabled(self):
+        return bool(self._read_bucket or self._cpu_share)
+
+    def _record(self, stage, duration):
+        if duration:
+            with self._lock:
+                self._throttled[stage] = self._throttled.get(stage, 0) + duration
+
+    def throttle_read(self, size):
+        """Account for size bytes read from a filesystem"""
+        if self._read_bucket:
+            self._record('read', self._read_bucket.consume(size))
+
+    @contextmanager
+    def cpu(self, stage):
+        """Limit the CPU share of the work done by the current thread within this context"""
+        if not self._cpu_share:
+            yield
+            return
+
+        start = time.thread_time()
+
+        try:
+            yield
+        finally:
+            used = time.thread_time() - start
+            wait = used * (1 - self._cpu_share) / self._cpu_share
+
+            if wait:
+                time.sleep(wait)
+                self._record(stage, wait)
+
+    def throttled(self):
+        """Time spent throttled per stage, in seconds"""
+        with self._lock:
+            return dict(self._throttled)
+
+    def report(self):
+        if self.enabled:
+            throttled = ', '.join(f"{stage} {duration:.1f}s" for stage, duration in sorted(self.throttled().items()))
+            logger.log(PROGRESS, f"Resource governor throttled: {throttled or 'nothing'}")
+
+
+def lower_priority():
+    """Lower the CPU and I/O priority of the current process"""
+    import psutil
+
+    process = psutil.Process()
+
+    try:
+        if sys.platform == 'win32':
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_VERYLOW)
+        else:
+            process.nice(19)
+
+            # I/O priorities are only supported on Linux
+            if hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+                process.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (psutil.Error, OSError) as e:
+        logger.warning(f"Could not lower process priority: {str(e)}")
+
+
+# Shared by all collectors and outputs of the process
+governor = Governor()
@@ -0,0 +1,53 @@
+import os
+
+import jsonlines
+
+from .logging import logger
+
+
+UNCHANGED = 'unchanged'
+CHANGED = 'changed'
+# Same size but different or unknown timestamps: only the content can tell
+AMBIGUOUS = 'ambiguous'
+
+
+class PreviousManifest:
+    """Manifest of a previous run, used to only collect new or changed files"""
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+
+        # The archive holding the content of the members, relative to the parent of the output directories
+        dirpath = os.path.dirname(os.path.abspath(path))
+        archive = os.path.basename(path).replace('-manifest.jsonl', '-files.zip')
+        self.archive = os.path.join(os.path.basename(dirpath), archive)
+
+        with jsonlines.open(path) as records:
+            for record in records:
+                self._records[record['path']] = record
+
+        logger.info(f"Loaded {len(self._records)} records from previous manifest '{path}'")
+
+    def __len__(self):
+        return len(self._records)
+
+    def compare(self, path, size, timestamps):
+        """Compare a file to its previous version, returns its status and the previous record"""
+        record = self._records.get(path)
+
+        if record is None or record['size'] != size:
+            return CHANGED, record
+
+        if timestamps and 'mtime' in record and 'ctime' in record:
+            if record['mtime'] == timestamps['mtime'] and record['ctime'] == timestamps['ctime']:
+                return UNCHANGED, record
+
+        if record.get('sha256'):
+            return AMBIGUOUS, record
+
+        return CHANGED, record
+
+    def reference(self, record):
+        """Archive holding the content of a previous record"""
+        return record.get('archive', self.archive)
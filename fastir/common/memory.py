@@ -0,0 +1,221 @@
+import mmap
+import tempfile
+import threading
+import time
+
+from .logging import logger, PROGRESS
+from .metrics import metrics
+
+
+# Memory usage is sampled at most this often by each stage, in seconds
+CHECK_INTERVAL = 0.2
+
+# Share of the limit above which caches are shrunk and buffers spilled to disk
+PRESSURE_THRESHOLD = 0.8
+
+# Caches are shrunk at most this often, as freed memory is not always returned to the system
+SHRINK_INTERVAL = 5
+
+# Share of the limit a single buffer may use before being spilled to disk
+BUFFER_SHARE = 1 / 32
+
+
+class MemoryMonitor:
+    """Keep the memory used by the collection under a limit, for small containers and old servers.
+
+    The resident set size (RSS) of the process is sampled by the stages of the
+    collection, and its peak recorded for each of them. Structures that can grow
+    with the size of the host (directory caches, buffered results, ...) are tracked:
+    when memory runs low, they are asked to shrink or to spill to temporary files.
+    Requests are only flags, applied by the thread owning each structure.
+
+    Without a limit, the monitor does nothing.
+    """
+
+    def __init__(self):
+        self._limit = None
+        self._process = None
+
+        self._structures = {}
+        self._last_checks = {}
+        self._last_shrink = 0
+        self._lock = threading.Lock()
+
+        self.pressure = False
+        self.peak = 0
+
+    def configure(self, max_memory=None):
+        self._limit = max_memory
+        self._structures = {}
+        self._last_checks = {}
+        self.pressure = False
+        self.peak = 0
+
+        if max_memory:
+            # psutil is only needed to sample memory usage
+            import psutil
+
+            self._process = psutil.Process()
+            metrics.memory_limit(max_memory)
+
+    @property
+    def enabled(self):
+        return bool(self._limit)
+
+    def share(self, default, share):
+        """Size allowed to a structure, when it can use up to `share` of the limit"""
+        if not self._limit:
+            return default
+
+        return min(default, int(self._limit * share))
+
+    def track(self, name, size, shrink=None):
+        """Track a structure, from a function returning its size and one requesting it to shrink"""
+        if self._limit:
+            with self._lock:
+                self._structures[name] = (size, shrink)
+
+    def untrack(self, name):
+        with self._lock:
+            self._structures.pop(name, None)
+
+    def should_spill(self, size):
+        """Whether a buffer of this size should be moved to disk"""
+        return bool(self._limit) and (self.pressure or size > self._limit * BUFFER_SHARE)
+
+    def check(self, stage):
+        """Sample memory usage for a stage, and release memory when it runs low"""
+        if not self._limit:
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            if now - self._last_checks.get(stage, 0) < CHECK_INTERVAL:
+                return
+
+            self._last_checks[stage] = now
+            structures = list(self._structures.items())
+
+        rss = self._process.memory_info().rss
+        self.peak = max(self.peak, rss)
+        metrics.memory_usage(stage, rss)
+
+        for name, (size, _) in structures:
+            metrics.structure_size(name, size())
+
+        self.pressure = rss > self._limit * PRESSURE_THRESHOLD
+
+        if self.pressure:
+            self._shrink(rss, structures, now)
+
+    def _shrink(self, rss, structures, now):
+        with self._lock:
+            if now - self._last_shrink < SHRINK_INTERVAL:
+                return
+
+            self._last_shrink = now
+
+        logger.info(f"Using {rss} bytes of memory (limit {self._limit}), shrinking caches and spilling buffers")
+        metrics.memory_shrink()
+
+        for _, (_, shrink) in structures:
+            if shrink:
+                shrink()
+
+    def report(self):
+        if self._limit:
+            logger.log(PROGRESS, f"Peak memory usage: {self.peak} bytes (limit {self._limit})")
+
+
+class SpillBuffer:
+    """Lines buffered in memory, moved to a temporary file when they grow too large or memory runs low"""
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+
+        self._lines = []
+        self._file = None
+        self._spill_requested = False
+
+        memory.track(name, lambda: self.size, self.request_spill)
+
+    def request_spill(self):
+        self._spill_requested = True
+
+    def append(self, line):
+        self._lines.append(line)
+        self.size += len(line)
+
+        if self._spill_requested or memory.should_spill(self.size):
+            self._spill()
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+
+        self._file.writelines(self._lines)
+        metrics.memory_spilled(self.name, self.size)
+
+        self._lines = []
+        self.size = 0
+        self._spill_requested = False
+
+    def __iter__(self):
+        if self._file:
+            self._file.seek(0)
+            yield from self._file
+
+        yield from self._lines
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+        memory.untrack(self.name)
+
+
+class ContentBuffer:
+    """Content of a file kept for parsing, in memory or in a temporary file when it is too large"""
+
+    def __init__(self, size):
+        self.size = 0
+        self._file = tempfile.TemporaryFile() if memory.should_spill(size) else None
+        self._chunks = []
+        self._mapping = None
+
+    def write(self, chunk):
+        if self._file:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+        self.size += len(chunk)
+
+    def getbuffer(self):
+        """Content as bytes, or mapped from the temporary file"""
+        if self._file is None:
+            return b''.join(self._chunks)
+
+        self._file.flush()
+        self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mapping
+
+    def close(self):
+        if self._mapping:
+            try:
+                self._mapping.close()
+            except BufferError:
+                # Still referenced by the parser, released with it
+                pass
+
+        if self._file:
+            self._file.close()
+
+        self._chunks = []
+
+
+# Shared by all collectors and outputs of the process
+memory = MemoryMonitor()
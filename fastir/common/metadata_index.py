@@ -0,0 +1,192 @@
+import struct
+from array import array
+from collections import defaultdict
+
+import pytsk3
+
+from .logging import logger
+
+
+NTFS_MFT_INODE = 0
+NTFS_BOOT_INODE = 7
+NTFS_DEFAULT_RECORD_SIZE = 1024
+NTFS_FIXUP_STRIDE = 512
+NTFS_RECORD_IN_USE = 0x01
+NTFS_RECORD_DIRECTORY = 0x02
+NTFS_ATTRIBUTE_FILE_NAME = 0x30
+NTFS_ATTRIBUTE_END = 0xFFFFFFFF
+NTFS_NAMESPACE_DOS = 2
+NTFS_REFERENCE_MASK = 0xFFFFFFFFFFFF
+NTFS_SEQUENCE_SHIFT = 48
+
+# Size of the blocks read from $MFT
+MFT_READ_SIZE = 4 * 1024 * 1024
+
+
+def parse_mft_record(record):
+    """Parse a raw MFT record.
+
+    Returns a tuple (flags, sequence, base record, names) where names is a list
+    of (parent entry, parent sequence, name) tuples, or None if the record is not
+    valid.
+    """
+    if record[:4] != b'FILE':
+        return None
+
+    record = bytearray(record)
+
+    # Apply the update sequence array (fixups)
+    usa_offset, usa_count = struct.unpack_from('<HH', record, 0x04)
+    usa = record[usa_offset:usa_offset + 2 * usa_count]
+
+    for i in range(1, usa_count):
+        position = i * NTFS_FIXUP_STRIDE - 2
+
+        if position + 2 > len(record) or len(usa) < 2 * (i + 1):
+            break
+
+        if record[position:position + 2] != usa[0:2]:
+            return None
+
+        record[position:position + 2] = usa[2 * i:2 * i + 2]
+
+    sequence = struct.unpack_from('<H', record, 0x10)[0]
+    attribute_offset, flags, used_size = struct.unpack_from('<HHI', record, 0x14)
+    base_record = struct.unpack_from('<Q', record, 0x20)[0] & NTFS_REFERENCE_MASK
+    used_size = min(used_size, len(record))
+
+    names = []
+    offset = attribute_offset
+
+    while offset + 16 <= used_size:
+        attribute_type, length = struct.unpack_from('<II', record, offset)
+
+        if attribute_type == NTFS_ATTRIBUTE_END or length == 0:
+            break
+
+        non_resident = record[offset + 8]
+
+        if attribute_type == NTFS_ATTRIBUTE_FILE_NAME and not non_resident:
+            content_length, content_offset = struct.unpack_from('<IH', record, offset + 0x10)
+            content = record[offset + content_offset:offset + content_offset + content_length]
+
+            if len(content) >= 0x42:
+                parent_reference = struct.unpack_from('<Q', content, 0)[0]
+                name_length = content[0x40]
+                namespace = content[0x41]
+
+                # DOS names are short aliases of a Win32 name, stored in another attribute
+                if namespace != NTFS_NAMESPACE_DOS:
+                    name = bytes(content[0x42:0x42 + 2 * name_length]).decode('utf-16-le', errors='replace')
+                    names.append((
+                        parent_reference & NTFS_REFERENCE_MASK, parent_reference >> NTFS_SEQUENCE_SHIFT, name))
+
+        offset += length
+
+    return flags, sequence, base_record, names
+
+
+class MetadataIndex:
+    """In-memory parent/child index of the allocated entries of an NTFS filesystem.
+
+    Entries are (name, inode, meta_type) tuples, indexed by the inode of their
+    parent directory. The index is built from a sequential read of $MFT: other
+    filesystems have no such table, and are walked directory by directory.
+    """
+
+    def __init__(self):
+        self._children = defaultdict(list)
+        self.entries = 0
+
+    def add(self, parent, name, inode, meta_type):
+        self._children[parent].append((name, inode, meta_type))
+        self.entries += 1
+
+    def children(self, inode):
+        return self._children.get(inode, [])
+
+    @staticmethod
+    def supported(fs_info):
+        return bool(int(fs_info.info.ftype) & int(pytsk3.TSK_FS_TYPE_NTFS_DETECT))
+
+    @classmethod
+    def build(cls, fs_info):
+        index = cls()
+        index._build_from_mft(fs_info)
+
+        return index
+
+    def _build_from_mft(self, fs_info):
+        """Read $MFT sequentially, in entry order."""
+        record_size = self._get_mft_record_size(fs_info)
+        mft = fs_info.open_meta(inode=NTFS_MFT_INODE)
+        size = mft.info.meta.size
+        read_size = MFT_READ_SIZE - MFT_READ_SIZE % record_size
+
+        flags = bytearray()
+        sequences = array('H')
+        names = []
+        offset = 0
+
+        while offset < size:
+            data = mft.read_random(offset, min(read_size, size - offset))
+            if not data:
+                break
+
+            for position in range(0, len(data) - record_size + 1, record_size):
+                entry = (offset + position) // record_size
+                result = parse_mft_record(data[position:position + record_size])
+                flags.append(0)
+                sequences.append(0)
+
+                if result:
+                    record_flags, sequence, base_record, record_names = result
+
+                    if base_record:
+                        # Extension record: its attributes belong to the base record
+                        entry = base_record
+                    else:
+                        flags[entry] = record_flags & 0xFF
+                        sequences[entry] = sequence
+
+                    for parent, parent_sequence, name in record_names:
+                        names.append((parent, parent_sequence, name, entry))
+
+            offset += len(data)
+
+        root = fs_info.info.root_inum
+        orphans = 0
+
+        for parent, parent_sequence, name, entry in names:
+            if entry == root or entry >= len(flags) or not flags[entry] & NTFS_RECORD_IN_USE:
+                continue
+
+            # The parent record was reused by another file since this entry was created
+            if parent >= len(flags) or not flags[parent] & NTFS_RECORD_IN_USE or sequences[parent] != parent_sequence:
+                orphans += 1
+                continue
+
+            if flags[entry] & NTFS_RECORD_DIRECTORY:
+                meta_type = pytsk3.TSK_FS_META_TYPE_DIR
+            else:
+                meta_type = pytsk3.TSK_FS_META_TYPE_REG
+
+            self.add(parent, name, entry, meta_type)
+
+        if orphans:
+            logger.debug(f"Ignored {orphans} entries whose parent directory no longer exists")
+
+    def _get_mft_record_size(self, fs_info):
+        try:
+            boot = fs_info.open_meta(inode=NTFS_BOOT_INODE).read_random(0, 512)
+            bytes_per_sector, sectors_per_cluster = struct.unpack_from('<HB', boot, 0x0B)
+            clusters_per_record = struct.unpack_from('<b', boot, 0x40)[0]
+
+            if clusters_per_record > 0:
+                return clusters_per_record * bytes_per_sector * sectors_per_cluster
+            elif clusters_per_record < 0:
+                return 2 ** -clusters_per_record
+        except (OSError, struct.error) as e:
+            logger.warning(f"Could not read NTFS boot sector: {str(e)}")
+
+        return NTFS_DEFAULT_RECORD_SIZE
@@ -0,0 +1,193 @@
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+ARTIFACT_COUNTERS = [
+    'wall_time', 'files_collected', 'bytes_read', 'bytes_written', 'cache_hits',
+    'commands', 'wmi_queries', 'registry_values', 'skipped'
+]
+PATTERN_COUNTERS = ['listing_time', 'directories_listed', 'entries_examined', 'files_matched', 'cache_hits']
+STAGE_COUNTERS = ['workers', 'items', 'busy', 'idle', 'blocked']
+
+
+class Metrics:
+    """Counters of the run, per artifact and per pattern.
+
+    Work done while enumerating paths (directory listings) is attributed to the
+    patterns being resolved by the current thread. A directory listing shared by
+    several patterns is counted for each of them.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = time.monotonic()
+
+        self._artifacts = defaultdict(lambda: dict.fromkeys(ARTIFACT_COUNTERS, 0))
+        self._patterns = defaultdict(lambda: dict.fromkeys(PATTERN_COUNTERS, 0))
+        self._pattern_artifacts = defaultdict(set)
+        self._stages = defaultdict(float)
+        self._expansions = {}
+        self._pipeline = defaultdict(lambda: dict.fromkeys(STAGE_COUNTERS, 0))
+        self._running = defaultdict(int)
+        self._queues = defaultdict(lambda: {'size': 0, 'max_depth': 0, 'depth_total': 0, 'samples': 0})
+        self._memory = {
+            'limit': None,
+            'peak_rss': 0,
+            'stages': defaultdict(int),
+            'structures': defaultdict(int),
+            'shrinks': 0,
+            'spilled': defaultdict(int)
+        }
+
+    def add_pattern(self, pattern, artifact):
+        with self._lock:
+            self._pattern_artifacts[pattern].add(artifact)
+
+    def set_patterns(self, patterns):
+        """Set the patterns resolved by the current thread, return the previous ones"""
+        previous = getattr(self._local, 'patterns', ())
+        self._local.patterns = patterns
+
+        return previous
+
+    def count_current(self, counter, value=1):
+        """Count for the patterns resolved by the current thread"""
+        patterns = getattr(self._local, 'patterns', ())
+
+        if patterns:
+            with self._lock:
+                for pattern in patterns:
+                    self._patterns[pattern][counter] += value
+
+    def count_pattern(self, pattern, counter, value=1):
+        with self._lock:
+            self._patterns[pattern][counter] += value
+
+    def directory_listed(self, entries, duration):
+        patterns = getattr(self._local, 'patterns', ())
+
+        if patterns:
+            with self._lock:
+                for pattern in patterns:
+                    counters = self._patterns[pattern]
+                    counters['directories_listed'] += 1
+                    counters['entries_examined'] += entries
+                    counters['listing_time'] += duration
+
+    def pattern_expanded(self, pattern, count):
+        """Number of concrete values a pattern with variables expanded into"""
+        with self._lock:
+            self._expansions[pattern] = count
+
+    def count_artifact(self, artifact, counter, value=1):
+        with self._lock:
+            self._artifacts[artifact][counter] += value
+
+    def stage(self, name, duration):
+        with self._lock:
+            self._stages[name] += duration
+
+    def stage_workers(self, stage, workers):
+        """Declare threads starting to work for a stage of the collection pipeline.
+
+        Stages are run several times (by each collection pass, or for each volume):
+        their number of workers is the largest number of threads working at once.
+        """
+        with self._lock:
+            self._running[stage] += workers
+            self._pipeline[stage]['workers'] = max(self._pipeline[stage]['workers'], self._running[stage])
+
+    def stage_workers_done(self, stage, workers):
+        """Declare threads that stopped working for a stage"""
+        with self._lock:
+            self._running[stage] -= workers
+
+    def stage_time(self, stage, busy=0, idle=0, blocked=0, items=0):
+        """Time a pipeline stage spent working, waiting for input, or blocked on its output"""
+        with self._lock:
+            counters = self._pipeline[stage]
+            counters['busy'] += busy
+            counters['idle'] += idle
+            counters['blocked'] += blocked
+            counters['items'] += items
+
+    def queue_depth(self, queue, size, depth):
+        with self._lock:
+            counters = self._queues[queue]
+            counters['size'] = size
+            counters['max_depth'] = max(counters['max_depth'], depth)
+            counters['depth_total'] += depth
+            counters['samples'] += 1
+
+    def memory_limit(self, limit):
+        with self._lock:
+            self._memory['limit'] = limit
+
+    def memory_usage(self, stage, rss):
+        """Record the memory used by the process (RSS) while a stage was running"""
+        with self._lock:
+            self._memory['peak_rss'] = max(self._memory['peak_rss'], rss)
+            self._memory['stages'][stage] = max(self._memory['stages'][stage], rss)
+
+    def structure_size(self, name, size):
+        with self._lock:
+            self._memory['structures'][name] = max(self._memory['structures'][name], size)
+
+    def memory_shrink(self):
+        with self._lock:
+            self._memory['shrinks'] += 1
+
+    def memory_spilled(self, name, size):
+        with self._lock:
+            self._memory['spilled'][name] += size
+
+    def _memory_dict(self):
+        return {key: dict(value) if isinstance(value, dict) else value for key, value in self._memory.items()}
+
+    def _pipeline_dict(self, wall_time):
+        stages = {}
+        for stage, counters in self._pipeline.items():
+            # Share of the time the threads of the stage were working
+            capacity = max(counters['workers'], 1) * wall_time
+            stages[stage] = dict(counters, utilization=counters['busy'] / capacity if capacity else 0)
+
+        queues = {}
+        for queue, counters in self._queues.items():
+            queues[queue] = {
+                'size': counters['size'],
+                'max_depth': counters['max_depth'],
+                'mean_depth': counters['depth_total'] / counters['samples'] if counters['samples'] else 0
+            }
+
+        return {'stages': stages, 'queues': queues}
+
+    def to_dict(self):
+        with self._lock:
+            patterns = {}
+            for pattern, artifacts in self._pattern_artifacts.items():
+                patterns[pattern] = dict(self._patterns[pattern], artifacts=sorted(artifacts))
+
+            wall_time = time.monotonic() - self._start
+
+            return {
+                'wall_time': wall_time,
+                'stages': dict(self._stages),
+                'artifacts': {artifact: dict(counters) for artifact, counters in self._artifacts.items()},
+                'patterns': patterns,
+                'expansions': dict(self._expansions),
+                'pipeline': self._pipeline_dict(wall_time),
+                'memory': self._memory_dict()
+            }
+
+    def write(self, out):
+        json.dump(self.to_dict(), out, indent=2)
+
+
+# Shared by all collectors and outputs of the process
+metrics = Metrics()
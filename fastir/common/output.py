@@ -1,14 +1,25 @@
 import os
+import re
+import zlib
 import hashlib
 import json
 import logging
-import zipfile
 import platform
+import time
 import jsonlines
 from datetime import datetime
+from contextlib import contextmanager
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from .sink import DirectorySink, StreamSink
+from .archive import Archive
 from .file_info import FileInfo
+from .file_info_cache import FileInfoCache
+from .manifest import PreviousManifest, UNCHANGED, AMBIGUOUS
+from .governor import governor
+from .memory import memory, SpillBuffer
+from .metrics import metrics
 from .logging import logger, PROGRESS
 
 
@@ -29,6 +40,55 @@ def parse_human_size(size):
             return int(size)
 
 
+# Results that can be converted to the nested JSON layout of previous versions
+LEGACY_RESULT_TYPES = ['commands', 'wmi', 'registry']
+
+# Member of each archive volume listing the files it holds
+VOLUME_INDEX = 'fastir-index.jsonl'
+
+HASH_WORKERS = 3
+# Hashing small chunks is faster than handing them over to another thread
+HASH_THREADING_THRESHOLD = 64 * 1024
+
+
+def command_output(jsonl_path, record):
+    """Output of a command record, read from its output file"""
+    with open(os.path.join(os.path.dirname(jsonl_path), record['output_file']), 'rb') as f:
+        return f.read().decode('utf-8', errors='replace')
+
+
+def results_to_json(jsonl_path, json_path, result_type):
+    """Convert JSONL results to the nested JSON layout of previous versions"""
+    if result_type == 'registry':
+        results = defaultdict(lambda: defaultdict(dict))
+    else:
+        results = defaultdict(dict)
+
+    with jsonlines.open(jsonl_path) as records:
+        for record in records:
+            if result_type == 'commands':
+                results[record['artifact']][record['command']] = command_output(jsonl_path, record)
+            elif result_type == 'wmi':
+                results[record['artifact']][record['query']] = record['output']
+            else:
+                results[record['artifact']][record['key']][record['name']] = {
+                    'value': record['value'],
+                    'type': record['type']
+                }
+
+    with open(json_path, 'w') as out:
+        json.dump(results, out, indent=2)
+
+
+def update_hash(h, chunk):
+    start = time.monotonic()
+
+    with governor.cpu('hashing'):
+        h.update(chunk)
+
+    metrics.stage_time('hash', busy=time.monotonic() - start)
+
+
 def normalize_filepath(filepath):
     # On Windows, make sure we remove the ':' behind the drive letter
     if filepath.index(os.path.sep) > 0:
@@ -37,20 +97,153 @@ def normalize_filepath(filepath):
     return filepath.encode('utf-8', 'backslashreplace').decode('utf-8')
 
 
+class ArchiveConsumer:
+    """Write the content of a file to the archive"""
+
+    def __init__(self, outputs, artifact, path_object, filename, identity, previous=None):
+        self._outputs = outputs
+        self._path_object = path_object
+        self._filename = filename
+        self._identity = identity
+
+        # Record of the previous run, when only the content can tell if the file changed
+        self._previous = previous
+
+        self.algorithms = ['sha256'] if outputs._sha256 or outputs._deduplicate or previous else []
+        self._size = 0
+        self._member = outputs._zip.open(filename)
+
+        # Artifacts collecting the same file while it is being read
+        self.artifacts = [artifact]
+        outputs._archiving[filename] = self
+
+    def update(self, chunk):
+        start = time.monotonic()
+
+        with governor.cpu('compression'):
+            self._member.write(chunk)
+
+        # With compression workers, this thread only waits for compressed blocks and writes them
+        if self._outputs._compression_workers <= 1:
+            metrics.stage_time('compress', busy=time.monotonic() - start)
+
+        self._size += len(chunk)
+
+    def abort(self):
+        self._member.close()
+        del self._outputs._archiving[self._filename]
+
+        # Partial content is not kept, so that the file can be read again
+        if self._outputs._zip.can_discard():
+            self._outputs._zip.discard_last()
+
+    def close(self, digests):
+        self._member.close()
+        del self._outputs._archiving[self._filename]
+
+        for artifact in self.artifacts:
+            metrics.count_artifact(artifact, 'bytes_written', self._outputs._zip.last_compressed_size())
+
+        self._outputs._archived(
+            self.artifacts, self._path_object, self._filename, self._identity, self._size, digests,
+            self._previous)
+
+
+class FileInfoConsumer:
+    """Compute information about a file"""
+
+    def __init__(self, outputs, artifact, info, cache_key=None):
+        self._outputs = outputs
+        self._artifact = artifact
+        self._info = info
+        self._cache_key = cache_key
+
+        self.artifacts = [artifact]
+
+        self.algorithms = info.algorithms
+
+    def update(self, chunk):
+        memory.check('sniff')
+
+        start = time.monotonic()
+        self._info.update(chunk)
+        metrics.stage_time('sniff', busy=time.monotonic() - start)
+
+    def abort(self):
+        pass
+
+    def close(self, digests):
+        start = time.monotonic()
+        results = self._info.get_results(digests)
+        metrics.stage_time('sniff', busy=time.monotonic() - start, items=1)
+
+        if self._outputs._file_info_cache:
+            self._outputs._file_info_cache.add(self._cache_key, FileInfo.cacheable_properties(results))
+
+        self._outputs._write_file_info(self._artifact, results)
+
+
 class Outputs:
-    def __init__(self, dirpath, maxsize, sha256):
+    def __init__(self, dirpath, maxsize, sha256, deduplicate=False,
+                 compression_level=zlib.Z_DEFAULT_COMPRESSION, compression_workers=1,
+                 file_info_cache=None, file_info_cache_size=None, previous_manifest=None, legacy_json=False,
+                 hash_workers=HASH_WORKERS, stream=None, volume_size=None, volume_members=None):
         self._dirpath = dirpath
+        self._stream = stream
+        metrics.reset()
 
         self._zip = None
         self._maxsize = parse_human_size(maxsize)
         self._sha256 = sha256
-
-        self._commands = defaultdict(dict)
-        self._wmi = defaultdict(dict)
-        self._registry = defaultdict(lambda: defaultdict(dict))
+        self._compression_level = compression_level
+        self._compression_workers = compression_workers
+        self._hash_workers = hash_workers
+
+        # Store files with the same identity (device, inode) or content only once
+        self._deduplicate = deduplicate
+        self._identities = {}
+        self._contents = {}
+        self._manifest = None
+        self._archiving = {}
+
+        # Files are archived in volumes of limited size or number of members, finalized as soon as they are full
+        self._volume_size = parse_human_size(volume_size)
+        self._volume_members = volume_members
+        self._volumes = 0
+        self._volume = None
+        self._volume_index = None
+
+        # Volume and SHA-256 of each member whose content was entirely written
+        self._members = {}
+
+        # Only collect files that are new or changed since a previous run
+        self._previous = PreviousManifest(previous_manifest) if previous_manifest else None
+
+        # Sources not collected in time are recorded when collecting before a deadline
+        self.deadline = None
+        self._skipped = 0
+
+        # Commands, WMI and registry results are written as soon as they are collected
+        self._results = {}
+        self._legacy_json = legacy_json
+        self._command_outputs = 0
+
+        # Files opened on the sink, closed at the end of the run
+        self._files = []
+        self._zip_file = None
+        self._log_file = None
 
         self._file_info = None
 
+        # File info of unchanged files is taken from previous runs
+        self._file_info_cache = None
+        if file_info_cache:
+            self._file_info_cache = FileInfoCache(file_info_cache, parse_human_size(file_info_cache_size))
+
+        # Consumers of the file being read once, see read_once()
+        self._batch = None
+        self._hash_executor = None
+
         self._init_output_()
 
     def _init_output_(self):
@@ -58,20 +251,36 @@ class Outputs:
         now = datetime.now().strftime(r'%Y%m%d%H%M%S')
 
         self._hostname = platform.node()
-        self._dirpath = os.path.join(self._dirpath, f"{now}-{self._hostname}")
+        name = self._name = f"{now}-{self._hostname}"
 
-        # Create the directory and set an environment variable that may be used in COMMAND artifacts
-        os.makedirs(self._dirpath)
-        os.environ['FAOUTPUTDIR'] = self._dirpath
+        if self._stream:
+            # Outputs are sent over the stream, and recreated in a directory with the same name by the receiver
+            self._sink = StreamSink(self._stream, name)
+            self._dirpath = None
+        else:
+            # Create the directory and set an environment variable that may be used in COMMAND artifacts
+            self._dirpath = os.path.join(self._dirpath, name)
+            self._sink = DirectorySink(self._dirpath)
+            os.environ['FAOUTPUTDIR'] = self._dirpath
 
         self._setup_logging()
 
-    def _setup_logging(self):
-        logfile = os.path.join(self._dirpath, f'{self._hostname}-logs.txt')
+        if self._legacy_json and not self._sink.local:
+            logger.warning('Results cannot be converted to legacy JSON files when outputs are streamed')
+            self._legacy_json = False
 
+    def _open(self, name, mode='w'):
+        f = self._sink.open(name, mode)
+        self._files.append(f)
+
+        return f
+
+    def _setup_logging(self):
         formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-        file_output = logging.FileHandler(logfile, 'w', 'utf-8')
+        self._log_file = self._sink.open(f'{self._hostname}-logs.txt', 'w')
+
+        file_output = logging.StreamHandler(self._log_file)
         file_output.setLevel(logging.INFO)
         file_output.setFormatter(formatter)
 
@@ -82,84 +291,466 @@ class Outputs:
         logger.addHandler(file_output)
         logger.addHandler(console_output)
 
+    def exceeds_maxsize(self, size):
+        return bool(self._maxsize) and size > self._maxsize
+
+    def deadline_exceeded(self, size=0):
+        """Reason why reading size bytes cannot be done before the deadline, None if it can"""
+        if self.deadline is None:
+            return None
+
+        if self.deadline.expired():
+            return 'deadline'
+
+        if size and not self.deadline.fits(size):
+            return 'not enough time before deadline'
+
+        return None
+
+    def add_skipped(self, artifact, source_type, item, reason):
+        logger.warning(f"Skipping {source_type} '{item}' for artifact '{artifact}': {reason}")
+        self._skipped += 1
+        metrics.count_artifact(artifact, 'skipped')
+
+        self._write_result('skipped', {
+            'artifact': artifact,
+            'type': source_type,
+            'item': item,
+            'reason': reason
+        })
+
+    def _skip_for_deadline(self, artifact, source_type, path_object, size):
+        reason = self.deadline_exceeded(size)
+
+        if reason:
+            self.add_skipped(artifact, source_type, path_object.path, reason)
+
+        return bool(reason)
+
+    @contextmanager
+    def read_once(self, path_object):
+        """Read the file only once for all the files and file info collected within this context"""
+        self._batch = []
+
+        try:
+            yield
+        finally:
+            consumers, self._batch = self._batch, None
+
+        if consumers:
+            self._read(path_object, consumers)
+
+    def _consume(self, path_object, consumer):
+        if self._batch is not None:
+            self._batch.append(consumer)
+        else:
+            self._read(path_object, [consumer])
+
+    def _update_hashes(self, hashes, chunk):
+        if len(hashes) > 1 and self._hash_workers > 1 and len(chunk) >= HASH_THREADING_THRESHOLD:
+            if self._hash_executor is None:
+                self._hash_executor = ThreadPoolExecutor(self._hash_workers, thread_name_prefix='hash')
+                metrics.stage_workers('hash', self._hash_workers)
+
+            return [self._hash_executor.submit(update_hash, h, chunk) for h in hashes.values()]
+
+        for h in hashes.values():
+            update_hash(h, chunk)
+
+        return []
+
+    def _read(self, path_object, consumers):
+        """Read the file content and send it to all consumers.
+
+        Each hash algorithm is computed once for all consumers, on worker threads
+        (hashlib releases the GIL), while consumers process the chunk.
+        """
+        hashes = {}
+        for consumer in consumers:
+            for algorithm in consumer.algorithms:
+                hashes.setdefault(algorithm, hashlib.new(algorithm))
+
+        start = time.monotonic()
+        size = 0
+
+        try:
+            for chunk in path_object.read_chunks():
+                size += len(chunk)
+                futures = self._update_hashes(hashes, chunk)
+
+                for consumer in consumers:
+                    consumer.update(chunk)
+
+                for future in futures:
+                    future.result()
+        except Exception:
+            for consumer in consumers:
+                consumer.abort()
+
+            raise
+
+        duration = time.monotonic() - start
+
+        # Measured throughput is used to estimate the time needed to read the next files
+        if self.deadline:
+            self.deadline.record_read(size, duration)
+
+        # A file read once for several artifacts counts for each of them
+        for artifact in {artifact for consumer in consumers for artifact in consumer.artifacts}:
+            metrics.count_artifact(artifact, 'bytes_read', size)
+            metrics.count_artifact(artifact, 'wall_time', duration)
+
+        digests = {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+        for consumer in consumers:
+            consumer.close(digests)
+
+    def has_cached_file_info(self, path_object):
+        """Whether the file info of this path object can be produced without reading it"""
+        if self._file_info_cache is None:
+            return False
+
+        return FileInfoCache.key(path_object) in self._file_info_cache
+
     def add_collected_file_info(self, artifact, path_object):
         info = FileInfo(path_object)
 
-        if not self._maxsize or info.size <= self._maxsize:
-            # Open the result file if this is the first time it is needed
-            if self._file_info is None:
-                self._file_info = jsonlines.open(
-                    os.path.join(self._dirpath, f'{self._hostname}-file_info.jsonl'), 'w')
+        if not self.exceeds_maxsize(info.size):
+            cache_key = None
+
+            if self._file_info_cache:
+                cache_key = FileInfoCache.key(path_object)
+                properties = self._file_info_cache.get(cache_key, info.size)
+
+                if properties is not None:
+                    logger.info(f"Using cached file info for '{path_object.path}'")
+                    metrics.count_artifact(artifact, 'cache_hits')
+                    self._write_file_info(artifact, info.get_cached_results(properties))
+                    return
+
+            if self._skip_for_deadline(artifact, 'FILE_INFO', path_object, info.size):
+                return
+
+            self._consume(path_object, FileInfoConsumer(self, artifact, info, cache_key))
+
+    def _write_file_info(self, artifact, file_info):
+        # Open the result file if this is the first time it is needed
+        if self._file_info is None:
+            self._file_info = jsonlines.Writer(self._open(f'{self._hostname}-file_info.jsonl'))
+
+        file_info['labels'] = {'artifact': artifact}
+        metrics.count_artifact(artifact, 'files_collected')
+
+        self._file_info.write(file_info)
+
+    def _get_timestamps(self, path_object):
+        try:
+            return path_object.get_timestamps()
+        except Exception:
+            return None
+
+    def _add_to_manifest(self, artifact, path_object, member, size, sha256=None, deduplicated=False, previous=None):
+        if self._manifest is None:
+            self._manifest = jsonlines.Writer(self._open(f'{self._hostname}-manifest.jsonl'))
+
+        record = {
+            'artifact': artifact,
+            'path': path_object.path,
+            'member': member,
+            'size': size
+        }
+        metrics.count_artifact(artifact, 'files_collected')
+
+        # Timestamps are used to find unchanged files in the next runs
+        timestamps = self._get_timestamps(path_object)
+        if timestamps:
+            record.update(timestamps)
+
+        if sha256:
+            record['sha256'] = sha256
+
+        # Only a range or the allocated runs of the file were read
+        if path_object.layout:
+            record['layout'] = path_object.layout
+
+        if deduplicated:
+            record['deduplicated'] = True
+
+        # The content is in the archive of a previous run
+        if previous:
+            record['unchanged'] = True
+            record['archive'] = self._previous.reference(previous)
+        elif self._has_volumes():
+            volume, _ = self._members.get(member, (self._volume, None))
+            record['archive'] = f'{self._name}/{volume}'
+
+            if volume == self._volume:
+                self._volume_index.append(json.dumps(record).encode('utf-8') + b'\n')
+
+        self._manifest.write(record)
 
-            file_info = info.compute()
-            file_info['labels'] = {'artifact': artifact}
+    def _compare_to_previous(self, path_object, size):
+        if self._previous is None:
+            return None, None
 
-            self._file_info.write(file_info)
+        return self._previous.compare(path_object.path, size, self._get_timestamps(path_object))
+
+    def is_unchanged(self, path_object):
+        """Whether the file can be skipped without reading it, because it did not change since the previous run"""
+        status, _ = self._compare_to_previous(path_object, path_object.get_size())
+
+        return status == UNCHANGED
 
     def add_collected_file(self, artifact, path_object):
         logger.info(f"Collecting file '{path_object.path}' for artifact '{artifact}'")
 
-        # Make sure to create the file if it do not exists
-        if self._zip is None:
-            self._zip = zipfile.ZipFile(
-                os.path.join(self._dirpath, f'{self._hostname}-files.zip'), 'w', zipfile.ZIP_DEFLATED)
-
-        if not self._maxsize or path_object.get_size() <= self._maxsize:
-            # Write file content to zipfile
-            filename = normalize_filepath(path_object.path)
-
-            if filename not in self._zip.namelist():
-                zinfo = zipfile.ZipInfo(filename=filename)
-                zinfo.compress_type = zipfile.ZIP_DEFLATED
-
-                # Read/write by chunks to reduce memory footprint
-                if self._sha256:
-                    h = hashlib.sha256()
-                with self._zip._lock:
-                    with self._zip.open(zinfo, mode='w', force_zip64=True) as dest:
-                        for chunk in path_object.read_chunks():
-                            dest.write(chunk)
-                            if self._sha256:
-                                h.update(chunk)
-                if self._sha256:
-                    logger.info(f"File '{path_object.path}' has SHA-256 '{h.hexdigest()}'")
+        # Make sure to create the file if it do not exists, next volumes are created when they are needed
+        if self._zip is None and not self._volumes:
+            self._open_volume()
+
+        size = path_object.get_size()
+
+        if not self.exceeds_maxsize(size):
+            # Write file content to zipfile, files partially read have members of their own
+            filename = normalize_filepath(path_object.path) + path_object.member_suffix
+
+            # The member is not final until the file is read
+            if filename in self._archiving:
+                self._archiving[filename].artifacts.append(artifact)
+                return
+
+            # Only members whose content was entirely written are referenced
+            if filename in self._members:
+                _, sha256 = self._members[filename]
+                self._add_to_manifest(artifact, path_object, filename, size, sha256)
+                return
+
+            # Partial content of a file that failed to be read cannot be removed from a stream
+            if self._zip is not None and filename in self._zip:
+                logger.warning(f"Ignoring file '{path_object.path}' because it could not be read before")
+                return
+
+            status, previous = self._compare_to_previous(path_object, size)
+
+            if status == UNCHANGED:
+                logger.info(f"File '{path_object.path}' did not change since the previous run")
+                metrics.count_artifact(artifact, 'cache_hits')
+                self._add_to_manifest(
+                    artifact, path_object, previous['member'], size, previous.get('sha256'), previous=previous)
+                return
+
+            identity = None
+            if self._deduplicate:
+                identity = path_object.get_identity()
+
+                if identity in self._identities:
+                    member = self._identities[identity]
+                    _, sha256 = self._members[member]
+                    self._add_to_manifest(artifact, path_object, member, size, sha256, deduplicated=True)
+                    return
+
+            if status != AMBIGUOUS:
+                previous = None
+
+            if self._skip_for_deadline(artifact, 'FILE', path_object, size):
+                return
+
+            if self._zip is None:
+                self._open_volume()
+
+            self._consume(path_object, ArchiveConsumer(self, artifact, path_object, filename, identity, previous))
         else:
             logger.warning(f"Ignoring file '{path_object.path}' because of its size")
 
-    def add_collected_command(self, artifact, command, output):
+    def is_archived(self, path_object):
+        """Whether the content of a file was entirely written to the archive"""
+        return normalize_filepath(path_object.path) + path_object.member_suffix in self._members
+
+    def _archived(self, artifacts, path_object, filename, identity, size, digests, previous=None):
+        sha256 = digests.get('sha256')
+
+        if self._sha256:
+            logger.info(f"File '{path_object.path}' has SHA-256 '{sha256}'")
+
+        # The content did not change since the previous run, there is no need to keep it
+        if previous and previous['sha256'] == sha256 and self._zip.can_discard():
+            logger.info(f"File '{path_object.path}' did not change since the previous run")
+            self._zip.discard_last()
+
+            for artifact in artifacts:
+                self._add_to_manifest(artifact, path_object, previous['member'], size, sha256, previous=previous)
+            return
+
+        deduplicated = False
+        if self._deduplicate:
+            original = self._contents.setdefault((size, sha256), filename)
+
+            # The same content was already archived under another name
+            if original != filename and self._zip.can_discard():
+                self._zip.discard_last()
+                filename = original
+                deduplicated = True
+
+            if identity:
+                self._identities[identity] = filename
+
+        self._members.setdefault(filename, (self._volume, sha256))
+
+        for artifact in artifacts:
+            self._add_to_manifest(artifact, path_object, filename, size, sha256, deduplicated)
+
+        if self._volume_full():
+            self._close_volume()
+
+    def _has_volumes(self):
+        return bool(self._volume_size or self._volume_members)
+
+    def _open_volume(self):
+        if self._has_volumes():
+            self._volumes += 1
+            self._volume = f'{self._hostname}-files-{self._volumes:03d}.zip'
+            self._volume_index = SpillBuffer('volume_index')
+        else:
+            self._volume = f'{self._hostname}-files.zip'
+
+        self._zip_file = self._sink.open(self._volume, 'wb')
+        self._zip = Archive(self._zip_file, self._compression_level, self._compression_workers)
+
+    def _volume_full(self):
+        # A volume is closed once the file filling it is written, so it can exceed its size by one file
+        if not self._has_volumes() or self._archiving:
+            return False
+
+        return bool(
+            (self._volume_size and self._zip.size() >= self._volume_size)
+            or (self._volume_members and len(self._zip) >= self._volume_members))
+
+    def _close_volume(self):
+        if self._has_volumes():
+            # Each volume can be processed on its own, without the manifest
+            self._zip.write(VOLUME_INDEX, self._volume_index)
+            self._volume_index.close()
+
+        self._zip.close()
+        self._zip_file.close()
+
+        if self._has_volumes():
+            logger.log(PROGRESS, f"Archive volume '{self._volume}' is complete")
+
+        self._zip = None
+        self._volume = None
+
+    def _write_result(self, result_type, record):
+        memory.check('results')
+
+        # Open the result file if this is the first time it is needed
+        if result_type not in self._results:
+            self._results[result_type] = jsonlines.Writer(
+                self._open(f'{self._hostname}-{result_type}.jsonl'), flush=True)
+
+        self._results[result_type].write(record)
+
+    def command_output_name(self, artifact):
+        """Name of a new file where the output of a command is written"""
+        self._command_outputs += 1
+        name = re.sub(r'[^\w.-]', '_', artifact)
+
+        return f'{self._hostname}-commands/{self._command_outputs:05d}-{name}.txt'
+
+    def open_command_output(self, name):
+        """Open the file where the output of a command is written, from any thread"""
+        return self._sink.open(name, 'wb')
+
+    def add_collected_command_output(self, artifact, command, result):
         logger.info(f"Collecting command '{command}' for artifact '{artifact}'")
-        self._commands[artifact][command] = output.decode('utf-8', errors='replace')
+
+        record = {
+            'artifact': artifact,
+            'command': command,
+            'output_file': result.output_file,
+            'returncode': result.returncode
+        }
+
+        if result.timed_out:
+            record['timed_out'] = True
+
+        metrics.count_artifact(artifact, 'commands')
+        metrics.count_artifact(artifact, 'wall_time', result.duration)
+        metrics.count_artifact(artifact, 'bytes_written', result.size)
+
+        if result.truncated:
+            record['truncated'] = True
+
+        self._write_result('commands', record)
 
     def add_collected_wmi(self, artifact, query, output):
         logger.info(f"Collecting WMI query '{query}' for artifact '{artifact}'")
-        self._wmi[artifact][query] = output
+        metrics.count_artifact(artifact, 'wmi_queries')
+        self._write_result('wmi', {
+            'artifact': artifact,
+            'query': query,
+            'output': output
+        })
 
     def add_collected_registry_value(self, artifact, key, name, value, type_):
         logger.info(f"Collecting Reg value '{name}' from '{key}' for artifact '{artifact}'")
-        self._registry[artifact][key][name] = {
+        metrics.count_artifact(artifact, 'registry_values')
+        self._write_result('registry', {
+            'artifact': artifact,
+            'key': key,
+            'name': name,
             'value': value,
             'type': type_
-        }
+        })
 
     def close(self):
-        if self._zip:
-            self._zip.close()
+        if self._zip is not None:
+            self._close_volume()
 
-        if self._commands:
-            with open(os.path.join(self._dirpath, f'{self._hostname}-commands.json'), 'w') as out:
-                json.dump(self._commands, out, indent=2)
+        if self._hash_executor:
+            self._hash_executor.shutdown()
 
-        if self._wmi:
-            with open(os.path.join(self._dirpath, f'{self._hostname}-wmi.json'), 'w') as out:
-                json.dump(self._wmi, out, indent=2)
-
-        if self._registry:
-            with open(os.path.join(self._dirpath, f'{self._hostname}-registry.json'), 'w') as out:
-                json.dump(self._registry, out, indent=2)
+        for results in self._results.values():
+            results.close()
 
         if self._file_info:
             self._file_info.close()
 
+        if self._manifest:
+            self._manifest.close()
+
+        for f in self._files:
+            f.close()
+
+        for result_type in self._results:
+            if self._legacy_json and result_type in LEGACY_RESULT_TYPES:
+                jsonl_path = os.path.join(self._dirpath, f'{self._hostname}-{result_type}.jsonl')
+                results_to_json(
+                    jsonl_path, os.path.join(self._dirpath, f'{self._hostname}-{result_type}.json'), result_type)
+                os.remove(jsonl_path)
+
+        if self._skipped:
+            logger.log(PROGRESS, f"Skipped {self._skipped} sources because of the deadline, see '{self._hostname}-skipped.jsonl'")
+
+        if self._file_info_cache:
+            stats = self._file_info_cache.stats()
+            logger.log(
+                PROGRESS,
+                f"File info cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"(hit ratio {stats['hit_ratio']:.1%}), {stats['bytes_saved']} bytes not read")
+
+            try:
+                entries = self._file_info_cache.save()
+                logger.info(f"Saved {entries} entries to file info cache '{self._file_info_cache.path}'")
+            except OSError as e:
+                logger.error(f"Could not save file info cache '{self._file_info_cache.path}': {str(e)}")
+
+        with self._sink.open(f'{self._hostname}-metrics.json', 'w') as out:
+            metrics.write(out)
+
         for handler in logger.handlers[:]:
             handler.close()
             logger.removeHandler(handler)
+
+        self._log_file.close()
+        self._sink.close()
@@ -1,7 +1,15 @@
+import os
+import time
 from fnmatch import fnmatch
 
+from .metrics import metrics
+
 
 class PathObject:
+    # Only set for files of which only a part is collected, see PartialPathObject
+    layout = None
+    member_suffix = ''
+
     def __init__(self, filesystem, name, path, obj=None):
         self.filesystem = filesystem
         self.name = name
@@ -18,28 +26,144 @@ class PathObject:
         return self.filesystem.is_symlink(self)
 
     def list_directory(self):
-        return self.filesystem.list_directory(self)
+        start = time.perf_counter()
+        entries = self.filesystem.list_directory(self)
+
+        if not isinstance(entries, list):
+            entries = list(entries or [])
+
+        metrics.directory_listed(len(entries), time.perf_counter() - start)
+
+        return entries
 
     def get_path(self, path):
         return self.filesystem.get_path(self, path)
 
-    def read_chunks(self):
-        return self.filesystem.read_chunks(self)
+    def read_chunks(self, start=0, end=None):
+        return self.filesystem.read_chunks(self, start, end)
 
     def get_size(self):
         return self.filesystem.get_size(self)
 
+    def get_identity(self):
+        return self.filesystem.get_identity(self)
+
+    def get_timestamps(self):
+        return self.filesystem.get_timestamps(self)
+
+
+def resolve_range(read_range, size):
+    """Bounds of a ('head', n), ('tail', n) or (start, end) range within a file"""
+    kind, value = read_range
+
+    if kind == 'head':
+        return 0, min(value, size)
+    elif kind == 'tail':
+        return max(size - value, 0), size
+
+    return min(kind, size), min(value, size)
+
+
+class PartialPathObject(PathObject):
+    """Path object of which only a range, or only allocated runs, are read.
+
+    The content is the concatenation of the runs read, and `layout` records where
+    they are in the file (and its full size), so that it can be reconstructed.
+    """
+
+    def __init__(self, path_object, read_range=None, sparse=False):
+        self.filesystem = path_object.filesystem
+        self.name = path_object.name
+        self.path = path_object.path
+
+        self._path_object = path_object
+        self._read_range = read_range
+        self._sparse = sparse
+        self._runs = None
+        self._file_size = None
+
+    @property
+    def obj(self):
+        return self._path_object.obj
+
+    def _get_runs(self):
+        if self._runs is None:
+            self._file_size = self._path_object.get_size()
+            start, end = resolve_range(self._read_range, self._file_size) if self._read_range else (0, self._file_size)
+
+            runs = self.filesystem.allocated_runs(self._path_object) if self._sparse else None
+            if runs is None:
+                runs = [(0, self._file_size)]
+
+            self._runs = [
+                (max(offset, start), min(offset + length, end) - max(offset, start))
+                for offset, length in runs
+                if offset < end and offset + length > start
+            ]
+
+        return self._runs
+
+    @property
+    def layout(self):
+        runs = self._get_runs()
+
+        return {
+            'file_size': self._file_size,
+            'runs': [list(run) for run in runs]
+        }
+
+    @property
+    def member_suffix(self):
+        suffix = ''
+
+        if self._read_range:
+            suffix += '.{}-{}'.format(*self._read_range)
+
+        if self._sparse:
+            suffix += '.sparse'
+
+        return suffix
+
+    def read_chunks(self):
+        for offset, length in self._get_runs():
+            yield from self._path_object.read_chunks(offset, offset + length)
+
+    def get_size(self):
+        return sum(length for _, length in self._get_runs())
+
+    def get_identity(self):
+        identity = self._path_object.get_identity()
+
+        # The same file is not the same content when other parts of it are read
+        return identity + (self.member_suffix,) if identity else identity
+
+    def get_timestamps(self):
+        return self._path_object.get_timestamps()
+
 
 class PathComponent:
+    # Whether generating paths requires the listing of the parent directory
+    lists_directory = True
+
     def __init__(self, directory):
         self._directory = directory
         self._generator = None
 
+    @property
+    def key(self):
+        """Identify components that always produce the same paths from a given parent"""
+        raise NotImplementedError
+
     def get_generator(self, generator):
         self._generator = generator
         return self._generate
 
     def _generate(self):
+        for parent in self._generator():
+            yield from self.generate_from(parent)
+
+    def generate_from(self, parent, entries=None):
+        """Generate matching paths from parent, using its listing if it is already known"""
         raise NotImplementedError
 
 
@@ -49,13 +173,19 @@ class RecursionPathComponent(PathComponent):
 
         self.max_depth = max_depth or 3
 
-    def _generate(self):
-        for parent in self._generator():
-            yield from self._recurse_from_dir(parent, depth=0)
+    @property
+    def key(self):
+        return ('recursion', self._directory, self.max_depth)
 
-    def _recurse_from_dir(self, parent, depth):
+    def generate_from(self, parent, entries=None):
+        yield from self._recurse_from_dir(parent, 0, entries)
+
+    def _recurse_from_dir(self, parent, depth, entries=None):
         if depth < self.max_depth or self.max_depth == -1:
-            for path in parent.list_directory():
+            if entries is None:
+                entries = parent.list_directory()
+
+            for path in entries:
                 if path.is_directory():
                     yield from self._recurse_from_dir(path, depth + 1)
 
@@ -73,28 +203,128 @@ class GlobPathComponent(PathComponent):
 
         self._path = path
 
-    def _generate(self):
-        for parent in self._generator():
-            for path in parent.list_directory():
-                if fnmatch(path.name, self._path):
-                    if self._directory and path.is_directory():
-                        yield path
-                    elif not self._directory and path.is_file():
-                        yield path
+    @property
+    def key(self):
+        return ('glob', self._directory, os.path.normcase(self._path))
+
+    def generate_from(self, parent, entries=None):
+        if entries is None:
+            entries = parent.list_directory()
+
+        for path in entries:
+            if fnmatch(path.name, self._path):
+                if self._directory and path.is_directory():
+                    yield path
+                elif not self._directory and path.is_file():
+                    yield path
 
 
 class RegularPathComponent(PathComponent):
+    lists_directory = False
+
     def __init__(self, directory, path):
         super().__init__(directory)
 
         self._path = path
 
-    def _generate(self):
-        for parent in self._generator():
-            path = parent.get_path(self._path)
+    @property
+    def key(self):
+        return ('regular', self._directory, os.path.normcase(self._path))
 
-            if path:
-                if self._directory and path.is_directory():
-                    yield path
-                elif not self._directory and path.is_file():
-                    yield path
+    def generate_from(self, parent, entries=None):
+        path = parent.get_path(self._path)
+
+        if path:
+            if self._directory and path.is_directory():
+                yield path
+            elif not self._directory and path.is_file():
+                yield path
+
+
+class PathTreeNode:
+    def __init__(self, component):
+        self.component = component
+        self.children = {}
+        self.labels = []
+
+        # Patterns going through this node, and patterns ending there
+        self.patterns = ()
+        self.ending_patterns = ()
+
+
+class PathTree:
+    """Prefix tree of parsed patterns.
+
+    Patterns sharing the same leading components share the same nodes, so that
+    every directory is only walked once whatever the number of patterns going
+    through it. Each leaf holds the labels (artifact, source type) of all the
+    patterns ending there.
+    """
+
+    def __init__(self):
+        self._root = PathTreeNode(None)
+
+        # Patterns with matches taken by the consumer of a walk, and patterns entirely walked
+        self.yielded_patterns = set()
+        self.enumerated_patterns = set()
+
+    def add(self, components, label, pattern=None):
+        node = self._root
+
+        for component in components:
+            if component.key not in node.children:
+                node.children[component.key] = PathTreeNode(component)
+
+            node = node.children[component.key]
+
+            if pattern and pattern not in node.patterns:
+                node.patterns += (pattern,)
+
+        if label not in node.labels:
+            node.labels.append(label)
+
+        if pattern and pattern not in node.ending_patterns:
+            node.ending_patterns += (pattern,)
+
+    def walk(self, base_generator):
+        """Generate (path, labels) for every path matched by at least one pattern"""
+        for parent in base_generator():
+            yield from self._walk(self._root, parent)
+
+    def _walk(self, node, parent):
+        entries = None
+
+        # Directory listings are shared by all the children needing them
+        if sum(child.component.lists_directory for child in node.children.values()) > 1:
+            previous = metrics.set_patterns(
+                tuple({pattern for child in node.children.values() for pattern in child.patterns}))
+            entries = list(parent.list_directory() or [])
+            metrics.set_patterns(previous)
+
+        for child in node.children.values():
+            paths = child.component.generate_from(parent, entries)
+
+            while True:
+                # Work done while generating paths is attributed to the patterns of the child
+                previous = metrics.set_patterns(child.patterns)
+                path = next(paths, None)
+                metrics.set_patterns(previous)
+
+                if path is None:
+                    break
+
+                if child.labels:
+                    for pattern in child.ending_patterns:
+                        metrics.count_pattern(pattern, 'files_matched')
+
+                    yield path, child.labels
+
+                    # The consumer asked for the next path, so it took this one
+                    self.yielded_patterns.update(child.ending_patterns)
+
+                if child.children:
+                    yield from self._walk(child, path)
+
+            # Patterns never leave the child of the root holding their first component
+            if node is self._root:
+                self.enumerated_patterns.update(child.patterns)
@@ -0,0 +1,41 @@
+import time
+from queue import Queue
+
+from .metrics import metrics
+
+
+class StageQueue(Queue):
+    """Bounded queue between two stages of the collection.
+
+    Its depth is sampled on every put, and the time the producer spends blocked on a
+    full queue (backpressure) and the consumer spends waiting on an empty one (idle)
+    is recorded for their stages.
+    """
+
+    def __init__(self, name, maxsize, producer, consumer):
+        super().__init__(maxsize)
+
+        self.name = name
+        self._producer = producer
+        self._consumer = consumer
+
+    def put(self, item, block=True, timeout=None):
+        """Put an item, and return the time spent blocked"""
+        start = time.monotonic()
+        super().put(item, block, timeout)
+        blocked = time.monotonic() - start
+
+        metrics.queue_depth(self.name, self.maxsize, self.qsize())
+        metrics.stage_time(self._producer, blocked=blocked)
+
+        return blocked
+
+    def get_timed(self):
+        """Get an item, and return it with the time spent waiting for it"""
+        start = time.monotonic()
+        item = super().get()
+        idle = time.monotonic() - start
+
+        metrics.stage_time(self._consumer, idle=idle)
+
+        return item, idle
@@ -0,0 +1,151 @@
+import json
+import time
+import logging
+import platform
+from contextlib import contextmanager
+from collections import defaultdict
+
+from .deadline import DEFAULT_READ_THROUGHPUT
+from .output import parse_human_size
+from .logging import logger, PROGRESS
+
+
+# Bytes read from matched files to measure the read throughput of the host
+SAMPLE_SIZE = 8 * 1024 * 1024
+
+ARTIFACT_COUNTERS = ['files', 'bytes', 'file_info', 'too_large', 'commands', 'wmi_queries', 'registry_keys']
+
+
+class Planner:
+    """Output estimating what a collection would cost, without collecting anything.
+
+    Collectors resolve their sources as they would for a real collection, and report
+    them here: file sizes come from the metadata already known to filesystems (TSK or
+    stat), and only a small sample of file content is read to measure the read
+    throughput. Commands and WMI queries are counted, not run.
+    """
+
+    def __init__(self, maxsize=None, sample_size=SAMPLE_SIZE):
+        self._maxsize = parse_human_size(maxsize)
+        self._start = time.monotonic()
+
+        self._artifacts = defaultdict(lambda: dict.fromkeys(ARTIFACT_COUNTERS, 0))
+        self._paths = set()
+        self._bytes = 0
+
+        self._sample_size = sample_size
+        self._sampled_bytes = 0
+        self._sample_time = 0
+
+        # Nothing is collected, so there is no deadline to respect
+        self.deadline = None
+
+        self._console = logging.StreamHandler()
+        self._console.setLevel(PROGRESS)
+        self._console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(self._console)
+
+    def exceeds_maxsize(self, size):
+        return bool(self._maxsize) and size > self._maxsize
+
+    def deadline_exceeded(self, size=0):
+        return None
+
+    def add_skipped(self, artifact, source_type, item, reason):
+        pass
+
+    def _sample(self, path_object, size):
+        """Read the beginning of a file, while the sample is not complete"""
+        if self._sampled_bytes >= self._sample_size or size == 0:
+            return
+
+        start = time.monotonic()
+        read = 0
+
+        try:
+            for chunk in path_object.read_chunks():
+                read += len(chunk)
+
+                if self._sampled_bytes + read >= self._sample_size:
+                    break
+        except Exception as e:
+            logger.debug(f"Could not sample file '{path_object.path}': {str(e)}")
+            return
+
+        self._sampled_bytes += read
+        self._sample_time += time.monotonic() - start
+
+    def _add_file(self, artifact, path_object, counter):
+        try:
+            size = path_object.get_size()
+        except Exception as e:
+            logger.error(f"Error planning file '{path_object.path}': {str(e)}")
+            return
+
+        counters = self._artifacts[artifact]
+
+        if self.exceeds_maxsize(size):
+            counters['too_large'] += 1
+            return
+
+        counters[counter] += 1
+        counters['bytes'] += size
+
+        # Files collected for several artifacts (or as file info) are only read once
+        if path_object.path not in self._paths:
+            self._paths.add(path_object.path)
+            self._bytes += size
+            self._sample(path_object, size)
+
+    @contextmanager
+    def read_once(self, path_object):
+        yield
+
+    def add_collected_file(self, artifact, path_object):
+        self._add_file(artifact, path_object, 'files')
+
+    def add_collected_file_info(self, artifact, path_object):
+        self._add_file(artifact, path_object, 'file_info')
+
+    def add_planned(self, artifact, counter, count=1):
+        """Count commands, WMI queries or registry keys"""
+        self._artifacts[artifact][counter] += count
+
+    def read_throughput(self):
+        """Measured read throughput in bytes per second, None when nothing was read"""
+        if self._sampled_bytes and self._sample_time > 0:
+            return self._sampled_bytes / self._sample_time
+
+    def to_dict(self, expansions=None):
+        throughput = self.read_throughput()
+        totals = dict.fromkeys(ARTIFACT_COUNTERS, 0)
+
+        for counters in self._artifacts.values():
+            for counter, value in counters.items():
+                totals[counter] += value
+
+        return {
+            'hostname': platform.node(),
+            'planning_time': time.monotonic() - self._start,
+            'files': len(self._paths),
+            'bytes': self._bytes,
+            'read_throughput': throughput or DEFAULT_READ_THROUGHPUT,
+            'read_throughput_measured': throughput is not None,
+            'estimated_read_time': self._bytes / (throughput or DEFAULT_READ_THROUGHPUT),
+            'totals': totals,
+            'artifacts': {artifact: dict(counters) for artifact, counters in sorted(self._artifacts.items())},
+            'expansions': expansions or {}
+        }
+
+    def write(self, path, expansions=None):
+        plan = self.to_dict(expansions)
+
+        with open(path, 'w') as out:
+            json.dump(plan, out, indent=2)
+
+        logger.log(
+            PROGRESS,
+            f"Planned {plan['files']} files ({plan['bytes']} bytes, about {plan['estimated_read_time']:.0f}s to read), "
+            f"{plan['totals']['commands']} commands and {plan['totals']['wmi_queries']} WMI queries, see '{path}'")
+
+        logger.removeHandler(self._console)
@@ -0,0 +1,178 @@
+import io
+import os
+import sys
+import struct
+import socket
+import threading
+
+
+# Size of the data frames sent by streamed files
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+STREAM_MAGIC = b'FASTIR-STREAM\x01'
+
+# Frames: kind (1 byte), name length (2 bytes), data length (4 bytes), name, data
+FRAME_HEADER = struct.Struct('>cHI')
+FRAME_DATA = b'D'
+FRAME_CLOSE = b'C'
+FRAME_END = b'E'
+
+
+class DirectorySink:
+    """Output files written to a local directory"""
+
+    local = True
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+        os.makedirs(self.dirpath)
+
+    def path(self, name):
+        return os.path.join(self.dirpath, name)
+
+    def open(self, name, mode='wb'):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if 'b' in mode:
+            return open(path, mode)
+
+        return open(path, mode, encoding='utf-8')
+
+    def close(self):
+        pass
+
+
+class StreamedFile(io.RawIOBase):
+    """Write-only, unseekable file sent as data frames of a stream"""
+
+    def __init__(self, sink, name):
+        self._sink = sink
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self._sink.send(FRAME_DATA, self.name, bytes(data))
+
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._sink.send(FRAME_CLOSE, self.name)
+
+        super().close()
+
+
+class StreamSink:
+    """Output files multiplexed over a single stream (socket, pipe or stdout).
+
+    The stream never needs to seek: each file is sent as data frames appended to
+    it, followed by a close frame, and frames of files written by several threads
+    can be interleaved. Names are relative to `prefix`, the output directory
+    recreated by the receiver.
+    """
+
+    local = False
+
+    def __init__(self, stream, prefix):
+        self._stream = stream
+        self._prefix = prefix
+        self._lock = threading.Lock()
+
+        self._stream.write(STREAM_MAGIC)
+
+    def send(self, kind, name, data=b''):
+        name = name.encode('utf-8')
+
+        with self._lock:
+            self._stream.write(FRAME_HEADER.pack(kind, len(name), len(data)) + name)
+            self._stream.write(data)
+
+    def path(self, name):
+        return None
+
+    def open(self, name, mode='wb'):
+        buffered = io.BufferedWriter(StreamedFile(self, f'{self._prefix}/{name}'), STREAM_BUFFER_SIZE)
+
+        if 'b' in mode:
+            return buffered
+
+        return io.TextIOWrapper(buffered, encoding='utf-8')
+
+    def close(self):
+        self.send(FRAME_END, '')
+
+        with self._lock:
+            self._stream.flush()
+            self._stream.close()
+
+
+def open_stream(target, mode='wb'):
+    """Open a stream from a 'tcp:host:port', 'unix:path' or '-' (stdout/stdin) target"""
+    if target == '-':
+        return sys.stdout.buffer if 'w' in mode else sys.stdin.buffer
+
+    kind, _, address = target.partition(':')
+
+    if kind == 'tcp':
+        host, _, port = address.rpartition(':')
+        connection = socket.create_connection((host, int(port)))
+    elif kind == 'unix':
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    else:
+        raise ValueError(f"Unsupported stream target '{target}'")
+
+    return connection.makefile(mode)
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+
+    if len(data) != size:
+        raise EOFError('Truncated stream')
+
+    return data
+
+
+def receive(stream, dirpath):
+    """Recreate output directories from a stream, return the names of the files received"""
+    if read_exactly(stream, len(STREAM_MAGIC)) != STREAM_MAGIC:
+        raise ValueError('Not a FastIR Artifacts stream')
+
+    root = os.path.realpath(dirpath)
+    files = {}
+    received = []
+
+    try:
+        while True:
+            kind, name_size, data_size = FRAME_HEADER.unpack(read_exactly(stream, FRAME_HEADER.size))
+            name = read_exactly(stream, name_size).decode('utf-8')
+            data = read_exactly(stream, data_size)
+
+            if kind == FRAME_END:
+                break
+
+            # Files are only written inside the output directory
+            path = os.path.realpath(os.path.join(root, name))
+            if os.path.isabs(name) or os.path.commonpath([root, path]) != root:
+                raise ValueError(f"Invalid file name '{name}'")
+
+            if name not in files:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                files[name] = open(path, 'wb')
+                received.append(name)
+
+            if kind == FRAME_DATA:
+                files[name].write(data)
+            elif kind == FRAME_CLOSE:
+                files.pop(name).close()
+    finally:
+        for f in files.values():
+            f.close()
+
+    return received
@@ -0,0 +1,16 @@
+import artifacts.registry
+import artifacts.source_type
+from artifacts.source_type import FileSourceType
+
+
+FILE_INFO_TYPE = "FILE_INFO"
+
+
+class FileInfoSourceType(FileSourceType):
+    """Custom Source Type to collect file info instead of content"""
+    TYPE_INDICATOR = FILE_INFO_TYPE
+
+
+# register custom source type
+artifacts.registry.ArtifactDefinitionsRegistry.RegisterSourceType(FileInfoSourceType)
+artifacts.source_type.SourceTypeFactory.RegisterSourceType(FileInfoSourceType)
@@ -1,11 +1,26 @@
 import re
+from itertools import product
 
 from .logging import logger
+from .metrics import metrics
 
 
 class HostVariables:
+    """Host variables (%%users.homedir%%, %systemroot%, ...) substituted in artifact sources.
+
+    Patterns are split once into literal and variable segments, and expanded into
+    the cartesian product of the values of their variables (occurrences of the same
+    variable sharing a value). Results are memoized per pattern, and the number of
+    concrete values each pattern expanded into is kept in `expansions`.
+    """
+
     def __init__(self):
-        self._variables = []
+        self._variables = {}
+        self._variables_re = None
+        self._substituted = {}
+
+        self.expansions = {}
+        self._resolved = False
 
         self.init_variables()
         self.resolve_variables()
@@ -14,49 +29,82 @@ class HostVariables:
         raise NotImplementedError
 
     def resolve_variables(self):
-        for variable in self._variables:
-            values = variable['value']
-
-            if not isinstance(variable['value'], set):
-                values = set([values])
-
+        for variable in self._variables.values():
             resolved_values = set()
 
-            for value in values:
+            for value in variable['values']:
                 resolved_values.update(self.substitute(value))
 
-            variable['value'] = resolved_values
+            variable['values'] = resolved_values
+
+        # Patterns substituted before resolution may have used unresolved values
+        self._substituted = {}
+        self.expansions = {}
+        self._resolved = True
 
     def add_variable(self, name, value):
-        self._variables.append({
-            'name': name,
-            're': re.compile(re.escape(name), re.IGNORECASE),
-            'value': value
-        })
+        values = value if isinstance(value, set) else set([value])
 
-    def _substitute_value(self, original_value, variable_re, variable_value):
-        new_value, subs = variable_re.subn(variable_value.replace('\\', r'\\'), original_value)
+        # Variables added several times take all their values
+        variable = self._variables.setdefault(name.lower(), {'name': name, 'values': set()})
+        variable['values'].update(values)
 
-        if subs:
-            return self.substitute(new_value)
-        else:
-            return set()
+        self._variables_re = None
+        self._substituted = {}
 
-    def substitute(self, value):
-        values = set()
+    def _tokenize(self, pattern):
+        """Split a pattern into literal strings and variable keys (odd indexes)"""
+        if self._variables_re is None:
+            # Longest names first, so that a variable is not matched inside another one
+            names = sorted(self._variables, key=len, reverse=True)
+            self._variables_re = re.compile(
+                '({})'.format('|'.join(re.escape(name) for name in names)) if names else '(?!)', re.IGNORECASE)
+
+        segments = self._variables_re.split(pattern)
+        segments[1::2] = [segment.lower() for segment in segments[1::2]]
+
+        return segments
+
+    def _expand(self, pattern):
+        segments = self._tokenize(pattern)
+        literals = ''.join(segments[0::2])
+
+        if literals.count('%') >= 2:
+            logger.warning(f"Value '{pattern}' contains unsupported variables")
 
+        keys = list(dict.fromkeys(segments[1::2]))
+
+        if not keys:
+            return set([pattern])
+
+        # Values of variables can contain other variables until they are resolved
+        values = [
+            set().union(*(self.substitute(value) for value in self._variables[key]['values']))
+            for key in keys
+        ]
+
+        results = set()
+        for combination in product(*values):
+            chosen = dict(zip(keys, combination))
+            results.add(''.join(chosen[segment] if i % 2 else segment for i, segment in enumerate(segments)))
+
+        if not results:
+            logger.warning(f"Value '{pattern}' contains variables without values")
+            results.add(pattern)
+
+        return results
+
+    def substitute(self, value):
         if value.count('%') < 2:
-            values.add(value)
-        else:
-            for variable in self._variables:
-                if isinstance(variable['value'], set):
-                    for variable_value in variable['value']:
-                        values.update(self._substitute_value(value, variable['re'], variable_value))
-                else:
-                    values.update(self._substitute_value(value, variable['re'], variable['value']))
-
-            if not values:
-                logger.warning(f"Value '{value}' contains unsupported variables")
-                values.add(value)
-
-        return values
+            return set([value])
+
+        substituted = self._substituted.get(value)
+
+        if substituted is None:
+            substituted = self._substituted[value] = self._expand(value)
+
+            if self._resolved:
+                self.expansions[value] = len(substituted)
+                metrics.pattern_expanded(value, len(substituted))
+
+        return set(substituted)
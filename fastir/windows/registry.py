@@ -1,11 +1,13 @@
 import os
 import json
+import time
 import winreg
 
 import artifacts
 
 from fastir.common.filesystem import FileSystem
 from fastir.common.path_components import PathObject
+from fastir.common.metrics import metrics
 from fastir.common.collector import AbstractCollector
 
 
@@ -133,6 +135,11 @@ class RegistryCollector(AbstractCollector):
 
     def collect(self, output):
         for key in self._keys:
+            if output.deadline_exceeded():
+                output.add_skipped(key['artifact'], 'REGISTRY_KEY', f"{key['hive']}\\{key['key']}", 'deadline')
+                continue
+
+            start = time.monotonic()
             reader = RegistryReader(key['hive'], key['key'].lower())
 
             for key_to_collect in reader.keys_to_collect():
@@ -141,8 +148,15 @@ class RegistryCollector(AbstractCollector):
                         key['artifact'], key_to_collect.path, name, value, type_)
 
             reader.close()
+            metrics.count_artifact(key['artifact'], 'wall_time', time.monotonic() - start)
 
         for key_value in self._values:
+            if output.deadline_exceeded():
+                output.add_skipped(
+                    key_value['artifact'], 'REGISTRY_VALUE', f"{key_value['hive']}\\{key_value['key']}\\{key_value['value']}", 'deadline')
+                continue
+
+            start = time.monotonic()
             reader = RegistryReader(key_value['hive'], key_value['key'].lower())
 
             for key_to_collect in reader.keys_to_collect():
@@ -153,6 +167,14 @@ class RegistryCollector(AbstractCollector):
                         key_value['artifact'], key_to_collect.path, key_value['value'], value['value'], value['type'])
 
             reader.close()
+            metrics.count_artifact(key_value['artifact'], 'wall_time', time.monotonic() - start)
+
+    def plan(self, planner):
+        # Key patterns are resolved, but values are not read
+        for key in self._keys + self._values:
+            reader = RegistryReader(key['hive'], key['key'].lower())
+            planner.add_planned(key['artifact'], 'registry_keys', len(list(reader.keys_to_collect())))
+            reader.close()
 
     def register_source(self, artifact_definition, artifact_source, variables):
         supported = False
@@ -1,8 +1,11 @@
+import time
+
 import artifacts
 import pywintypes
 import win32com.client
 
 from fastir.common.logging import logger
+from fastir.common.metrics import metrics
 from fastir.common.collector import AbstractCollector
 
 
@@ -46,9 +49,20 @@ class WMIExecutor(AbstractCollector):
 
     def collect(self, output):
         for query in self._queries:
+            if output.deadline_exceeded():
+                output.add_skipped(query['artifact'], 'WMI', query['query'], 'deadline')
+                continue
+
+            start = time.monotonic()
             result = wmi_query(query['query'], query['base_object'])
+            metrics.count_artifact(query['artifact'], 'wall_time', time.monotonic() - start)
+
             output.add_collected_wmi(query['artifact'], query['query'], result)
 
+    def plan(self, planner):
+        for query in self._queries:
+            planner.add_planned(query['artifact'], 'wmi_queries')
+
     def register_source(self, artifact_definition, artifact_source, variables):
         if artifact_source.type_indicator == artifacts.definitions.TYPE_INDICATOR_WMI_QUERY:
             for query in variables.substitute(artifact_source.query):
@@ -6,8 +6,15 @@ import artifacts.reader
 import artifacts.definitions
 import configargparse
 
-from fastir.common.output import Outputs
+from fastir.common.plan import Planner
+from fastir.common.sink import open_stream
+from fastir.common.output import Outputs, parse_human_size
 from fastir.common.collector import Collector
+from fastir.common.artifacts_cache import ArtifactsCache
+from fastir.common.source_types import FileInfoSourceType  # noqa: F401 (registers the FILE_INFO source type)
+from fastir.common.deadline import Deadline
+from fastir.common.governor import governor, lower_priority
+from fastir.common.memory import memory
 from fastir.common.logging import logger, PROGRESS
 from fastir.common.helpers import get_operating_system
 
@@ -25,18 +32,28 @@ REGISTRY_TYPES = [
     artifacts.definitions.TYPE_INDICATOR_WINDOWS_REGISTRY_VALUE
 ]
 
+# Folder of the configuration file and of the artifacts cache shipped with a release
+APPLICATION_DIR = (os.path.dirname(__file__), os.path.dirname(sys.executable))[hasattr(sys, 'frozen')]
 
-def get_artifacts_registry(use_library, paths):
-    reader = artifacts.reader.YamlArtifactsReader()
-    registry = artifacts.registry.ArtifactDefinitionsRegistry()
+
+def get_definition_directories(use_library, paths):
+    directories = []
 
     if not paths or use_library:
-        path = os.path.join(sys.prefix, 'share', 'artifacts')
-        registry.ReadFromDirectory(reader, path)
+        directories.append(os.path.join(sys.prefix, 'share', 'artifacts'))
 
     if paths:
-        for path in paths:
-            registry.ReadFromDirectory(reader, path)
+        directories += paths
+
+    return directories
+
+
+def get_artifacts_registry(directories):
+    reader = artifacts.reader.YamlArtifactsReader()
+    registry = artifacts.registry.ArtifactDefinitionsRegistry()
+
+    for path in directories:
+        registry.ReadFromDirectory(reader, path)
 
     return registry
 
@@ -89,35 +106,151 @@ def get_artifacts_to_collect(registry, include, exclude, platform, collect_regis
             yield artifact_definition, artifact_source
 
 
+def get_artifacts_cache_path(path):
+    """Relative paths of the artifacts cache are relative to the folder of a release"""
+    if path and hasattr(sys, 'frozen'):
+        return os.path.join(APPLICATION_DIR, path)
+
+    return path
+
+
+def select_artifacts(arguments, platform, cache_path=None, directories=None):
+    """List (definition, source) pairs to collect, from the artifacts cache when possible"""
+    if directories is None:
+        directories = get_definition_directories(arguments.library, arguments.directory)
+
+    collect_registry = bool(arguments.include or (arguments.directory and not arguments.library))
+    parameters = {
+        'include': arguments.include,
+        'exclude': arguments.exclude,
+        'platform': platform,
+        'collect_registry': collect_registry
+    }
+
+    cache = ArtifactsCache(cache_path, directories) if cache_path else None
+
+    if cache:
+        selection = cache.get(parameters)
+
+        if selection is not None:
+            logger.info(f"Using artifacts cache '{cache_path}'")
+            return selection
+
+    artifacts_registry = get_artifacts_registry(directories)
+
+    include_artifacts = resolve_artifact_groups(artifacts_registry, arguments.include)
+    exclude_artifacts = resolve_artifact_groups(artifacts_registry, arguments.exclude)
+
+    selection = list(get_artifacts_to_collect(
+        artifacts_registry, include_artifacts, exclude_artifacts, platform, collect_registry))
+
+    if cache:
+        cache.set(parameters, selection)
+
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning(f"Could not save artifacts cache '{cache_path}': {str(e)}")
+
+    return selection
+
+
+def parse_priorities(priorities):
+    """Parse 'name:priority' pairs (comma-separated), names being artifact names or labels"""
+    parsed = {}
+
+    if priorities:
+        for item in priorities.split(','):
+            name, priority = item.rsplit(':', 1)
+            parsed[name.strip()] = int(priority)
+
+    return parsed
+
+
+def parse_range(value):
+    """Parse 'head:n', 'tail:n' or 'start-end' ranges, sizes being human sizes"""
+    if ':' in value:
+        kind, size = value.split(':', 1)
+
+        if kind not in ['head', 'tail']:
+            raise ValueError(f"Unsupported range '{value}'")
+
+        return kind, parse_human_size(size)
+
+    start, end = value.split('-', 1)
+
+    return parse_human_size(start) or 0, parse_human_size(end)
+
+
+def parse_read_options(sparse, ranges):
+    """Parse names whose files are read sparsely, and 'name:range' pairs (comma-separated)"""
+    parsed = {}
+
+    if sparse:
+        for name in sparse.split(','):
+            parsed.setdefault(name.strip(), {})['sparse'] = True
+
+    if ranges:
+        for item in ranges.split(','):
+            name, read_range = item.split(':', 1)
+            parsed.setdefault(name.strip(), {})['range'] = parse_range(read_range.strip())
+
+    return parsed
+
+
 def main(arguments):
     try:
         locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
     except locale.Error:
         pass
-    output = Outputs(arguments.output, arguments.maxsize, arguments.sha256)
 
-    logger.log(PROGRESS, "Loading artifacts ...")
+    if arguments.plan:
+        output = Planner(arguments.maxsize)
+    else:
+        output = Outputs(
+            arguments.output, arguments.maxsize, arguments.sha256, arguments.deduplicate,
+            arguments.compression_level, arguments.compression_workers,
+            arguments.file_info_cache, arguments.file_info_cache_size, arguments.previous_manifest,
+            arguments.legacy_json, arguments.hash_workers,
+            open_stream(arguments.stream) if arguments.stream else None,
+            arguments.volume_size, arguments.volume_members)
 
-    platform = get_operating_system()
-    collector = Collector(platform)
+    if arguments.low_priority:
+        lower_priority()
 
-    artifacts_registry = get_artifacts_registry(arguments.library, arguments.directory)
+    governor.configure(parse_human_size(arguments.max_read_rate), arguments.cpu_share)
+    memory.configure(parse_human_size(arguments.max_memory))
 
-    include_artifacts = resolve_artifact_groups(artifacts_registry, arguments.include)
-    exclude_artifacts = resolve_artifact_groups(artifacts_registry, arguments.exclude)
+    logger.log(PROGRESS, "Loading artifacts ...")
 
-    for artifact_definition, artifact_source in get_artifacts_to_collect(
-        artifacts_registry, include_artifacts, exclude_artifacts, platform,
-        arguments.include or (arguments.directory and not arguments.library)
-    ):
+    platform = get_operating_system()
+    tsk_options = {
+        'index': arguments.tsk_index,
+        'ordered_reads': arguments.ordered_reads
+    }
+    command_options = {
+        'workers': arguments.command_workers,
+        'timeout': arguments.command_timeout,
+        'max_output_size': parse_human_size(arguments.command_max_output)
+    }
+    deadline = Deadline(arguments.deadline) if arguments.deadline else None
+    collector = Collector(
+        platform, arguments.workers, tsk_options, command_options, deadline, parse_priorities(arguments.priorities),
+        arguments.read_workers, parse_read_options(arguments.sparse, arguments.ranges))
+
+    for artifact_definition, artifact_source in select_artifacts(
+            arguments, platform, get_artifacts_cache_path(arguments.artifacts_cache)):
         collector.register_source(artifact_definition, artifact_source)
 
-    collector.collect(output)
+    if arguments.plan:
+        collector.plan(output, arguments.plan)
+    else:
+        collector.collect(output)
 
 
 if __name__ == "__main__":
     parser = configargparse.ArgumentParser(
-        default_config_files=[os.path.join((os.path.dirname(__file__), os.path.dirname(sys.executable))[hasattr(sys, 'frozen')], 'fastir_artifacts.ini')],
+        default_config_files=[os.path.join(APPLICATION_DIR, 'fastir_artifacts.ini')],
         description='FastIR Artifacts - Collect ForensicArtifacts')
 
     parser.add_argument('-i', '--include', help='Artifacts to collect (comma-separated)')
@@ -127,8 +260,73 @@ if __name__ == "__main__":
         '-l', '--library',
         help='Keep loading Artifacts definitions from the ForensicArtifacts library (in addition to custom directories)',
         action='store_true')
+    parser.add_argument(
+        '--artifacts-cache', help='File where selected artifact definitions are cached, for a faster startup')
     parser.add_argument('-m', '--maxsize', help='Do not collect file with size > n')
     parser.add_argument('-o', '--output', help='Directory where the results are created', default='.')
+    parser.add_argument(
+        '--stream',
+        help="Send results to 'tcp:host:port', 'unix:path' or '-' (stdout) instead of writing them to disk")
     parser.add_argument('-s', '--sha256', help='Compute SHA-256 of collected files', action='store_true')
+    parser.add_argument(
+        '--deduplicate', help='Store files with the same inode or content only once', action='store_true')
+    parser.add_argument(
+        '--compression-level', help='Compression level of the files archive (0-9)', type=int, default=6)
+    parser.add_argument(
+        '--compression-workers', help='Number of threads compressing the files archive', type=int, default=1)
+    parser.add_argument(
+        '--volume-size', help='Start a new volume of the files archive when it exceeds n bytes')
+    parser.add_argument(
+        '--volume-members', help='Start a new volume of the files archive after n files', type=int)
+    parser.add_argument(
+        '--file-info-cache', help='File where FILE_INFO results are cached across runs, for unchanged files')
+    parser.add_argument(
+        '--file-info-cache-size', help='Maximum size of the file info cache (default 64M)', default='64M')
+    parser.add_argument(
+        '--previous-manifest', help='Manifest of a previous run, only new or changed files are collected')
+    parser.add_argument(
+        '--legacy-json',
+        help='Convert commands, WMI and registry results to nested JSON files at the end of the run',
+        action='store_true')
+    parser.add_argument(
+        '--plan', help='Do not collect anything, write the estimated cost of the collection to a JSON file')
+    parser.add_argument('-w', '--workers', help='Number of filesystems collected in parallel', type=int, default=1)
+    parser.add_argument(
+        '--read-workers', help='Number of threads reading files ahead, for each filesystem', type=int, default=1)
+    parser.add_argument(
+        '--hash-workers', help='Number of threads computing hashes of a file', type=int, default=3)
+    parser.add_argument(
+        '--command-workers', help='Number of commands executed in parallel', type=int, default=1)
+    parser.add_argument(
+        '--command-timeout', help='Kill commands running for more than n seconds', type=float)
+    parser.add_argument(
+        '--command-max-output', help='Kill commands and truncate their output when it exceeds n bytes')
+    parser.add_argument(
+        '--deadline', help='Collect the most valuable and cheapest sources first, and stop after n seconds', type=float)
+    parser.add_argument(
+        '--priorities', help='Priorities of artifacts or labels in deadline mode (comma-separated name:priority)')
+    parser.add_argument(
+        '--sparse',
+        help='Only read allocated runs of the files of these artifacts or labels (comma-separated)')
+    parser.add_argument(
+        '--ranges',
+        help="Only read a range of the files of artifacts or labels (comma-separated name:range, "
+             "range being 'head:n', 'tail:n' or 'start-end')")
+    parser.add_argument('--max-read-rate', help='Do not read more than n bytes per second from filesystems')
+    parser.add_argument(
+        '--cpu-share', help='Share of a CPU (0-1) each compression or hashing thread may use', type=float)
+    parser.add_argument(
+        '--max-memory',
+        help='Shrink caches and spill buffers to temporary files to keep memory usage under n bytes')
+    parser.add_argument(
+        '--low-priority', help='Lower the CPU (nice) and I/O (ionice) priority of the process', action='store_true')
+    parser.add_argument(
+        '--tsk-index',
+        help='Index NTFS filesystem metadata in a single pass of the MFT instead of reading directories one by one',
+        action='store_true')
+    parser.add_argument(
+        '--ordered-reads',
+        help='Find all files on NTFS/ext filesystems before reading them in physical disk order',
+        action='store_true')
 
     main(parser.parse_args())
@@ -2,15 +2,75 @@
 
 import os.path
 import sys
+import shutil
+import argparse
 
+sys.path.insert(0, '.')
+
+from fastir_artifacts import select_artifacts
+from fastir.common.helpers import get_operating_system
+
+
+ARTIFACTS_CACHE = os.path.join('build', 'artifacts-cache.json')
+
+# Backends are imported when selected sources need them, out of sight of the analysis
+HIDDEN_IMPORTS = [
+    'fastir.common.filesystem',
+    'fastir.common.commands',
+    'fastir.unix.variables',
+    'pytsk3',
+    'psutil',
+    'pefile'
+]
+
+if sys.platform == 'win32':
+    HIDDEN_IMPORTS += [
+        'fastir.windows.variables',
+        'fastir.windows.wmi',
+        'fastir.windows.registry',
+        'win32com.client'
+    ]
+
+
+def read_configuration(path):
+    options = {}
+
+    with open(path) as f:
+        for line in f:
+            key, separator, value = line.partition('=')
+
+            if separator and not key.strip().startswith('#'):
+                options[key.strip()] = value.strip()
+
+    return options
+
+
+def build_artifacts_cache():
+    """Cache the sources selected by the bundled configuration, from the bundled definitions"""
+    definitions = os.path.join('build', 'artifacts')
+    shutil.rmtree(definitions, ignore_errors=True)
+    shutil.copytree(os.path.join(sys.prefix, 'share', 'artifacts'), definitions)
+    shutil.copy(os.path.join('examples', 'own.yaml'), definitions)
+
+    if os.path.exists(ARTIFACTS_CACHE):
+        os.remove(ARTIFACTS_CACHE)
+
+    options = read_configuration(os.path.join('examples', 'fastir_artifacts.ini'))
+    arguments = argparse.Namespace(
+        include=options.get('include'), exclude=options.get('exclude'), library=False, directory=None)
+    select_artifacts(arguments, get_operating_system(), ARTIFACTS_CACHE, [definitions])
+
+
+build_artifacts_cache()
 
 a = Analysis(['fastir_artifacts.py'],
              pathex=['.'],
              binaries=[],
              datas=[(os.path.join(sys.prefix, 'share', 'artifacts'), os.path.join('share', 'artifacts')),
                     (os.path.join('examples', 'fastir_artifacts.ini'), '.'),
-                    (os.path.join('examples', 'own.yaml'), os.path.join('share', 'artifacts'))],
-             hiddenimports=[],
+                    (os.path.join('examples', 'own.yaml'), os.path.join('share', 'artifacts')),
+                    (ARTIFACTS_CACHE, '.')],
+             hiddenimports=HIDDEN_IMPORTS,
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
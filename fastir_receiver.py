@@ -0,0 +1,52 @@
+import os
+import socket
+import argparse
+import threading
+
+from fastir.common.sink import receive, open_stream
+
+
+def receive_connection(connection, address, output):
+    with connection, connection.makefile('rb') as stream:
+        try:
+            files = receive(stream, output)
+            print(f"Received {len(files)} files from {address or 'local client'}")
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Error receiving results from {address or 'local client'}: {str(e)}")
+
+
+def listen(target, output):
+    """Accept collections until interrupted, each one received by its own thread"""
+    kind, _, address = target.partition(':')
+
+    if kind == 'tcp':
+        host, _, port = address.rpartition(':')
+        server = socket.create_server((host, int(port)))
+    elif kind == 'unix':
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(address)
+        server.listen()
+    else:
+        raise ValueError(f"Unsupported listen address '{target}'")
+
+    with server:
+        while True:
+            connection, address = server.accept()
+            threading.Thread(target=receive_connection, args=(connection, address, output), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='FastIR Artifacts - Receive results streamed by collections')
+
+    parser.add_argument('-o', '--output', help='Directory where the results are created', default='.')
+    parser.add_argument(
+        '-l', '--listen', help="Accept collections on 'tcp:host:port' or 'unix:path' (read stdin by default)")
+
+    arguments = parser.parse_args()
+    os.makedirs(arguments.output, exist_ok=True)
+
+    if arguments.listen:
+        listen(arguments.listen, arguments.output)
+    else:
+        files = receive(open_stream('-', 'rb'), arguments.output)
+        print(f"Received {len(files)} files")
@@ -1,13 +1,14 @@
 import os
 import sys
 import glob
-import json
 import zipfile
 import subprocess
 from shutil import rmtree
 from tempfile import mkdtemp
+from collections import defaultdict
 
 import pytest
+import jsonlines
 
 
 FASTIR_ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -41,16 +42,19 @@ def temp_dir():
 
 
 @pytest.fixture(scope='session')
-def fastir_command(temp_dir):
+def fastir_executable():
     if sys.platform == 'darwin' or sys.platform == 'linux':
         command = os.path.join(FASTIR_ROOT, 'dist', 'fastir_artifacts', 'fastir_artifacts')
-        command = ['sudo', command]
+        return ['sudo', command]
     elif sys.platform == 'win32':
-        command = [os.path.join('dist', 'fastir_artifacts', 'fastir_artifacts.exe')]
+        return [os.path.join('dist', 'fastir_artifacts', 'fastir_artifacts.exe')]
     else:
         raise ValueError(f'Unknown platform {sys.platform}')
 
-    return command + ['-o', temp_dir, '-i', ','.join(TEST_ARTIFACTS)]
+
+@pytest.fixture(scope='session')
+def fastir_command(fastir_executable, temp_dir):
+    return fastir_executable + ['-o', temp_dir, '-i', ','.join(TEST_ARTIFACTS)]
 
 
 @pytest.fixture(scope='session')
@@ -78,13 +82,25 @@ def fastir_results(fastir_output, temp_dir):
 
 @pytest.fixture(scope='session')
 def command_results_file(fastir_results):
-    return glob.glob(os.path.join(fastir_results, '*-commands.json'))[0]
+    return glob.glob(os.path.join(fastir_results, '*-commands.jsonl'))[0]
+
+
+def read_command_output(command_results_file, record):
+    output_path = os.path.join(os.path.dirname(command_results_file), record['output_file'])
+
+    with open(output_path, 'rb') as f:
+        return f.read().decode('utf-8', errors='replace')
 
 
 @pytest.fixture(scope='session')
 def command_results(command_results_file):
-    with open(command_results_file, 'r') as f:
-        yield json.load(f)
+    results = defaultdict(dict)
+
+    with jsonlines.open(command_results_file) as records:
+        for record in records:
+            results[record['artifact']][record['command']] = read_command_output(command_results_file, record)
+
+    yield results
 
 
 @pytest.fixture(scope='session')
@@ -139,6 +155,44 @@ def test_logs(logs_results_file, logs_results):
     assert 'Finished collecting artifacts' in logs_results
 
 
+TIMEOUT_ARTIFACT = """name: SlowCommand
+doc: Command running for longer than the timeout.
+sources:
+- type: COMMAND
+  attributes:
+    cmd: /bin/sh
+    args: ['-c', 'echo started; sleep 30']
+supported_os: [Darwin, Linux]
+"""
+
+
+@pytest.fixture(scope='session')
+def timed_out_results(fastir_executable):
+    """Results of a separate run, where a command is killed by the command timeout"""
+    dirpath = mkdtemp()
+    definitions_dir = os.path.join(dirpath, 'definitions')
+    output_dir = os.path.join(dirpath, 'output')
+    os.makedirs(definitions_dir)
+
+    with open(os.path.join(definitions_dir, 'slow.yaml'), 'w') as f:
+        f.write(TIMEOUT_ARTIFACT)
+
+    command = fastir_executable + [
+        '-o', output_dir, '-d', definitions_dir, '-i', 'SlowCommand', '--command-timeout', '2']
+    subprocess.check_output(command, stderr=subprocess.STDOUT)
+
+    # Fix ownership
+    subprocess.check_output(['sudo', 'chown', '-R', f'{os.getuid()}:{os.getgid()}', output_dir])
+
+    results_path = os.path.join(output_dir, os.listdir(output_dir)[0])
+    command_results_file = glob.glob(os.path.join(results_path, '*-commands.jsonl'))[0]
+
+    with jsonlines.open(command_results_file) as records:
+        yield [(record, read_command_output(command_results_file, record)) for record in records]
+
+    rmtree(dirpath)
+
+
 #####################
 ## Linux Tests
 #####################
@@ -151,6 +205,18 @@ def test_command_iptables(command_results):
         assert 'Chain INPUT' in output
 
 
+@pytest.mark.linux
+@pytest.mark.darwin
+def test_command_timed_out(timed_out_results):
+    assert len(timed_out_results) == 1
+
+    record, output = timed_out_results[0]
+    assert record['artifact'] == 'SlowCommand'
+    assert record['timed_out'] is True
+    assert record['returncode'] != 0
+    assert output == 'started\n'
+
+
 @pytest.mark.linux
 @pytest.mark.darwin
 def test_file_passwd(files_results_names, files_results):
@@ -188,13 +254,18 @@ def test_command_kextstat(command_results):
 #####################
 @pytest.fixture(scope='session')
 def wmi_results_file(fastir_results):
-    return glob.glob(os.path.join(fastir_results, '*-wmi.json'))[0]
+    return glob.glob(os.path.join(fastir_results, '*-wmi.jsonl'))[0]
 
 
 @pytest.fixture(scope='session')
 def wmi_results(wmi_results_file):
-    with open(wmi_results_file, 'r') as f:
-        yield json.load(f)
+    results = defaultdict(dict)
+
+    with jsonlines.open(wmi_results_file) as records:
+        for record in records:
+            results[record['artifact']][record['query']] = record['output']
+
+    yield results
 
 
 @pytest.mark.win32
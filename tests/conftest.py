@@ -25,7 +25,7 @@ def temp_dir():
 
 @pytest.fixture
 def outputs(temp_dir):
-    with patch.object(Outputs, 'add_collected_command'):
+    with patch.object(Outputs, 'add_collected_command_output'):
         with patch.object(Outputs, 'add_collected_file'):
             with patch.object(Outputs, 'add_collected_file_info'):
                 outputs = Outputs(temp_dir, maxsize=None, sha256=False)
@@ -0,0 +1,124 @@
+import os
+import sys
+import zlib
+from zipfile import ZipFile
+from unittest.mock import patch
+
+import pytest
+
+from fastir.common.archive import Archive, ParallelCompressor, parallel_compression_supported
+
+
+@pytest.fixture
+def content():
+    # Data that compresses, but not too easily
+    return b''.join(str(i).encode() * (i % 7) for i in range(20000))
+
+
+def chunks(data, size):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_write(temp_dir, content, workers):
+    path = os.path.join(temp_dir, 'test.zip')
+
+    with patch('fastir.common.archive.COMPRESSION_BLOCK_SIZE', 4096):
+        archive = Archive(path, compression_workers=workers)
+        assert archive.write('first', chunks(content, 10000)) == len(content)
+        archive.write('empty', [])
+        archive.write('second', [b'second'])
+        archive.close()
+
+    with ZipFile(path) as zf:
+        assert zf.namelist() == ['first', 'empty', 'second']
+        assert zf.testzip() is None
+        assert zf.read('first') == content
+        assert zf.read('empty') == b''
+        assert zf.read('second') == b'second'
+
+
+def test_parallel_compressor(content):
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(3) as executor, patch('fastir.common.archive.COMPRESSION_BLOCK_SIZE', 1000):
+        compressor = ParallelCompressor(executor, 6, 2)
+        compressed = b''.join(compressor.compress(chunk) for chunk in chunks(content, 3000))
+        compressed += compressor.flush()
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    assert decompressor.decompress(compressed) == content
+    assert decompressor.eof
+
+
+@pytest.mark.skipif(sys.implementation.name != 'cpython', reason='requires CPython')
+def test_parallel_compression_supported(temp_dir):
+    # Checked versions compress members through the attribute replaced by a ParallelCompressor
+    archive = Archive(os.path.join(temp_dir, 'test.zip'), compression_workers=2)
+
+    with archive.open('member') as member:
+        assert parallel_compression_supported(member)
+        assert isinstance(member._compressor, ParallelCompressor)
+
+    archive.close()
+
+
+def test_parallel_compression_unsupported(temp_dir, content, caplog):
+    path = os.path.join(temp_dir, 'test.zip')
+
+    # Other versions fall back to the compression of the zipfile module
+    with patch('fastir.common.archive.PARALLEL_COMPRESSION_VERSIONS', ((3, 0), (3, 1))):
+        assert not parallel_compression_supported()
+
+        archive = Archive(path, compression_workers=4)
+        archive.write('content', [content])
+        archive.close()
+
+    assert 'cannot be compressed in parallel' in caplog.text
+
+    with ZipFile(path) as zf:
+        assert zf.read('content') == content
+
+
+def test_compression_level(temp_dir, content):
+    sizes = []
+
+    for level in [0, 9]:
+        path = os.path.join(temp_dir, f'{level}.zip')
+        archive = Archive(path, compression_level=level)
+        archive.write('content', [content])
+        archive.close()
+
+        with ZipFile(path) as zf:
+            sizes.append(zf.getinfo('content').compress_size)
+
+    assert sizes[0] > len(content) > sizes[1]
+
+
+def test_members_index(temp_dir):
+    archive = Archive(os.path.join(temp_dir, 'test.zip'))
+    archive.write('member', [b'content'])
+
+    assert 'member' in archive
+    assert 'other' not in archive
+    assert len(archive) == 1
+
+    archive.close()
+
+
+def test_discard_last(temp_dir):
+    path = os.path.join(temp_dir, 'test.zip')
+
+    archive = Archive(path)
+    archive.write('kept', [b'kept'])
+    archive.write('discarded', [b'discarded'])
+
+    assert archive.can_discard()
+    archive.discard_last()
+    archive.write('last', [b'last'])
+    archive.close()
+
+    with ZipFile(path) as zf:
+        assert zf.namelist() == ['kept', 'last']
+        assert zf.testzip() is None
@@ -0,0 +1,123 @@
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+import artifacts.reader
+import artifacts.registry
+from artifacts.definitions import TYPE_INDICATOR_COMMAND
+
+from fastir.common.artifacts_cache import ArtifactsCache
+from fastir.common.source_types import FILE_INFO_TYPE
+from fastir_artifacts import get_artifacts_cache_path
+
+
+DEFINITIONS = """name: TestCommand
+doc: Test command
+sources:
+- type: COMMAND
+  attributes:
+    cmd: echo
+    args: [test]
+---
+name: TestFileInfo
+doc: Test file info
+supported_os: [Linux, Windows]
+sources:
+- type: FILE_INFO
+  attributes:
+    paths: ['/bin/*']
+  supported_os: [Linux]
+- type: FILE_INFO
+  attributes:
+    paths: ['C:\\\\Windows\\\\*.exe']
+  supported_os: [Windows]
+"""
+
+PARAMETERS = {'include': None, 'exclude': None, 'platform': 'Linux', 'collect_registry': False}
+
+
+@pytest.fixture
+def definitions(temp_dir):
+    directory = os.path.join(temp_dir, 'definitions')
+    os.makedirs(directory)
+
+    with open(os.path.join(directory, 'test.yaml'), 'w') as f:
+        f.write(DEFINITIONS)
+
+    return directory
+
+
+def select(directory):
+    registry = artifacts.registry.ArtifactDefinitionsRegistry()
+    registry.ReadFromDirectory(artifacts.reader.YamlArtifactsReader(), directory)
+
+    return [
+        (definition, source)
+        for definition in registry.GetDefinitions()
+        for source in definition.sources
+        if not source.supported_os or 'Linux' in source.supported_os
+    ]
+
+
+def save_cache(path, directory):
+    cache = ArtifactsCache(path, [directory])
+    assert cache.get(PARAMETERS) is None
+
+    cache.set(PARAMETERS, select(directory))
+    cache.save()
+
+
+def test_artifacts_cache(temp_dir, definitions):
+    path = os.path.join(temp_dir, 'artifacts-cache.json')
+    save_cache(path, definitions)
+
+    selection = ArtifactsCache(path, [definitions]).get(PARAMETERS)
+
+    assert [(definition.name, source.type_indicator) for definition, source in selection] == [
+        ('TestCommand', TYPE_INDICATOR_COMMAND), ('TestFileInfo', FILE_INFO_TYPE)]
+    assert selection[0][1].cmd == 'echo'
+    assert selection[1][1].paths == ['/bin/*']
+
+    # Selections depend on parameters
+    assert ArtifactsCache(path, [definitions]).get(dict(PARAMETERS, platform='Windows')) is None
+
+
+def test_artifacts_cache_changed_definitions(temp_dir, definitions):
+    path = os.path.join(temp_dir, 'artifacts-cache.json')
+    save_cache(path, definitions)
+
+    definitions_file = os.path.join(definitions, 'test.yaml')
+
+    # Same content with another modification time (extracted release)
+    os.utime(definitions_file, ns=(0, 0))
+    assert ArtifactsCache(path, [definitions]).get(PARAMETERS) is not None
+
+    with open(definitions_file, 'w') as f:
+        f.write(DEFINITIONS.replace('args: [test]', 'args: [tset]'))
+
+    assert ArtifactsCache(path, [definitions]).get(PARAMETERS) is None
+
+    with open(os.path.join(definitions, 'other.yaml'), 'w') as f:
+        f.write(DEFINITIONS)
+
+    assert ArtifactsCache(path, [definitions]).get(PARAMETERS) is None
+
+
+def test_artifacts_cache_corrupted(temp_dir, definitions):
+    path = os.path.join(temp_dir, 'artifacts-cache.json')
+
+    with open(path, 'w') as f:
+        f.write('{')
+
+    assert ArtifactsCache(path, [definitions]).get(PARAMETERS) is None
+
+
+def test_artifacts_cache_path():
+    assert get_artifacts_cache_path('artifacts-cache.json') == 'artifacts-cache.json'
+
+    # A release finds the cache it ships next to its executable, whatever the working directory
+    with patch.object(sys, 'frozen', True, create=True):
+        with patch('fastir_artifacts.APPLICATION_DIR', os.path.join('release', 'fastir_artifacts')):
+            assert get_artifacts_cache_path('artifacts-cache.json') == os.path.join(
+                'release', 'fastir_artifacts', 'artifacts-cache.json')
@@ -1,12 +1,18 @@
+import os
+
 import pytest
 from artifacts.artifact import ArtifactDefinition
 from artifacts.definitions import TYPE_INDICATOR_COMMAND, TYPE_INDICATOR_FILE, TYPE_INDICATOR_PATH
 
-from fastir.common.collector import Collector
+from fastir.common.collector import Collector, get_priority, get_read_options
+from fastir.common.deadline import Deadline
 from fastir.common.filesystem import FILE_INFO_TYPE
 from fastir.common.helpers import get_operating_system
 
 
+FS_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data', 'filesystem'))
+
+
 @pytest.fixture
 def command_echo():
     artifact = ArtifactDefinition('EchoCommand')
@@ -48,7 +54,7 @@ def test_collector(command_echo, passwords_file, passwords_file_info, outputs, f
     collector.collect(outputs)
 
     assert outputs.add_collected_file.call_count == 1
-    assert outputs.add_collected_command.call_count == 1
+    assert outputs.add_collected_command_output.call_count == 1
     assert outputs.add_collected_file_info.call_count == 1
 
 
@@ -61,3 +67,51 @@ def test_unsupported_source(path_artifact, caplog):
         log = caplog.records[0]
         assert log.levelname == "WARNING"
         assert log.message == "Cannot process source for 'PathArtifact' because type 'PATH' is not supported"
+
+
+def test_priorities():
+    definition = ArtifactDefinition('Artifact')
+    assert get_priority(definition, {'Other': 10}) == 0
+    assert get_priority(definition, {'Artifact': 10}) == 10
+
+    definition.labels = ['Logs']
+    assert get_priority(definition, {'Artifact': 1, 'Logs': 5}) == 5
+
+
+def test_read_options():
+    definition = ArtifactDefinition('Artifact')
+    definition.labels = ['Logs']
+
+    read_options = {'Logs': {'sparse': True, 'range': ('head', 10)}, 'Artifact': {'range': ('tail', 5)}}
+    assert get_read_options(definition, read_options) == {'sparse': True, 'range': ('tail', 5)}
+    assert get_read_options(definition, {}) == {}
+
+
+def test_deadline_priority_order(outputs, fake_partitions):
+    collector = Collector(get_operating_system(), deadline=Deadline(60), priorities={'High': 10})
+
+    for name in ['Low', 'High']:
+        artifact = ArtifactDefinition(name)
+        artifact.AppendSource(TYPE_INDICATOR_COMMAND, {'cmd': 'echo', 'args': [name]})
+        collector.register_source(artifact, artifact.sources[0])
+
+    collector.collect(outputs)
+
+    assert [call[0][0] for call in outputs.add_collected_command_output.call_args_list] == ['High', 'Low']
+
+
+def test_deadline_filesystems_opened_once(outputs, fake_partitions):
+    collector = Collector(get_operating_system(), deadline=Deadline(60), priorities={'High': 10})
+
+    for name, filename in [('Low', 'root.txt'), ('High', 'test.txt')]:
+        artifact = ArtifactDefinition(name)
+        artifact.AppendSource(TYPE_INDICATOR_FILE, {'paths': [os.path.join(FS_ROOT, filename)]})
+        collector.register_source(artifact, artifact.sources[0])
+
+    # A single manager collects each priority in turn
+    managers = {id(collector) for _, name, collector in collector._all_collectors() if name == 'filesystem'}
+    assert len(managers) == 1
+
+    collector.collect(outputs)
+
+    assert [call[0][0] for call in outputs.add_collected_file.call_args_list] == ['High', 'Low']
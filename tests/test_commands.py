@@ -1,7 +1,13 @@
+import os
+import sys
+import time
+
+import pytest
 from artifacts.artifact import ArtifactDefinition
 from artifacts.definitions import TYPE_INDICATOR_COMMAND
 
 from fastir.common.commands import CommandExecutor
+from fastir.common.deadline import Deadline
 
 
 def command_artifact(name, command, args):
@@ -11,6 +17,13 @@ def command_artifact(name, command, args):
     return artifact
 
 
+def collected_output(outputs):
+    artifact, command, result = outputs.add_collected_command_output.call_args[0]
+
+    with open(os.path.join(outputs._dirpath, result.output_file), 'rb') as f:
+        return artifact, command, result, f.read()
+
+
 def test_command_execution(outputs, test_variables):
     collector = CommandExecutor()
     artifact = command_artifact('TestArtifact', 'echo', ['test'])
@@ -18,7 +31,9 @@ def test_command_execution(outputs, test_variables):
     assert collector.register_source(artifact, artifact.sources[0], test_variables) is True
 
     collector.collect(outputs)
-    outputs.add_collected_command.assert_called_with('TestArtifact', 'echo test', b'test\n')
+
+    artifact, command, result, content = collected_output(outputs)
+    assert (artifact, command, result.returncode, content) == ('TestArtifact', 'echo test', 0, b'test\n')
 
 
 def test_unknown_command(outputs, test_variables, caplog):
@@ -28,8 +43,107 @@ def test_unknown_command(outputs, test_variables, caplog):
     assert collector.register_source(artifact, artifact.sources[0], test_variables) is True
 
     collector.collect(outputs)
-    outputs.add_collected_command.assert_called_with('TestArtifact', 'idontexist', b'')
+
+    artifact, command, result, content = collected_output(outputs)
+    assert (artifact, command, result.not_found, content) == ('TestArtifact', 'idontexist', True, b'')
 
     log = caplog.records[0]
     assert log.levelname == "WARNING"
     assert log.message == "Command 'idontexist' for artifact 'TestArtifact' could not be found"
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_concurrent_commands(outputs, test_variables):
+    collector = CommandExecutor(workers=4)
+
+    for i in range(4):
+        artifact = command_artifact(f'Sleep{i}', 'sleep', ['0.5'])
+        collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    start = time.monotonic()
+    collector.collect(outputs)
+
+    assert time.monotonic() - start < 1.5
+    assert [call[0][0] for call in outputs.add_collected_command_output.call_args_list] == [
+        'Sleep0', 'Sleep1', 'Sleep2', 'Sleep3']
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_command_timeout(outputs, test_variables, caplog):
+    collector = CommandExecutor(timeout=0.2)
+    artifact = command_artifact('TestArtifact', 'sleep', ['10'])
+    collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    start = time.monotonic()
+    collector.collect(outputs)
+
+    assert time.monotonic() - start < 5
+    assert collected_output(outputs)[2].timed_out is True
+    assert "timed out" in caplog.records[0].message
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_command_deadline_timeout(outputs, test_variables, caplog):
+    collector = CommandExecutor()
+    artifact = command_artifact('TestArtifact', 'sleep', ['10'])
+    collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    # Without a command timeout, the command is killed when the deadline is reached
+    outputs.deadline = Deadline(0.5)
+    collector.collect(outputs)
+
+    result = collected_output(outputs)[2]
+    assert result.timed_out is True
+    assert 0 < result.timeout <= 0.5
+    assert f"timed out after {result.timeout:.1f}s" in caplog.records[0].message
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_command_timeout_kills_children(outputs, test_variables):
+    collector = CommandExecutor(timeout=0.2)
+    artifact = command_artifact('TestArtifact', 'sh', ['-c', 'echo started; sleep 10'])
+    collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    start = time.monotonic()
+    collector.collect(outputs)
+
+    assert time.monotonic() - start < 5
+
+    _, _, result, content = collected_output(outputs)
+    assert result.timed_out is True
+    assert content == b'started\n'
+
+
+def test_command_timeout_kills_grandchildren(outputs, test_variables):
+    # The command starts a process inheriting its output, and both outlive the timeout
+    script = (
+        "import subprocess, sys, time; "
+        "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)']); "
+        "print('started', flush=True); "
+        "time.sleep(10)")
+
+    collector = CommandExecutor(timeout=1)
+    artifact = command_artifact('TestArtifact', sys.executable, ['-c', script])
+    collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    start = time.monotonic()
+    collector.collect(outputs)
+
+    assert time.monotonic() - start < 5
+
+    _, _, result, content = collected_output(outputs)
+    assert result.timed_out is True
+    assert content.strip() == b'started'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_command_max_output(outputs, test_variables):
+    collector = CommandExecutor(max_output_size=1000)
+    artifact = command_artifact('TestArtifact', 'yes', [])
+    collector.register_source(artifact, artifact.sources[0], test_variables)
+
+    collector.collect(outputs)
+
+    _, _, result, content = collected_output(outputs)
+    assert result.truncated is True
+    assert len(content) == 1000
@@ -0,0 +1,92 @@
+from fastir.common.path_components import PathObject
+from fastir.common.directory_cache import DirectoryCache, ENTRY_OVERHEAD
+
+
+def entries(directory, *names):
+    return [PathObject(None, name, f'{directory}/{name}') for name in names]
+
+
+def test_lookup_by_name():
+    cache = DirectoryCache()
+    listing = cache.add('/dir', entries('/dir', 'a', 'b'))
+
+    assert listing.get('b').path == '/dir/b'
+    assert listing.get('c') is None
+    assert cache.get('/dir') is listing
+
+
+def test_counters():
+    cache = DirectoryCache()
+
+    assert cache.get('/dir') is None
+    cache.add('/dir', entries('/dir', 'a'))
+    cache.get('/dir')
+    cache.get('/dir')
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 0
+    assert stats['directories'] == 1
+    assert stats['entries'] == 1
+
+
+def test_eviction_by_entries():
+    cache = DirectoryCache(max_entries=4)
+
+    cache.add('/a', entries('/a', '1', '2'))
+    cache.add('/b', entries('/b', '1', '2'))
+
+    # Using '/a' makes '/b' the least recently used listing
+    cache.get('/a')
+    cache.add('/c', entries('/c', '1'))
+
+    assert cache.get('/b') is None
+    assert cache.get('/a') is not None
+    assert cache.get('/c') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['entries'] == 3
+
+
+def test_eviction_by_bytes():
+    cache = DirectoryCache(max_bytes=3 * ENTRY_OVERHEAD)
+
+    cache.add('/a', entries('/a', '1', '2'))
+    cache.add('/b', entries('/b', '1', '2'))
+
+    assert len(cache) == 1
+    assert cache.get('/b') is not None
+
+
+def test_keep_last_listing():
+    cache = DirectoryCache(max_entries=1)
+    cache.add('/a', entries('/a', '1', '2', '3'))
+
+    assert cache.get('/a') is not None
+
+
+def test_resize():
+    cache = DirectoryCache()
+    cache.add('/a', entries('/a', '1', '2'))
+    cache.add('/b', entries('/b', '1', '2'))
+
+    cache.resize(2, cache.max_bytes)
+
+    assert len(cache) == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_requested_shrink():
+    cache = DirectoryCache()
+    for path in ['/a', '/b', '/c']:
+        cache.add(path, entries(path, '1', '2'))
+
+    # Applied by the owner of the cache, on the next listing added
+    cache.request_shrink()
+    assert len(cache) == 3
+
+    cache.add('/d', entries('/d', '1', '2'))
+
+    assert cache.max_entries == 3
+    assert len(cache) == 1
+    assert cache.get('/d') is not None
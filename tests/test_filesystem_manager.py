@@ -1,9 +1,16 @@
 import os
+import glob
+import json
+from zipfile import ZipFile
+
+from unittest.mock import patch
 
 import pytest
 from artifacts.artifact import ArtifactDefinition
 from artifacts.definitions import TYPE_INDICATOR_FILE
 
+from fastir.common.output import Outputs
+from fastir.common.metrics import metrics
 from fastir.common.filesystem import FileSystemManager, OSFileSystem, TSKFileSystem
 
 
@@ -68,3 +75,184 @@ def test_no_mountpoin(fake_partitions):
 
     with pytest.raises(IndexError):
         manager.get_path_object('im_not_a_mountpoint/file.txt')
+
+
+def test_parallel_collection(fake_partitions, outputs, test_variables):
+    manager = FileSystemManager(workers=2)
+
+    artifact = file_artifact('TestArtifact', '/passwords.txt')
+    manager.register_source(artifact, artifact.sources[0], test_variables)
+
+    artifact = file_artifact('TestArtifact2', fp('**'))
+    manager.register_source(artifact, artifact.sources[0], test_variables)
+
+    manager.collect(outputs)
+
+    assert set(resolved_paths(outputs)) == set([
+        '/passwords.txt', fp('root.txt'), fp('root2.txt'), fp('test.txt'), fp('l1/l1.txt'), fp('l1/l2/l2.txt')])
+
+
+def test_parallel_collection_archive(fake_partitions, test_variables, temp_dir):
+    archives = []
+
+    for run, workers in enumerate([1, 2, 2, 3]):
+        output = Outputs(os.path.join(temp_dir, str(run)), maxsize=None, sha256=False)
+        manager = FileSystemManager(workers=workers)
+
+        for name, pattern in [('A1', '/**'), ('A2', fp('**')), ('A3', fp('l1/**4'))]:
+            artifact = file_artifact(name, pattern)
+            manager.register_source(artifact, artifact.sources[0], test_variables)
+
+        manager.collect(output)
+        output.close()
+
+        archive = glob.glob(os.path.join(temp_dir, str(run), '*', '*-files.zip'))[0]
+        with ZipFile(archive) as zf:
+            archives.append([(name, zf.read(name)) for name in zf.namelist()])
+
+    # Parallel collection should produce the same members as a serial one,
+    # always in the same order
+    assert len(archives[0]) == 10
+    assert sorted(archives[1]) == sorted(archives[0])
+    assert archives[2] == archives[1]
+    assert archives[3] == archives[1]
+
+
+def test_read_workers_archive(fake_partitions, test_variables, temp_dir):
+    archives = []
+
+    for run, read_workers in enumerate([1, 4]):
+        output = Outputs(os.path.join(temp_dir, str(run)), maxsize=None, sha256=True)
+        manager = FileSystemManager(workers=2, read_workers=read_workers)
+
+        for name, pattern in [('A1', '/**'), ('A2', fp('**'))]:
+            artifact = file_artifact(name, pattern)
+            manager.register_source(artifact, artifact.sources[0], test_variables)
+
+        manager.collect(output)
+        output.close()
+
+        archive = glob.glob(os.path.join(temp_dir, str(run), '*', '*-files.zip'))[0]
+        with ZipFile(archive) as zf:
+            archives.append([(name, zf.read(name)) for name in zf.namelist()])
+
+        metrics_file = glob.glob(os.path.join(temp_dir, str(run), '*', '*-metrics.json'))[0]
+        with open(metrics_file) as f:
+            pipeline = json.load(f)['pipeline']
+
+        assert pipeline['stages']['read']['workers'] == 2 * read_workers
+        assert pipeline['stages']['write']['items'] == len(archives[-1])
+        assert pipeline['queues']['files']['size'] > 0
+
+    # Reading files ahead with several threads does not change the archive
+    assert archives[1] == archives[0]
+
+
+def test_stage_workers_priority_passes(fake_partitions, test_variables, outputs):
+    metrics.reset()
+    manager = FileSystemManager(workers=2, read_workers=3)
+
+    for priority, pattern in [(10, '/**'), (0, fp('**'))]:
+        manager.add_pattern('TestArtifact', pattern, priority=priority)
+
+    for priority in [10, 0]:
+        manager.collect(outputs, priority)
+
+    # Workers of each pass are not added up
+    stages = metrics.to_dict()['pipeline']['stages']
+    assert stages['enumerate']['workers'] == 1
+    assert stages['read']['workers'] == 3
+    assert stages['write']['workers'] == 1
+
+
+def test_read_again_after_error(fake_partitions, test_variables, temp_dir):
+    output = Outputs(os.path.join(temp_dir, 'output'), maxsize=None, sha256=False)
+    manager = FileSystemManager()
+
+    # root.txt is matched twice, and its first read fails
+    for name, pattern in [('A1', fp('root.txt')), ('A2', fp('root*.txt'))]:
+        artifact = file_artifact(name, pattern)
+        manager.register_source(artifact, artifact.sources[0], test_variables)
+
+    read_chunks = OSFileSystem.read_chunks
+    reads = []
+
+    def failing_first_read(filesystem, path_object, start=0, end=None):
+        reads.append(path_object.path)
+
+        if reads.count(path_object.path) == 1:
+            yield b'partial'
+            raise OSError('read error')
+
+        yield from read_chunks(filesystem, path_object, start, end)
+
+    with patch.object(OSFileSystem, 'read_chunks', failing_first_read):
+        manager.collect(output)
+    output.close()
+
+    assert reads.count(fp('root.txt')) == 2
+
+    archive = glob.glob(os.path.join(temp_dir, 'output', '*', '*-files.zip'))[0]
+    with ZipFile(archive) as zf, open(fp('root.txt'), 'rb') as f:
+        members = [name for name in zf.namelist() if name.endswith('/root.txt')]
+        assert len(members) == 1
+        assert zf.read(members[0]) == f.read()
+
+
+def rebuild(content, layout):
+    """Rebuild a file from the runs of a partially collected file"""
+    data = bytearray(layout['file_size'])
+    position = 0
+
+    for offset, length in layout['runs']:
+        data[offset:offset + length] = content[position:position + length]
+        position += length
+
+    return bytes(data)
+
+
+def test_partial_collection(temp_dir):
+    files = {}
+    for name, content in [('sparse.bin', None), ('head.txt', b'head content'), ('both.txt', b'both content')]:
+        files[name] = os.path.join(temp_dir, name)
+
+        with open(files[name], 'wb') as f:
+            if content:
+                f.write(content)
+            else:
+                f.write(b'head')
+                f.seek(4 * 1024 * 1024)
+                f.write(b'tail')
+
+    output = Outputs(os.path.join(temp_dir, 'output'), maxsize=None, sha256=False)
+    filesystem = OSFileSystem(temp_dir)
+
+    filesystem.add_pattern('Sparse', files['sparse.bin'], read_options={'sparse': True})
+    filesystem.add_pattern('Head', files['head.txt'], read_options={'range': ('head', 4)})
+
+    # Read in full for one artifact, so for all of them
+    filesystem.add_pattern('Tail', files['both.txt'], read_options={'range': ('tail', 4)})
+    filesystem.add_pattern('Full', files['both.txt'])
+
+    filesystem.collect(output)
+    output.close()
+
+    manifest = glob.glob(os.path.join(temp_dir, 'output', '*', '*-manifest.jsonl'))[0]
+    with open(manifest) as f:
+        records = {record['artifact']: record for record in map(json.loads, f)}
+
+    archive = glob.glob(os.path.join(temp_dir, 'output', '*', '*-files.zip'))[0]
+    with ZipFile(archive) as zf:
+        members = {name: zf.read(record['member']) for name, record in records.items()}
+
+    assert records['Sparse']['member'].endswith('sparse.bin.sparse')
+    assert records['Sparse']['size'] == len(members['Sparse'])
+    with open(files['sparse.bin'], 'rb') as f:
+        assert rebuild(members['Sparse'], records['Sparse']['layout']) == f.read()
+
+    assert members['Head'] == b'head'
+    assert records['Head']['member'].endswith('head.txt.head-4')
+    assert records['Head']['layout'] == {'file_size': 12, 'runs': [[0, 4]]}
+
+    assert members['Tail'] == members['Full'] == b'both content'
+    assert 'layout' not in records['Tail']
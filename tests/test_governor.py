@@ -0,0 +1,51 @@
+import time
+
+from fastir.common.governor import TokenBucket, Governor
+
+
+def test_token_bucket():
+    bucket = TokenBucket(1000)
+
+    # A burst of one second is allowed
+    assert bucket.consume(1000) == 0
+
+    start = time.monotonic()
+    waited = bucket.consume(200)
+
+    assert 0.1 < waited <= 0.2
+    assert time.monotonic() - start >= 0.1
+
+
+def test_disabled_governor():
+    governor = Governor()
+    governor.throttle_read(10 ** 12)
+
+    with governor.cpu('hashing'):
+        pass
+
+    assert not governor.enabled
+    assert governor.throttled() == {}
+
+
+def test_read_throttling():
+    governor = Governor()
+    governor.configure(max_read_rate=1000)
+
+    governor.throttle_read(1000)
+    governor.throttle_read(100)
+
+    assert 0 < governor.throttled()['read'] <= 0.1
+
+
+def test_cpu_throttling():
+    governor = Governor()
+    governor.configure(cpu_share=0.5)
+
+    start = time.thread_time()
+    with governor.cpu('hashing'):
+        while time.thread_time() - start < 0.05:
+            pass
+
+    # As much time is spent sleeping as working
+    assert governor.throttled()['hashing'] > 0
+    assert 'compression' not in governor.throttled()
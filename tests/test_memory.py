@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+from fastir.common.metrics import metrics
+from fastir.common.file_info import FileInfo
+from fastir.common.filesystem import OSFileSystem, read_ahead_sizes, FILE_QUEUE_SIZE, CHUNK_QUEUE_SIZE, CHUNK_SIZE
+from fastir.common.memory import MemoryMonitor, SpillBuffer, ContentBuffer, memory
+
+
+@pytest.fixture
+def memory_limit():
+    metrics.reset()
+    memory.configure(32 * 1024)
+
+    yield memory
+
+    memory.configure()
+
+
+def test_disabled_monitor():
+    monitor = MemoryMonitor()
+    monitor.track('structure', lambda: 10 ** 12, lambda: pytest.fail('Should not shrink'))
+    monitor.check('stage')
+
+    assert not monitor.enabled
+    assert not monitor.should_spill(10 ** 12)
+    assert monitor.share(100, 0.5) == 100
+
+
+def test_pressure(memory_limit):
+    requests = []
+    memory_limit.track('structure', lambda: 42, lambda: requests.append(True))
+    memory_limit.check('stage')
+
+    # The process uses more than the limit
+    assert memory_limit.pressure
+    assert requests == [True]
+    assert memory_limit.share(1024 * 1024, 0.5) == 16 * 1024
+
+    usage = metrics.to_dict()['memory']
+    assert usage['limit'] == 32 * 1024
+    assert usage['stages']['stage'] == usage['peak_rss'] > 0
+    assert usage['structures']['structure'] == 42
+    assert usage['shrinks'] == 1
+
+
+def test_spill_buffer(memory_limit):
+    buffer = SpillBuffer('lines')
+    lines = [f'{i}\n'.encode() for i in range(1000)]
+
+    for line in lines:
+        buffer.append(line)
+
+    assert buffer.size < 1024
+    assert list(buffer) == lines
+    assert metrics.to_dict()['memory']['spilled']['lines'] > 0
+
+    buffer.close()
+
+
+def test_content_buffer(memory_limit):
+    buffer = ContentBuffer(1024 * 1024)
+    buffer.write(b'MZ')
+    buffer.write(b'content')
+
+    assert buffer.getbuffer()[:] == b'MZcontent'
+    buffer.close()
+
+
+def test_pe_file_info_on_disk(memory_limit):
+    path_object = OSFileSystem('/').get_fullpath(os.path.join(os.path.dirname(__file__), 'data', 'MSVCR71.dll'))
+
+    # The content is larger than the share of a single buffer
+    results = FileInfo(path_object).compute()
+
+    assert results['file']['pe']['imphash'] == "7acc8c379c768a1ecd81ec502ff5f33e"
+
+
+def test_read_ahead_sizes():
+    assert read_ahead_sizes(2, 4) == (FILE_QUEUE_SIZE, CHUNK_QUEUE_SIZE)
+
+    # Chunks read ahead by 2 workers with 2 readers each fit in a quarter of the limit
+    memory.configure(1024 * CHUNK_SIZE)
+    files, chunks = read_ahead_sizes(2, 2)
+    assert chunks < CHUNK_QUEUE_SIZE
+    assert 2 * ((files + 2) * chunks + 2) <= 256
+
+    # Files are still read one chunk at a time under a tiny limit
+    memory.configure(32 * 1024)
+    assert read_ahead_sizes(2, 2) == (1, 1)
+
+    memory.configure()
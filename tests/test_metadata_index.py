@@ -0,0 +1,143 @@
+import os
+import struct
+from types import SimpleNamespace
+
+import pytsk3
+import pytest
+
+from fastir.common.metadata_index import MetadataIndex, parse_mft_record
+
+
+def file_name_attribute(parent, name, namespace, parent_sequence=3):
+    content = struct.pack('<Q', parent | (parent_sequence << 48)) + b'\x00' * 0x38
+    content += struct.pack('<BB', len(name), namespace) + name.encode('utf-16-le')
+    length = (0x18 + len(content) + 7) // 8 * 8
+
+    header = struct.pack('<IIBBHHHIHBB', 0x30, length, 0, 0, 0, 0, 0, len(content), 0x18, 0, 0)
+    return (header + content).ljust(length, b'\x00')
+
+
+def mft_record(flags, attributes, base_record=0, sequence=3):
+    attributes = b''.join(attributes) + struct.pack('<I', 0xFFFFFFFF)
+    used_size = 0x38 + len(attributes)
+
+    record = bytearray(1024)
+    record[0:4] = b'FILE'
+    struct.pack_into('<HH', record, 0x04, 0x30, 3)
+    struct.pack_into('<H', record, 0x10, sequence)
+    struct.pack_into('<HHI', record, 0x14, 0x38, flags, used_size)
+    struct.pack_into('<Q', record, 0x20, base_record)
+    record[0x38:used_size] = attributes
+
+    # Store the end of each sector in the update sequence array and replace it
+    record[0x30:0x32] = b'\x42\x00'
+    for i in [1, 2]:
+        position = i * 512 - 2
+        record[0x30 + 2 * i:0x32 + 2 * i] = record[position:position + 2]
+        record[position:position + 2] = b'\x42\x00'
+
+    return bytes(record)
+
+
+def test_parse_mft_record():
+    record = mft_record(0x03, [
+        file_name_attribute(5, 'PROGRA~1', 2),
+        file_name_attribute(5, 'Program Files', 1)
+    ])
+
+    flags, sequence, base_record, names = parse_mft_record(record)
+
+    assert flags == 0x03
+    assert sequence == 3
+    assert base_record == 0
+    assert names == [(5, 3, 'Program Files')]
+
+
+def test_parse_mft_record_fixups():
+    # The name spans over the end of the first sector, which must be restored
+    padding = struct.pack('<II', 0x10, 360) + b'\x00' * 352
+    record = mft_record(0x01, [padding, file_name_attribute(42, 'a_long_file_name.txt', 3)])
+
+    assert parse_mft_record(record)[3] == [(42, 3, 'a_long_file_name.txt')]
+
+
+def test_parse_invalid_mft_record():
+    record = bytearray(mft_record(0x01, [file_name_attribute(5, 'test', 1)]))
+    assert parse_mft_record(b'BAAD' + bytes(record[4:])) is None
+
+    # Corrupted update sequence
+    record[510:512] = b'\x00\x00'
+    assert parse_mft_record(bytes(record)) is None
+
+
+def test_parse_extension_record():
+    record = mft_record(0x01, [file_name_attribute(5, 'test', 1)], base_record=(1 << 48) | 27)
+    assert parse_mft_record(record)[2] == 27
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+        self.info = SimpleNamespace(meta=SimpleNamespace(size=len(data)))
+
+    def read_random(self, offset, size):
+        return self.data[offset:offset + size]
+
+
+def fake_ntfs(records):
+    """TSK filesystem whose $MFT holds these records, with 1024 bytes records"""
+    boot = bytearray(512)
+    struct.pack_into('<HB', boot, 0x0B, 512, 8)
+    struct.pack_into('<b', boot, 0x40, -10)
+
+    files = {0: FakeFile(b''.join(records)), 7: FakeFile(bytes(boot))}
+
+    return SimpleNamespace(
+        info=SimpleNamespace(root_inum=5, ftype=pytsk3.TSK_FS_TYPE_NTFS),
+        open_meta=lambda inode: files[inode])
+
+
+def test_mft_index():
+    records = [b'\x00' * 1024] * 5 + [
+        # 5: root directory, 6: directory, 7: file in the root, 8: file in the directory
+        mft_record(0x03, [file_name_attribute(5, '.', 1)], sequence=5),
+        mft_record(0x03, [file_name_attribute(5, 'directory', 1, parent_sequence=5)]),
+        mft_record(0x01, [file_name_attribute(5, 'root.txt', 1, parent_sequence=5)]),
+        mft_record(0x01, [file_name_attribute(6, 'file.txt', 1)]),
+        # 9: file created in a previous directory of record 6, before it was reused
+        mft_record(0x01, [file_name_attribute(6, 'orphan.txt', 1, parent_sequence=2)]),
+    ]
+    fs_info = fake_ntfs(records)
+
+    assert MetadataIndex.supported(fs_info)
+    index = MetadataIndex.build(fs_info)
+
+    assert sorted(index.children(5)) == [
+        ('directory', 6, pytsk3.TSK_FS_META_TYPE_DIR), ('root.txt', 7, pytsk3.TSK_FS_META_TYPE_REG)]
+    assert index.children(6) == [('file.txt', 8, pytsk3.TSK_FS_META_TYPE_REG)]
+    assert index.entries == 3
+
+
+@pytest.fixture
+def fs_info():
+    img_info = pytsk3.Img_Info(os.path.join(os.path.dirname(__file__), 'data', 'image.raw'))
+    return pytsk3.FS_Info(img_info)
+
+
+def test_index_not_supported(fs_info):
+    # The test image is an ext4 filesystem, without a name table to read in a single pass
+    assert not MetadataIndex.supported(fs_info)
+
+
+def test_ntfs_index():
+    img_info = pytsk3.Img_Info(os.path.join(os.path.dirname(__file__), 'data', 'ntfs.raw'))
+    fs_info = pytsk3.FS_Info(img_info)
+
+    assert MetadataIndex.supported(fs_info)
+    index = MetadataIndex.build(fs_info)
+
+    # The deleted file is not indexed
+    assert sorted(name for name, _, _ in index.children(5)) == [
+        '$Bitmap', '$Boot', '$MFT', '$MFTMirr', '$Volume', 'a_directory', 'passwords.txt']
+    assert sorted(index.children(16)) == [
+        ('a_file', 18, pytsk3.TSK_FS_META_TYPE_REG), ('another_file', 19, pytsk3.TSK_FS_META_TYPE_REG)]
@@ -1,7 +1,9 @@
 import os
+from unittest.mock import patch, Mock
 
 import pytest
 
+from fastir.common.deadline import Deadline
 from fastir.common.filesystem import OSFileSystem
 
 
@@ -108,3 +110,120 @@ def test_path_resolution_recursive_star_root(fs_test, outputs):
 def test_is_symlink(fs_test):
     path_object = fs_test.get_fullpath(fp('root.txt'))
     assert path_object.is_symlink() is False
+
+
+def test_duplicate_patterns(fs_test, outputs):
+    # Identical patterns (e.g. produced by variable expansion) are only resolved once
+    fs_test.add_pattern('TestArtifact', fp('l1/l2/l2.txt'))
+    fs_test.add_pattern('TestArtifact', fp('l1/l2/l2.txt'))
+    fs_test.collect(outputs)
+
+    assert resolved_paths(outputs) == ['l1/l2/l2.txt']
+
+
+def test_shared_directory_listing(fs_test, outputs):
+    fs_test.add_pattern('TestArtifact', fp('*.txt'))
+    fs_test.add_pattern('TestArtifact', fp('root*'))
+    fs_test.add_pattern('TestArtifact', fp('l1/*.txt'))
+    fs_test.add_pattern('TestArtifact', fp('l1/l2/*.txt'))
+
+    with patch.object(OSFileSystem, 'list_directory', autospec=True, side_effect=OSFileSystem.list_directory) as listing:
+        fs_test.collect(outputs)
+
+    assert sorted(resolved_paths(outputs)) == [
+        'l1/l1.txt', 'l1/l2/l2.txt', 'root.txt', 'root.txt', 'root2.txt', 'root2.txt', 'test.txt']
+
+    # Each directory is listed once for all patterns
+    listed = [os.path.relpath(call[0][1].path, FS_ROOT) for call in listing.call_args_list]
+    assert sorted(listed) == ['.', 'l1', os.path.join('l1', 'l2')]
+
+
+def test_list_directory_types(fs_test):
+    entries = {path.name: path for path in fs_test.get_fullpath(fp('l1')).list_directory()}
+
+    # Types come from the directory listing, without any additional stat
+    with patch('os.path.isdir', side_effect=AssertionError), patch('os.path.isfile', side_effect=AssertionError):
+        assert entries['l2'].is_directory()
+        assert not entries['l2'].is_file()
+        assert entries['l1.txt'].is_file()
+        assert entries['l1.txt'].get_size() == os.path.getsize(fp('l1/l1.txt'))
+
+
+def test_list_missing_directory(fs_test):
+    assert fs_test.get_fullpath(fp('missing')).list_directory() == []
+
+
+def test_read_all_chunks(temp_dir):
+    filepath = os.path.join(temp_dir, 'content.txt')
+    content = b'some content spanning several chunks'
+
+    with open(filepath, 'wb') as f:
+        f.write(content)
+
+    # Files bigger than a chunk must be read entirely
+    with patch('fastir.common.filesystem.CHUNK_SIZE', 8):
+        chunks = list(OSFileSystem('/').get_fullpath(filepath).read_chunks())
+
+    assert len(chunks) == 5
+    assert b''.join(chunks) == content
+
+
+def test_deadline_schedule_by_cost(temp_dir, outputs):
+    for name, size in [('big.txt', 300), ('small.txt', 100), ('medium.txt', 200)]:
+        with open(os.path.join(temp_dir, name), 'wb') as f:
+            f.write(b'x' * size)
+
+    filesystem = OSFileSystem(temp_dir)
+    filesystem.add_pattern('TestArtifact', os.path.join(temp_dir, '*.txt'))
+
+    outputs.deadline = Deadline(60)
+    filesystem.collect(outputs)
+
+    # The cheapest files are collected first
+    assert [os.path.basename(call[0][1].path) for call in outputs.add_collected_file.call_args_list] == [
+        'small.txt', 'medium.txt', 'big.txt']
+
+
+def test_deadline_schedule_in_batches(fs_test):
+    enumerated = []
+
+    def matches():
+        for size in [3, 1, 4, 2, 0]:
+            enumerated.append(size)
+            yield Mock(get_size=Mock(return_value=size)), []
+
+    with patch('fastir.common.filesystem.SCHEDULE_BATCH_SIZE', 2):
+        scheduled = fs_test._schedule_by_cost(matches())
+
+        # Only the first batch is enumerated before collecting its cheapest path
+        assert next(scheduled)[0].get_size() == 1
+        assert enumerated == [3, 1]
+
+        assert [path.get_size() for path, _ in scheduled] == [3, 2, 4, 0]
+
+
+def test_deadline_skips_pending_patterns(fs_test, outputs):
+    fs_test.add_pattern('TestArtifact', fp('root.txt'))
+    fs_test.add_pattern('TestArtifact', fp('l1/**'))
+
+    # The deadline is reached once the first file is collected
+    outputs.deadline = Deadline(60)
+    outputs.add_collected_file.side_effect = lambda *args: setattr(outputs.deadline, '_end', 0)
+
+    with patch('fastir.common.filesystem.SCHEDULE_BATCH_SIZE', 1):
+        with patch.object(outputs, 'add_skipped') as add_skipped:
+            fs_test.collect(outputs)
+
+    assert resolved_paths(outputs) == ['root.txt']
+    add_skipped.assert_called_once_with('TestArtifact', 'FILE', fp('l1/**'), 'deadline (incomplete enumeration)')
+
+
+def test_deadline_expired_enumeration(fs_test, outputs):
+    fs_test.add_pattern('TestArtifact', fp('**'))
+
+    outputs.deadline = Deadline(0)
+    with patch.object(outputs, 'add_skipped') as add_skipped:
+        fs_test.collect(outputs)
+
+    assert resolved_paths(outputs) == []
+    add_skipped.assert_called_once_with('TestArtifact', 'FILE', fp('**'), 'deadline (incomplete enumeration)')
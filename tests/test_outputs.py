@@ -5,10 +5,13 @@ import json
 import pytest
 import platform
 from zipfile import ZipFile
+from unittest.mock import patch
 
 from jsonlines import Reader
 
 from fastir.common.logging import logger
+from fastir.common.deadline import Deadline
+from fastir.common.commands import CommandResult
 from fastir.common.filesystem import OSFileSystem
 from fastir.common.output import parse_human_size, normalize_filepath, Outputs
 
@@ -143,17 +146,33 @@ def test_collect_file_size_filter(temp_dir, test_file):
     assert b"test_big_file.txt' because of its size" in logs
 
 
+def results_records(dirpath, result_type):
+    with Reader(output_file_content(dirpath, f'*-{result_type}.jsonl').splitlines()) as jsonl:
+        return list(jsonl)
+
+
+def collect_command(output, artifact, command, content):
+    result = CommandResult(output.command_output_name(artifact))
+    result.returncode = 0
+    result.size = len(content)
+
+    with output.open_command_output(result.output_file) as out:
+        out.write(content)
+
+    output.add_collected_command_output(artifact, command, result)
+
+    return result
+
+
 def test_collect_command(temp_dir):
     output = Outputs(temp_dir, None, False)
-    output.add_collected_command('TestArtifact', 'command', b'output')
+    result = collect_command(output, 'TestArtifact', 'command', b'output')
     output.close()
 
-    commands = json.loads(output_file_content(temp_dir, '*-commands.json'))
-    assert commands == {
-        'TestArtifact': {
-            'command': 'output'
-        }
-    }
+    assert results_records(temp_dir, 'commands') == [
+        {'artifact': 'TestArtifact', 'command': 'command', 'output_file': result.output_file, 'returncode': 0}
+    ]
+    assert output_file_content(temp_dir, result.output_file) == b'output'
 
 
 def test_collect_wmi(temp_dir):
@@ -161,12 +180,9 @@ def test_collect_wmi(temp_dir):
     output.add_collected_wmi('TestArtifact', 'query', 'output')
     output.close()
 
-    wmi = json.loads(output_file_content(temp_dir, '*-wmi.json'))
-    assert wmi == {
-        'TestArtifact': {
-            'query': 'output'
-        }
-    }
+    assert results_records(temp_dir, 'wmi') == [
+        {'artifact': 'TestArtifact', 'query': 'query', 'output': 'output'}
+    ]
 
 
 def test_collect_registry(temp_dir):
@@ -174,6 +190,42 @@ def test_collect_registry(temp_dir):
     output.add_collected_registry_value('TestArtifact', 'key', 'name', 'value', 'type')
     output.close()
 
+    assert results_records(temp_dir, 'registry') == [
+        {'artifact': 'TestArtifact', 'key': 'key', 'name': 'name', 'value': 'value', 'type': 'type'}
+    ]
+
+
+def test_results_written_immediately(temp_dir):
+    output = Outputs(temp_dir, None, False)
+    collect_command(output, 'TestArtifact', 'command', b'output')
+
+    assert len(results_records(temp_dir, 'commands')) == 1
+
+    output.close()
+
+
+def test_legacy_json(temp_dir):
+    output = Outputs(temp_dir, None, False, legacy_json=True)
+    collect_command(output, 'TestArtifact', 'command', b'output')
+    output.add_collected_wmi('TestArtifact', 'query', 'output')
+    output.add_collected_registry_value('TestArtifact', 'key', 'name', 'value', 'type')
+    output.add_collected_registry_value('TestArtifact', 'key', 'name2', 'value2', 'type2')
+    output.close()
+
+    commands = json.loads(output_file_content(temp_dir, '*-commands.json'))
+    assert commands == {
+        'TestArtifact': {
+            'command': 'output'
+        }
+    }
+
+    wmi = json.loads(output_file_content(temp_dir, '*-wmi.json'))
+    assert wmi == {
+        'TestArtifact': {
+            'query': 'output'
+        }
+    }
+
     registry = json.loads(output_file_content(temp_dir, '*-registry.json'))
     assert registry == {
         'TestArtifact': {
@@ -181,7 +233,370 @@ def test_collect_registry(temp_dir):
                 'name': {
                     'value': 'value',
                     'type': 'type'
+                },
+                'name2': {
+                    'value': 'value2',
+                    'type': 'type2'
                 }
             }
         }
     }
+
+    outdir = glob.glob(os.path.join(temp_dir, f'*-{platform.node()}'))[0]
+    assert not glob.glob(os.path.join(outdir, '*.jsonl'))
+
+
+def manifest_records(dirpath):
+    with Reader(output_file_content(dirpath, '*-manifest.jsonl').splitlines()) as jsonl:
+        return list(jsonl)
+
+
+def test_collect_file_twice(temp_dir, test_file):
+    output = Outputs(temp_dir, None, False)
+    output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.add_collected_file('TestArtifact2', OSFileSystem('/').get_fullpath(test_file))
+    output.close()
+
+    zipfile = ZipFile(io.BytesIO(output_file_content(temp_dir, '*-files.zip')))
+    assert len(zipfile.namelist()) == 1
+
+    records = manifest_records(temp_dir)
+    assert [record['artifact'] for record in records] == ['TestArtifact', 'TestArtifact2']
+    assert records[0]['member'] == records[1]['member'] == zipfile.namelist()[0]
+    assert records[0]['size'] == 14
+
+
+@pytest.fixture
+def duplicate_files(temp_dir):
+    original = os.path.join(temp_dir, 'original.txt')
+    copy = os.path.join(temp_dir, 'copy.txt')
+    link = os.path.join(temp_dir, 'link.txt')
+    other = os.path.join(temp_dir, 'other.txt')
+
+    for filepath, content in [(original, 'content'), (copy, 'content'), (other, 'other content')]:
+        with open(filepath, 'w') as f:
+            f.write(content)
+
+    os.link(original, link)
+
+    return [original, link, copy, other]
+
+
+@pytest.mark.parametrize('deduplicate', [True, False])
+def test_collect_file_deduplication(temp_dir, duplicate_files, deduplicate):
+    output_dir = os.path.join(temp_dir, 'output')
+    output = Outputs(output_dir, None, False, deduplicate)
+
+    with patch.object(OSFileSystem, 'read_chunks', autospec=True, side_effect=OSFileSystem.read_chunks) as read:
+        for filepath in duplicate_files:
+            output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(filepath))
+
+    output.close()
+
+    zipfile = ZipFile(io.BytesIO(output_file_content(output_dir, '*-files.zip')))
+    records = {os.path.basename(record['path']): record for record in manifest_records(output_dir)}
+
+    assert zipfile.testzip() is None
+
+    if deduplicate:
+        # The hard link is not even read
+        assert read.call_count == 3
+        assert sorted(os.path.basename(name) for name in zipfile.namelist()) == ['original.txt', 'other.txt']
+        assert records['link.txt']['member'] == records['original.txt']['member']
+        assert records['copy.txt']['member'] == records['original.txt']['member']
+        assert records['copy.txt']['deduplicated'] is True
+        assert records['copy.txt']['sha256'] == records['original.txt']['sha256']
+        assert zipfile.read(records['original.txt']['member']) == b'content'
+        assert zipfile.read(records['other.txt']['member']) == b'other content'
+    else:
+        assert read.call_count == 4
+        assert len(zipfile.namelist()) == 4
+        assert 'deduplicated' not in records['copy.txt']
+
+
+def test_read_once(temp_dir, test_pe_file):
+    output = Outputs(temp_dir, None, True)
+
+    with patch.object(OSFileSystem, 'read_chunks', autospec=True, side_effect=OSFileSystem.read_chunks) as read:
+        with output.read_once(test_pe_file):
+            output.add_collected_file('TestArtifact', test_pe_file)
+            output.add_collected_file_info('TestArtifact2', test_pe_file)
+            output.add_collected_file_info('TestArtifact3', test_pe_file)
+
+    output.close()
+
+    # The file is read once for the archive, its SHA-256 and both file info
+    assert read.call_count == 1
+
+    sha256 = "8094af5ee310714caebccaeee7769ffb08048503ba478b879edfef5f1a24fefe"
+    logs = output_file_content(temp_dir, '*-logs.txt')
+    assert f"MSVCR71.dll' has SHA-256 '{sha256}'".encode() in logs
+
+    zipfile = ZipFile(io.BytesIO(output_file_content(temp_dir, '*-files.zip')))
+    with open(test_pe_file.path, 'rb') as f:
+        assert zipfile.read(zipfile.namelist()[0]) == f.read()
+
+    with Reader(output_file_content(temp_dir, '*-file_info.jsonl').splitlines()) as jsonl:
+        records = list(jsonl)
+
+    assert [record['labels']['artifact'] for record in records] == ['TestArtifact2', 'TestArtifact3']
+    for record in records:
+        assert record['file']['hash']['md5'] == "86f1895ae8c5e8b17d99ece768a70732"
+        assert record['file']['hash']['sha256'] == sha256
+        assert record['file']['pe']['imphash'] == "7acc8c379c768a1ecd81ec502ff5f33e"
+
+
+def test_read_once_error(temp_dir, test_file):
+    output = Outputs(temp_dir, None, False)
+    path_object = OSFileSystem('/').get_fullpath(test_file)
+
+    with patch.object(OSFileSystem, 'read_chunks', side_effect=OSError('read error')):
+        with pytest.raises(OSError):
+            with output.read_once(path_object):
+                output.add_collected_file('TestArtifact', path_object)
+                output.add_collected_file_info('TestArtifact', path_object)
+
+    # Other files can still be collected
+    output.add_collected_file_info('TestArtifact', path_object)
+    output.close()
+
+    with Reader(output_file_content(temp_dir, '*-file_info.jsonl').splitlines()) as jsonl:
+        assert len(list(jsonl)) == 1
+
+
+def failing_read(*args, **kwargs):
+    yield b'partial'
+    raise OSError('read error')
+
+
+def test_partial_member_discarded(temp_dir, test_file):
+    output = Outputs(temp_dir, None, False)
+    path_object = OSFileSystem('/').get_fullpath(test_file)
+
+    with patch.object(OSFileSystem, 'read_chunks', failing_read):
+        with pytest.raises(OSError):
+            output.add_collected_file('TestArtifact', path_object)
+
+    assert not output.is_archived(path_object)
+
+    # The file is read again, instead of referencing the partial content
+    output.add_collected_file('TestArtifact2', path_object)
+    assert output.is_archived(path_object)
+    output.close()
+
+    zipfile = ZipFile(io.BytesIO(output_file_content(temp_dir, '*-files.zip')))
+    assert len(zipfile.namelist()) == 1
+    assert zipfile.read(zipfile.namelist()[0]) == b'MZtest content'
+
+    records = manifest_records(temp_dir)
+    assert [record['artifact'] for record in records] == ['TestArtifact2']
+
+
+def test_file_info_cache(temp_dir, test_pe_file):
+    cache = os.path.join(temp_dir, 'cache', 'file_info.jsonl')
+    records = []
+
+    for run in range(2):
+        output_dir = os.path.join(temp_dir, f'output{run}')
+        output = Outputs(output_dir, None, False, file_info_cache=cache)
+
+        with patch.object(OSFileSystem, 'read_chunks', autospec=True, side_effect=OSFileSystem.read_chunks) as read:
+            assert output.has_cached_file_info(test_pe_file) == (run == 1)
+            output.add_collected_file_info('TestArtifact', test_pe_file)
+
+        output.close()
+
+        # The unchanged file is only read during the first run
+        assert read.call_count == (1 - run)
+
+        with Reader(output_file_content(output_dir, '*-file_info.jsonl').splitlines()) as jsonl:
+            records.append(jsonl.read())
+
+    for record in records:
+        del record['@timestamp']
+
+    assert records[0] == records[1]
+    assert records[1]['file']['pe']['imphash'] == "7acc8c379c768a1ecd81ec502ff5f33e"
+
+
+def test_file_info_cache_changed_file(temp_dir, test_file):
+    cache = os.path.join(temp_dir, 'file_info.jsonl')
+
+    output = Outputs(os.path.join(temp_dir, 'output0'), None, False, file_info_cache=cache)
+    output.add_collected_file_info('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.close()
+
+    with open(test_file, 'w') as f:
+        f.write('MZnew content')
+
+    output = Outputs(os.path.join(temp_dir, 'output1'), None, False, file_info_cache=cache)
+    output.add_collected_file_info('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.close()
+
+    with Reader(output_file_content(os.path.join(temp_dir, 'output1'), '*-file_info.jsonl').splitlines()) as jsonl:
+        record = jsonl.read()
+
+    assert record['file']['hash']['md5'] != "10dbf3e392abcc57f8fae061c7c0aeec"
+
+
+def test_archive_volumes(temp_dir, duplicate_files):
+    output_dir = os.path.join(temp_dir, 'output')
+    output = Outputs(output_dir, None, True, deduplicate=True, volume_members=1)
+    outdir = glob.glob(os.path.join(output_dir, f'*-{platform.node()}'))[0]
+
+    output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(duplicate_files[0]))
+
+    # The first volume is complete as soon as its member is written
+    with ZipFile(glob.glob(os.path.join(outdir, '*-files-001.zip'))[0]) as zipfile:
+        assert 'fastir-index.jsonl' in zipfile.namelist()
+
+    for filepath in duplicate_files[1:] + [duplicate_files[0]]:
+        output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(filepath))
+
+    output.close()
+
+    volumes = sorted(glob.glob(os.path.join(outdir, '*-files-*.zip')))
+    records = manifest_records(output_dir)
+
+    # copy is deduplicated, and discarded from the second volume
+    assert [os.path.basename(volume)[-8:] for volume in volumes] == ['-001.zip', '-002.zip']
+    assert len(records) == 5
+
+    for volume in volumes:
+        with ZipFile(volume) as zipfile:
+            assert zipfile.testzip() is None
+
+            # Each volume lists the files it holds
+            with Reader(zipfile.read('fastir-index.jsonl').splitlines()) as jsonl:
+                index = list(jsonl)
+
+            assert index
+            for record in index:
+                assert record['archive'] == os.path.join(os.path.basename(outdir), os.path.basename(volume))
+                assert zipfile.read(record['member']) in [b'content', b'other content']
+
+    # Every record points to the volume holding its content
+    for record in records:
+        with ZipFile(os.path.join(output_dir, record['archive'])) as zipfile:
+            assert record['member'] in zipfile.namelist()
+
+
+def test_differential_collection(temp_dir, duplicate_files):
+    original, _, copy, other = duplicate_files
+
+    output = Outputs(os.path.join(temp_dir, 'output0'), None, True)
+    for filepath in [original, copy, other]:
+        output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(filepath))
+    output.close()
+
+    previous = glob.glob(os.path.join(temp_dir, 'output0', '*', '*-manifest.jsonl'))[0]
+
+    # Same size, different timestamps
+    os.utime(copy, ns=(0, 0))
+
+    # Different size
+    with open(other, 'w') as f:
+        f.write('changed')
+
+    output_dir = os.path.join(temp_dir, 'output1')
+    output = Outputs(output_dir, None, False, previous_manifest=previous)
+
+    with patch.object(OSFileSystem, 'read_chunks', autospec=True, side_effect=OSFileSystem.read_chunks) as read:
+        for filepath in [original, copy, other]:
+            output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(filepath))
+
+    output.close()
+
+    # The unchanged file is not read, the ambiguous one is hashed
+    assert read.call_count == 2
+
+    zipfile = ZipFile(io.BytesIO(output_file_content(output_dir, '*-files.zip')))
+    records = {os.path.basename(record['path']): record for record in manifest_records(output_dir)}
+
+    assert [os.path.basename(name) for name in zipfile.namelist()] == ['other.txt']
+    assert zipfile.read(records['other.txt']['member']) == b'changed'
+    assert 'unchanged' not in records['other.txt']
+
+    for name in ['original.txt', 'copy.txt']:
+        assert records[name]['unchanged'] is True
+        assert records[name]['archive'].endswith('-files.zip')
+        assert records[name]['archive'].startswith(os.path.basename(os.path.dirname(previous)))
+
+    assert records['copy.txt']['mtime'] == 0
+
+
+def test_differential_collection_twice(temp_dir, test_file):
+    output = Outputs(os.path.join(temp_dir, 'output0'), None, True)
+    output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.add_collected_file('TestArtifact2', OSFileSystem('/').get_fullpath(test_file))
+    output.close()
+
+    # Every record of the file has its hash, the last one is used by the next run
+    previous_records = manifest_records(os.path.join(temp_dir, 'output0'))
+    assert previous_records[0]['sha256'] == previous_records[1]['sha256']
+
+    previous = glob.glob(os.path.join(temp_dir, 'output0', '*', '*-manifest.jsonl'))[0]
+
+    # Same size, different timestamps
+    os.utime(test_file, ns=(0, 0))
+
+    output_dir = os.path.join(temp_dir, 'output1')
+    output = Outputs(output_dir, None, False, previous_manifest=previous)
+    output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.close()
+
+    # The file is hashed and found unchanged, it is not archived again
+    zipfile = ZipFile(io.BytesIO(output_file_content(output_dir, '*-files.zip')))
+    records = manifest_records(output_dir)
+
+    assert zipfile.namelist() == []
+    assert records[0]['unchanged'] is True
+    assert records[0]['sha256'] == previous_records[0]['sha256']
+
+
+def test_deadline(temp_dir, test_file):
+    output = Outputs(temp_dir, None, False)
+    path_object = OSFileSystem('/').get_fullpath(test_file)
+
+    output.deadline = Deadline(60)
+    with patch.object(Deadline, 'throughput', return_value=1):
+        # 14 bytes at 1 byte per second would take longer than 10 seconds
+        with patch.object(Deadline, 'remaining', return_value=10):
+            output.add_collected_file('TestArtifact', path_object)
+
+        output.add_collected_file_info('TestArtifact', path_object)
+
+    output.deadline = Deadline(0)
+    output.add_collected_file('TestArtifact2', path_object)
+    output.close()
+
+    assert results_records(temp_dir, 'skipped') == [
+        {'artifact': 'TestArtifact', 'type': 'FILE', 'item': test_file, 'reason': 'not enough time before deadline'},
+        {'artifact': 'TestArtifact2', 'type': 'FILE', 'item': test_file, 'reason': 'deadline'}
+    ]
+
+    with Reader(output_file_content(temp_dir, '*-file_info.jsonl').splitlines()) as jsonl:
+        assert len(list(jsonl)) == 1
+
+
+def test_metrics(temp_dir, test_file):
+    output = Outputs(temp_dir, None, False)
+    fs = OSFileSystem('/')
+    fs.add_pattern('TestArtifact', os.path.join(temp_dir, '*.txt'))
+    fs.collect(output)
+    output.add_collected_wmi('WMIArtifact', 'SELECT * FROM Win32_Test', [{'Name': 'test'}])
+    output.close()
+
+    metrics = json.loads(output_file_content(temp_dir, '*-metrics.json'))
+
+    artifact = metrics['artifacts']['TestArtifact']
+    assert artifact['files_collected'] == 1
+    assert artifact['bytes_read'] == os.path.getsize(test_file)
+    assert artifact['bytes_written'] > 0
+    assert metrics['artifacts']['WMIArtifact']['wmi_queries'] == 1
+
+    pattern = metrics['patterns'][os.path.join(temp_dir, '*.txt')]
+    assert pattern['artifacts'] == ['TestArtifact']
+    assert pattern['files_matched'] == 1
+    assert pattern['directories_listed'] >= 1
+    assert pattern['entries_examined'] >= 1
@@ -0,0 +1,75 @@
+import os
+import json
+
+import pytest
+from artifacts.artifact import ArtifactDefinition
+from artifacts.definitions import TYPE_INDICATOR_COMMAND
+
+from fastir.common.plan import Planner
+from fastir.common.collector import Collector
+from fastir.common.filesystem import OSFileSystem, FILE_INFO_TYPE
+from fastir.common.helpers import get_operating_system
+
+
+@pytest.fixture
+def texts(temp_dir):
+    paths = []
+
+    for name, size in [('a.txt', 10), ('b.txt', 20), ('c.txt', 30)]:
+        path = os.path.join(temp_dir, name)
+        paths.append(path)
+
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+    return paths
+
+
+def test_planner_files(temp_dir, texts):
+    planner = Planner(sample_size=1)
+    fs = OSFileSystem('/')
+    fs.add_pattern('Texts', os.path.join(temp_dir, '*.txt'))
+    fs.add_pattern('First', texts[0])
+    fs.add_pattern('FirstInfo', texts[0], FILE_INFO_TYPE)
+    fs.collect(planner)
+
+    plan = planner.to_dict()
+
+    assert plan['artifacts']['Texts'] == dict(plan['artifacts']['Texts'], files=3, bytes=60)
+    assert plan['artifacts']['First'] == dict(plan['artifacts']['First'], files=1, bytes=10)
+    assert plan['artifacts']['FirstInfo']['file_info'] == 1
+
+    # Files collected for several artifacts are only read once
+    assert plan['files'] == 3
+    assert plan['bytes'] == 60
+    assert plan['read_throughput_measured']
+
+
+def test_planner_maxsize(temp_dir, texts):
+    planner = Planner(maxsize='15')
+    fs = OSFileSystem('/')
+    fs.add_pattern('Texts', os.path.join(temp_dir, '*.txt'))
+    fs.collect(planner)
+
+    plan = planner.to_dict()
+
+    assert plan['files'] == 1
+    assert plan['artifacts']['Texts']['too_large'] == 2
+
+
+def test_collector_plan(temp_dir, fake_partitions):
+    artifact = ArtifactDefinition('EchoCommand')
+    artifact.AppendSource(TYPE_INDICATOR_COMMAND, {'cmd': 'touch', 'args': [os.path.join(temp_dir, 'created')]})
+
+    collector = Collector(get_operating_system())
+    collector.register_source(artifact, artifact.sources[0])
+
+    plan_path = os.path.join(temp_dir, 'plan.json')
+    collector.plan(Planner(), plan_path)
+
+    with open(plan_path) as f:
+        plan = json.load(f)
+
+    # Commands are counted, not run
+    assert plan['totals']['commands'] == 1
+    assert not os.path.exists(os.path.join(temp_dir, 'created'))
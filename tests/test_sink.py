@@ -0,0 +1,110 @@
+import os
+import sys
+import glob
+import socket
+import platform
+import threading
+from zipfile import ZipFile
+
+import pytest
+from jsonlines import Reader
+
+from fastir.common.commands import CommandExecutor
+from fastir.common.filesystem import OSFileSystem
+from fastir.common.output import Outputs
+from fastir.common.sink import StreamSink, receive
+
+
+@pytest.fixture
+def test_file(temp_dir):
+    test_file = os.path.join(temp_dir, 'test_file.txt')
+
+    with open(test_file, 'wb') as f:
+        f.write(os.urandom(3 * 1024 * 1024))
+
+    return test_file
+
+
+@pytest.fixture
+def received(temp_dir):
+    """Stream connected to a receiver recreating the outputs in a directory"""
+    sender, receiver = socket.socketpair()
+    dirpath = os.path.join(temp_dir, 'received')
+    results = {}
+
+    def run():
+        with receiver, receiver.makefile('rb') as stream:
+            results['files'] = receive(stream, dirpath)
+
+    def wait():
+        thread.join(timeout=10)
+        return results.get('files')
+
+    thread = threading.Thread(target=run)
+    thread.start()
+
+    with sender:
+        yield sender.makefile('wb'), dirpath, wait
+
+    thread.join(timeout=10)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires POSIX commands')
+def test_stream_outputs(temp_dir, test_file, test_variables, received):
+    stream, dirpath, wait = received
+
+    output = Outputs(temp_dir, None, True, stream=stream)
+    output.add_collected_file('TestArtifact', OSFileSystem('/').get_fullpath(test_file))
+    output.add_collected_wmi('TestArtifact', 'query', [{'a': 1}])
+
+    collector = CommandExecutor(workers=2)
+    collector.add_command('TestCommand', 'echo', ['test'])
+    collector.collect(output)
+    output.close()
+
+    assert len(wait()) == 7
+
+    # Nothing is written locally
+    assert sorted(os.listdir(temp_dir)) == ['received', 'test_file.txt']
+
+    outdir = glob.glob(os.path.join(dirpath, f'*-{platform.node()}'))[0]
+    prefix = os.path.join(outdir, platform.node())
+
+    with ZipFile(f'{prefix}-files.zip') as archive:
+        member = archive.namelist()[0]
+
+        with open(test_file, 'rb') as f:
+            assert archive.read(member) == f.read()
+
+    with Reader(open(f'{prefix}-manifest.jsonl')) as manifest:
+        assert [record['artifact'] for record in manifest] == ['TestArtifact']
+
+    with Reader(open(f'{prefix}-wmi.jsonl')) as records:
+        assert list(records)[0]['output'] == [{'a': 1}]
+
+    with Reader(open(f'{prefix}-commands.jsonl')) as records:
+        record = list(records)[0]
+
+    with open(os.path.join(outdir, record['output_file']), 'rb') as f:
+        assert f.read() == b'test\n'
+
+    with open(f'{prefix}-logs.txt') as f:
+        assert "Collecting command 'echo test'" in f.read()
+
+    assert os.path.exists(f'{prefix}-metrics.json')
+
+
+def test_receive_rejects_paths_outside_directory(temp_dir):
+    sender, receiver = socket.socketpair()
+
+    with sender, sender.makefile('wb') as stream:
+        sink = StreamSink(stream, '..')
+        with sink.open('evil.txt') as f:
+            f.write(b'test')
+        sink.close()
+
+        with receiver, receiver.makefile('rb') as stream:
+            with pytest.raises(ValueError):
+                receive(stream, os.path.join(temp_dir, 'received'))
+
+    assert not os.path.exists(os.path.join(temp_dir, 'evil.txt'))
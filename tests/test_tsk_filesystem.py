@@ -2,7 +2,8 @@ import os
 
 import pytest
 
-from fastir.common.filesystem import TSKFileSystem
+from fastir.common.filesystem import TSKFileSystem, TSKIndexedPathObject
+from fastir.common.path_components import PartialPathObject
 
 
 @pytest.fixture
@@ -68,3 +69,134 @@ uber secret laire,admin,admin
 def test_get_size(fs_test):
     path_object = fs_test.get_fullpath('/passwords.txt')
     assert path_object.get_size() == 116
+
+
+def test_get_path_not_a_directory(fs_test):
+    path_object = fs_test.get_fullpath('/passwords.txt')
+
+    assert path_object.list_directory() == []
+    assert path_object.get_path('child') is None
+
+
+def test_directory_cache(fs_test, outputs):
+    fs_test.add_pattern('TestArtifact', '/a_directory/a_file')
+    fs_test.add_pattern('TestArtifact2', '/a_directory/another_file')
+    fs_test.add_pattern('TestArtifact3', '/a_directory/*')
+    fs_test.collect(outputs)
+
+    # The root and 'a_directory' are each read once
+    stats = fs_test.cache_stats()
+    assert stats['misses'] == 2
+    assert stats['directories'] == 2
+
+
+@pytest.fixture
+def fs_indexed():
+    return TSKFileSystem(
+        None, os.path.join(os.path.dirname(__file__), 'data', 'image.raw'), '/', index=True)
+
+
+def test_indexed_resolution(fs_indexed, outputs):
+    # The test image cannot be indexed, its directories are read instead
+    assert fs_indexed._use_index is False
+
+    fs_indexed.add_pattern('TestArtifact', '/**')
+    fs_indexed.add_pattern('TestArtifact2', '/a_directory/a_file')
+    fs_indexed.collect(outputs)
+
+    paths = resolved_paths(outputs)
+    assert set(paths) == set([
+        '/a_directory/another_file',
+        '/a_directory/a_file',
+        '/passwords.txt',
+    ])
+    assert paths.count('/a_directory/a_file') == 2
+
+
+def test_indexed_read_chunks(fs_indexed):
+    path_object = fs_indexed.get_fullpath('/passwords.txt')
+
+    assert path_object.get_size() == 116
+    assert next(path_object.read_chunks()).startswith(b'place,user,password')
+
+
+@pytest.fixture
+def ntfs_image():
+    return os.path.join(os.path.dirname(__file__), 'data', 'ntfs.raw')
+
+
+def test_indexed_ntfs_resolution(ntfs_image, outputs):
+    fs_indexed = TSKFileSystem(None, ntfs_image, '/', index=True)
+    assert fs_indexed._use_index is True
+
+    fs_indexed.add_pattern('TestArtifact', '/**')
+    fs_indexed.add_pattern('TestArtifact2', '/a_directory/a_file')
+    fs_indexed.collect(outputs)
+    indexed_paths = resolved_paths(outputs)
+
+    outputs.add_collected_file.reset_mock()
+    fs_walked = TSKFileSystem(None, ntfs_image, '/')
+    fs_walked.add_pattern('TestArtifact', '/**')
+    fs_walked.add_pattern('TestArtifact2', '/a_directory/a_file')
+    fs_walked.collect(outputs)
+
+    # Deleted files should not resolve, and both methods should find the same files
+    assert sorted(indexed_paths) == sorted(resolved_paths(outputs))
+    assert set(indexed_paths) == set([
+        '/$Bitmap',
+        '/$Boot',
+        '/$MFT',
+        '/$MFTMirr',
+        '/$Volume',
+        '/a_directory/another_file',
+        '/a_directory/a_file',
+        '/passwords.txt',
+    ])
+    assert indexed_paths.count('/a_directory/a_file') == 2
+
+
+def test_indexed_ntfs_read_chunks(ntfs_image):
+    fs_indexed = TSKFileSystem(None, ntfs_image, '/', index=True)
+    path_object = fs_indexed.get_fullpath('/a_directory/passwords.txt')
+    assert path_object is None
+
+    # Indexed entries are opened from their inode when read
+    path_object = fs_indexed.get_fullpath('/passwords.txt')
+    assert isinstance(path_object, TSKIndexedPathObject)
+    assert path_object.get_size() == 116
+    assert b''.join(path_object.read_chunks()).startswith(b'place,user,password')
+
+
+def test_get_physical_offset(fs_test):
+    # passwords.txt is stored in block 22 of the test image
+    path_object = fs_test.get_fullpath('/passwords.txt')
+    assert fs_test.get_physical_offset(path_object) == 22 * 1024
+
+
+def test_read_range(fs_test):
+    path_object = fs_test.get_fullpath('/passwords.txt')
+
+    assert b''.join(path_object.read_chunks(6, 10)) == b'user'
+    assert fs_test.allocated_runs(path_object) == [(0, 116)]
+
+
+def test_partial_read(fs_test):
+    path_object = PartialPathObject(fs_test.get_fullpath('/passwords.txt'), ('tail', 12), sparse=True)
+
+    assert path_object.get_size() == 12
+    assert b''.join(path_object.read_chunks()) == b'admin,admin\n'
+    assert path_object.layout == {'file_size': 116, 'runs': [[104, 12]]}
+
+
+def test_ordered_reads(outputs):
+    fs_ordered = TSKFileSystem(
+        None, os.path.join(os.path.dirname(__file__), 'data', 'image.raw'), '/', ordered_reads=True)
+    fs_ordered.add_pattern('TestArtifact', '/**')
+    fs_ordered.collect(outputs)
+
+    # Files are collected following the order of their blocks on disk (22, 30, 31)
+    assert resolved_paths(outputs) == [
+        '/passwords.txt',
+        '/a_directory/a_file',
+        '/a_directory/another_file',
+    ]
@@ -26,3 +26,47 @@ def test_variables():
     assert variables.substitute('i_contain_%%unsupported%%_variables') == set([
         'i_contain_%%unsupported%%_variables'
     ])
+
+
+class MultiValuedVariablesForTests(HostVariables):
+
+    def init_variables(self):
+        self.add_variable('%%users.homedir%%', set(['/home/a', '/home/b']))
+        self.add_variable('%%users.sid%%', set(['S-1', 'S-2', 'S-3']))
+        self.add_variable('%systemroot%', 'C:\\Windows')
+        self.add_variable('%%environ_systemroot%%', '%SystemRoot%')
+        self.add_variable('%%users.none%%', set())
+
+
+def test_variables_cartesian_product():
+    variables = MultiValuedVariablesForTests()
+
+    assert variables.substitute('%%users.homedir%%/%%users.sid%%') == set(
+        f'{homedir}/{sid}' for homedir in ['/home/a', '/home/b'] for sid in ['S-1', 'S-2', 'S-3'])
+    assert variables.expansions['%%users.homedir%%/%%users.sid%%'] == 6
+
+    # Occurrences of the same variable share a value
+    assert variables.substitute('%%users.homedir%%:%%USERS.HOMEDIR%%') == set(['/home/a:/home/a', '/home/b:/home/b'])
+
+
+def test_variables_nested():
+    variables = MultiValuedVariablesForTests()
+
+    assert variables.substitute('%%environ_systemroot%%\\System32') == set(['C:\\Windows\\System32'])
+    assert variables.substitute('%SYSTEMROOT%\\System32') == set(['C:\\Windows\\System32'])
+
+
+def test_variables_memoized():
+    variables = MultiValuedVariablesForTests()
+
+    result = variables.substitute('%%users.homedir%%/test')
+    result.add('modified')
+
+    assert variables.substitute('%%users.homedir%%/test') == set(['/home/a/test', '/home/b/test'])
+    assert variables.expansions == {'%%users.homedir%%/test': 2}
+
+
+def test_variables_without_values():
+    variables = MultiValuedVariablesForTests()
+
+    assert variables.substitute('%%users.none%%/test') == set(['%%users.none%%/test'])